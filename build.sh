@@ -4,5 +4,10 @@ set -o errexit
 
 pip install -r requirements.txt
 
+python manage.py check --deploy --fail-level ERROR
 python manage.py collectstatic --no-input
-python manage.py migrate
\ No newline at end of file
+python manage.py migrate
+python manage.py process_images
+python manage.py refresh_leaderboards
+python manage.py build_recommendations
+python manage.py build_sitemaps
@@ -43,8 +43,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'recipes.static.WhiteNoiseMiddleware',
+    'recipes.instrumentation.InstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'recipes.db.ReplicaMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -56,16 +58,24 @@ ROOT_URLCONF = 'djangoProjectRecipe.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [BASE_DIR / 'templates']
-        ,
-        'APP_DIRS': True,
+        # DjangoTemplates con il tempo di rendering misurato per recipes.instrumentation
+        'BACKEND': 'recipes.instrumentation.TimedDjangoTemplates',
+        'DIRS': [BASE_DIR / 'templates'],
         'OPTIONS': {
+            # loader con cache anche in DEBUG: ogni template viene compilato una volta per processo
+            # (in sviluppo l'autoreload svuota la cache quando un template cambia)
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'recipes.context_processors.liked_recipes',
             ],
         },
     },
@@ -82,8 +92,52 @@ DATABASES = {
     }
 }
 
+# connessioni persistenti (secondi, 0 = una connessione per richiesta) con controllo di salute di quelle
+# rimaste inattive più di DB_HEALTH_CHECK_IDLE secondi (recipes.db). Per un vero pool condiviso tra i worker
+# si mette PgBouncer davanti a PostgreSQL e si punta DATABASE_URL su di lui.
+DB_CONN_MAX_AGE = int(os.environ.get("DB_CONN_MAX_AGE", 60))
+DB_HEALTH_CHECK_IDLE = 10
+
 database_url = os.environ.get("DATABASE_URL")
-DATABASES["default"] = dj_database_url.parse(database_url)
+DATABASES["default"] = dj_database_url.parse(database_url, conn_max_age=DB_CONN_MAX_AGE)
+
+# repliche in lettura: DATABASE_REPLICA_URLS è un elenco di URL separati da virgole (alias replica1,
+# replica2, ...). Le viste in sola lettura ci leggono; dopo una scrittura il client resta sul primario per
+# REPLICA_STICKY_SECONDS (recipes.db). In locale bastano due file SQLite e "manage.py sync_sqlite_replicas".
+DATABASE_REPLICAS = []
+for number, replica_url in enumerate(filter(None, os.environ.get("DATABASE_REPLICA_URLS", "").split(",")), 1):
+    DATABASES[f"replica{number}"] = dj_database_url.parse(replica_url.strip(), conn_max_age=DB_CONN_MAX_AGE)
+    DATABASES[f"replica{number}"]["TEST"] = {"MIRROR": "default"}
+    DATABASE_REPLICAS.append(f"replica{number}")
+DATABASE_ROUTERS = ["recipes.db.ReplicaRouter"]
+REPLICA_STICKY_SECONDS = 10
+
+# Cache (pagine anonime e card, vedi recipes.caching): CACHE_BACKEND sceglie tra memoria locale (default con
+# DEBUG), file su disco e un server compatibile Redis (default senza DEBUG). Le voci vengono invalidate dai signal
+# cambiando versione: quelle vecchie non si leggono più ma nessuno le cancella, e la scadenza di CACHE_TIMEOUT
+# secondi serve solo a liberarle (la freschezza la danno i signal). Con più processi la cache deve essere
+# condivisa: "check --deploy" fallisce con la memoria locale e avvisa se Redis non espelle le chiavi con una
+# politica LRU/LFU (con il default noeviction, a memoria piena rifiuta le scritture), vedi recipes.checks.
+CACHE_TIMEOUT = int(os.environ.get("CACHE_TIMEOUT", 24 * 60 * 60))
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "locmem" if DEBUG else "redis")
+CACHE_BACKENDS = {
+    "locmem": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+    "file": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("CACHE_LOCATION", os.path.join(BASE_DIR, "cache")),
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    },
+    "redis": {
+        "BACKEND": "recipes.cache_backends.RedisCache",
+        "LOCATION": os.environ.get("CACHE_LOCATION", "redis://localhost:6379/0"),
+    },
+}
+CACHES = {
+    "default": {**CACHE_BACKENDS[CACHE_BACKEND], "TIMEOUT": CACHE_TIMEOUT},
+}
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -118,6 +172,41 @@ USE_TZ = True
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+# i file caricati vengono salvati per hash del contenuto e cancellati quando nessuno li usa più (recipes.storage)
+DEFAULT_FILE_STORAGE = 'recipes.storage.ContentAddressedStorage'
+# senza S3 i media li serve Django (recipes.media): SERVE_MEDIA li abilita anche con DEBUG spento e
+# MEDIA_SENDFILE ('x-accel-redirect' per nginx, 'x-sendfile' per Apache) delega l'invio al server web.
+# Con nginx la location interna va dichiarata così:
+#   location /protected-media/ { internal; alias /path/to/media/; }
+SERVE_MEDIA = os.environ.get("SERVE_MEDIA", "False").lower() == "true"
+MEDIA_SENDFILE = os.environ.get("MEDIA_SENDFILE", "")
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# le immagini caricate vengono ridotte in background (recipes.tasks / recipes.images); con SQLite, che non
+# regge scritture concorrenti da altri thread, il lavoro gira nella richiesta subito dopo il commit
+BACKGROUND_TASK_WORKERS = int(os.environ.get("BACKGROUND_TASK_WORKERS", 2))
+BACKGROUND_TASKS_EAGER = os.environ.get("BACKGROUND_TASKS_EAGER", "False").lower() == "true"
+IMAGE_RENDITION_FORMAT = 'WEBP'
+# i test usano una MEDIA_ROOT temporanea (recipes.testing)
+TEST_RUNNER = 'recipes.testing.TemporaryMediaRunner'
+
+# sitemap e feed per i crawler, precalcolati in SITEMAP_ROOT da build_sitemaps (recipes.sitemaps); gli URL
+# assoluti che contengono partono da SITE_URL
+SITEMAP_ROOT = os.environ.get("SITEMAP_ROOT", os.path.join(BASE_DIR, 'sitemaps'))
+SITE_URL = os.environ.get("SITE_URL", "http://localhost:8000")
+
+# ogni quanti secondi al massimo un processo controlla nella cache se l'indice in memoria di "what can I cook"
+# è cambiato; la ricostruzione avviene in background (recipes.matching)
+INGREDIENT_INDEX_REFRESH = 30
+
+# emivita in giorni dei like nella classifica "trending" (recipes.leaderboard)
+TRENDING_HALF_LIFE_DAYS = 3
+
+# strumentazione delle richieste (recipes.instrumentation): frazione di richieste misurate e numero di
+# ripetizioni della stessa query oltre il quale una richiesta viene segnalata come N+1
+INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get("INSTRUMENTATION_SAMPLE_RATE", "1" if DEBUG else "0.05"))
+INSTRUMENTATION_N_PLUS_ONE = 5
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.2/howto/static-files/
 
@@ -156,5 +245,7 @@ AWS_S3_REGION_NAME = os.environ.get('AWS_S3_REGION_NAME', 'us-east-1')
 AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com'
 
 DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+(per tenere i file indirizzati per contenuto anche su S3 basta una classe
+ ContentAddressedMixin + S3Boto3Storage in recipes.storage, da indicare qui)
 MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/media/'
 '''
\ No newline at end of file
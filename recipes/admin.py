@@ -1,8 +1,18 @@
 from django.contrib import admin
-from recipes.models import Recipe, Category, Ingredient
+from recipes.models import Recipe, Category, Ingredient, RecipeCategory
+
 
 # Register your models here.
-admin.site.register(Recipe)
+# la M2M delle categorie ha una tabella esplicita (RecipeCategory), che l'admin modifica solo come inline
+class RecipeCategoryInline(admin.TabularInline):
+    model = RecipeCategory
+    extra = 1
+
+
+@admin.register(Recipe)
+class RecipeAdmin(admin.ModelAdmin):
+    inlines = [RecipeCategoryInline]
+
+
 admin.site.register(Category)
 admin.site.register(Ingredient)
-
@@ -0,0 +1,248 @@
+import hashlib
+
+from django.db.models import Count, F, Func, Max, Prefetch, Subquery, prefetch_related_objects
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_safe
+
+from .db import replica_reads
+from .models import LIKED_ORDERING, SUMMARY_LENGTH, Category, Ingredient, Recipe
+from .pagination import CURSOR_PARAM, KeysetPaginator
+
+# API JSON in sola lettura. Ogni risposta ha un ETag forte (e Last-Modified dove c'è un timestamp) calcolato
+# prima di costruire il corpo: se il client ha già quella versione riceve un 304 senza che le ricette vengano
+# serializzate. Le liste caricano la pagina una volta sola, nel validatore, e la vista la riusa. Le risorse
+# che non esistono non hanno validatori. ?fields=a,b limita i campi restituiti, le liste sono paginate a
+# cursore come le pagine HTML. Nomi e slug delle categorie compaiono nelle risposte: i validatori includono
+# l'ultima modifica e il numero delle categorie, letti dal database perché siano gli stessi su ogni worker.
+
+API_PAGE_SIZE = 50
+LIST_ORDERING = ('-date_posted', '-id')
+FIELDS_PARAM = 'fields'
+
+
+def _ingredients(recipe, request):
+    return [{'name': ingredient.name, 'quantity': ingredient.quantity} for ingredient in recipe.ingredient_set.all()]
+
+
+def _categories(recipe, request):
+    return [{'slug': category.slug, 'name': category.name} for category in recipe.category.all()]
+
+
+def _summary(recipe, request):
+    summary = getattr(recipe, 'summary', None)
+    return summary if summary is not None else recipe.description[:SUMMARY_LENGTH]
+
+
+RECIPE_FIELDS = {
+    'id': lambda recipe, request: recipe.pk,
+    'slug': lambda recipe, request: recipe.slug,
+    'url': lambda recipe, request: request.build_absolute_uri(reverse('apiRecipeDetail', args=[recipe.slug])),
+    'title': lambda recipe, request: recipe.title,
+    'summary': _summary,
+    'description': lambda recipe, request: recipe.description,
+    'content': lambda recipe, request: recipe.content,
+    'author': lambda recipe, request: recipe.author.username,
+    'difficulty': lambda recipe, request: recipe.difficulty,
+    'portions': lambda recipe, request: recipe.portions,
+    'cooking_time': lambda recipe, request: recipe.cooking_time,
+    'date_posted': lambda recipe, request: recipe.date_posted.isoformat(),
+    'updated_at': lambda recipe, request: recipe.updated_at.isoformat(),
+    'like_count': lambda recipe, request: recipe.like_count,
+    'image': lambda recipe, request: request.build_absolute_uri(recipe.detail_image_url),
+    'thumbnail': lambda recipe, request: request.build_absolute_uri(recipe.card_image_url),
+    'categories': _categories,
+    'ingredients': _ingredients,
+}
+LIST_FIELDS = ['id', 'slug', 'url', 'title', 'summary', 'author', 'difficulty', 'cooking_time', 'date_posted',
+               'updated_at', 'like_count', 'thumbnail']
+DETAIL_FIELDS = [field for field in RECIPE_FIELDS if field != 'summary']
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+def requested_fields(request, default):
+    value = request.GET.get(FIELDS_PARAM)
+    if not value:
+        return default
+    fields = list(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in RECIPE_FIELDS]
+    if unknown:
+        raise InvalidFields('Unknown fields: %s' % ', '.join(unknown))
+    return fields
+
+
+def recipe_queryset(queryset, fields):
+    # carica solo quello che serve ai campi richiesti; le relazioni multiple vanno in recipe_prefetches
+    if {'description', 'content'} & set(fields):
+        queryset = queryset.defer(None).select_related('author')
+    return queryset
+
+
+def recipe_prefetches(fields):
+    # una query per relazione invece di una per riga
+    lookups = []
+    if 'ingredients' in fields:
+        lookups.append(Prefetch('ingredient_set', Ingredient.objects.order_by('pk')))
+    if 'categories' in fields:
+        lookups.append(Prefetch('category', Category.objects.order_by('name')))
+    return lookups
+
+
+def serialize(recipe, fields, request):
+    return {field: RECIPE_FIELDS[field](recipe, request) for field in fields}
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+# ultima modifica e numero delle categorie (una cancellata cambia il conteggio), come annotazioni della query
+# che i validatori fanno già
+def categories_version():
+    return {
+        'categories_updated_at': Subquery(Category.objects.order_by('-updated_at').values('updated_at')[:1]),
+        'categories_count': Subquery(Category.objects.annotate(count=Func(F('pk'), function='COUNT'))
+                                     .values('count')[:1]),
+    }
+
+
+def conditional(validators):
+    # validators(request, **kwargs) -> (etag, last_modified), calcolati una volta sola per richiesta
+    def get(request, *args, **kwargs):
+        if not hasattr(request, '_api_validators'):
+            request._api_validators = validators(request, *args, **kwargs)
+        return request._api_validators
+
+    return condition(etag_func=lambda request, *args, **kwargs: get(request, *args, **kwargs)[0],
+                     last_modified_func=lambda request, *args, **kwargs: get(request, *args, **kwargs)[1])
+
+
+def api_view(view):
+    # GET/HEAD soltanto (letti da una replica), errori in JSON e niente cache intermedie senza rivalidazione
+    @require_safe
+    @cache_control(no_cache=True)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except InvalidFields as e:
+            return JsonResponse({'detail': str(e)}, status=400)
+        except Http404 as e:
+            # risorse mancanti e cursori non validi (KeysetPaginator)
+            return JsonResponse({'detail': str(e) or 'Not found.'}, status=404)
+    wrapper.__name__ = view.__name__
+    return replica_reads(wrapper)
+
+
+# liste paginate: (campi, pagina) caricata una volta per richiesta, dal validatore o dalla vista
+def _list_page(request, queryset, ordering=LIST_ORDERING):
+    if not hasattr(request, '_api_page'):
+        fields = requested_fields(request, LIST_FIELDS)
+        paginator = KeysetPaginator(recipe_queryset(queryset, fields).annotate(**categories_version()),
+                                    API_PAGE_SIZE, ordering)
+        request._api_page = fields, paginator.page(request.GET.get(CURSOR_PARAM), request.GET)
+    return request._api_page
+
+
+def _list_validators(request, queryset, ordering=LIST_ORDERING):
+    try:
+        fields, page = _list_page(request, queryset, ordering)
+    except InvalidFields:
+        return None, None
+    rows = [(recipe.pk, recipe.updated_at.timestamp(), recipe.author.username, recipe.categories_updated_at,
+             recipe.categories_count) for recipe in page]
+    last_modified = max((max(recipe.updated_at, recipe.categories_updated_at or recipe.updated_at) for recipe in page),
+                        default=None)
+    return make_etag(rows, fields, page.has_next()), last_modified
+
+
+def _list_response(request, queryset, ordering=LIST_ORDERING):
+    fields, page = _list_page(request, queryset, ordering)
+    prefetch_related_objects(page.object_list, *recipe_prefetches(fields))
+    base = request.build_absolute_uri(request.path)
+    return JsonResponse({
+        'results': [serialize(recipe, fields, request) for recipe in page],
+        'next': f'{base}?{page.next_querystring()}' if page.has_next() else None,
+        'previous': f'{base}?{page.previous_querystring()}' if page.has_previous() else None,
+    })
+
+
+@api_view
+@conditional(lambda request: _list_validators(request, Recipe.objects.for_cards()))
+def recipe_list(request):
+    return _list_response(request, Recipe.objects.for_cards())
+
+
+def _detail_validators(request, slug):
+    row = Recipe.objects.filter(slug=slug).annotate(**categories_version()).values_list(
+        'pk', 'updated_at', 'author__username', 'categories_updated_at', 'categories_count').first()
+    if row is None:
+        return None, None
+    return make_etag(row, request.GET.get(FIELDS_PARAM)), max(row[1], row[3] or row[1])
+
+
+@api_view
+@conditional(_detail_validators)
+def recipe_detail(request, slug):
+    fields = requested_fields(request, DETAIL_FIELDS)
+    queryset = recipe_queryset(Recipe.objects.select_related('author'), fields).prefetch_related(
+        *recipe_prefetches(fields))
+    recipe = get_object_or_404(queryset, slug=slug)
+    return JsonResponse(serialize(recipe, fields, request))
+
+
+def _categories_validators():
+    version = Category.objects.aggregate(Max('updated_at'), Count('pk'))
+    return make_etag(version), version['updated_at__max']
+
+
+@api_view
+@conditional(lambda request: _categories_validators())
+def category_list(request):
+    categories = Category.objects.order_by('name').values('slug', 'name')
+    return JsonResponse({'results': [
+        dict(category, recipes=request.build_absolute_uri(reverse('apiCategoryRecipes', args=[category['slug']])))
+        for category in categories
+    ]})
+
+
+def _category(request, slug):
+    if not hasattr(request, '_api_category'):
+        request._api_category = Category.objects.filter(slug=slug).first()
+    return request._api_category
+
+
+def _category_validators(request, slug):
+    category = _category(request, slug)
+    if category is None:
+        return None, None
+    return _list_validators(request, Recipe.objects.for_cards().filter(category=category))
+
+
+@api_view
+@conditional(_category_validators)
+def category_recipes(request, slug):
+    category = _category(request, slug)
+    if category is None:
+        raise Http404('No category found')
+    return _list_response(request, Recipe.objects.for_cards().filter(category=category))
+
+
+# preferiti dall'ultimo like al primo, come la pagina HTML
+def _favourites_validators(request):
+    if not request.user.is_authenticated:
+        return None, None
+    return _list_validators(request, Recipe.objects.for_cards().liked_by(request.user), LIKED_ORDERING)
+
+
+@api_view
+@cache_control(private=True)
+@conditional(_favourites_validators)
+def favourites(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication required.'}, status=403)
+    return _list_response(request, Recipe.objects.for_cards().liked_by(request.user), LIKED_ORDERING)
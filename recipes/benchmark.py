@@ -0,0 +1,276 @@
+import datetime
+import json
+import random
+import subprocess
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.template import Context, Engine
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import leaderboard
+from .bulk import RecipeImporter
+from .models import Category, Like, Recipe
+
+# benchmark dei percorsi principali del sito: seed() crea un dataset sintetico riproducibile (stesso seed,
+# stessi dati), run() percorre il vero URLconf con il client di test di Django (middleware, template e
+# database reali, senza rete) e misura latenze, query per richiesta e throughput di ogni percorso.
+# I risultati sono un dizionario serializzabile in JSON da confrontare tra un commit e l'altro con compare().
+
+USERNAME_PREFIX = 'bench-'
+PASSWORD = 'bench-password'
+INGREDIENTS = ['flour', 'sugar', 'butter', 'egg', 'milk', 'salt', 'pepper', 'olive oil', 'garlic', 'onion',
+               'tomato', 'basil', 'parsley', 'lemon', 'rice', 'pasta', 'potato', 'carrot', 'celery', 'chicken',
+               'beef', 'pork', 'salmon', 'tuna', 'shrimp', 'mushroom', 'spinach', 'zucchini', 'eggplant',
+               'pepperoni', 'mozzarella', 'parmesan', 'ricotta', 'cream', 'yogurt', 'honey', 'cinnamon', 'vanilla',
+               'chocolate', 'almond', 'walnut', 'apple', 'pear', 'orange', 'strawberry', 'banana', 'chickpea',
+               'lentil', 'bean', 'pea', 'corn', 'ginger', 'chili', 'cumin', 'paprika', 'oregano', 'rosemary',
+               'thyme', 'sage', 'vinegar']
+DISHES = ['soup', 'salad', 'pie', 'cake', 'risotto', 'stew', 'tart', 'curry', 'omelette', 'pasta bake',
+          'skewers', 'muffins', 'roast', 'casserole', 'frittata']
+CATEGORY_NAMES = ['Breakfast', 'Lunch', 'Dinner', 'Dessert', 'Vegetarian', 'Vegan', 'Quick', 'Baking',
+                  'Seafood', 'Street Food', 'Soups', 'Salads', 'Snacks', 'Holiday', 'Kids']
+TARGETS = 500  # ricette e categorie tra cui i percorsi scelgono a caso
+# render_cards(): la griglia com'era prima di recipes.cards (markup nel ciclo, reverse() e truncatewords per
+# card) e la stessa griglia con il tag, prima a cache vuota e poi con le card già in cache
+CARD_TEMPLATES = {
+    'inline': '''{% for recipe in recipes %}
+        <div class="card" style="width: 15rem;">
+           <a href={% url 'recipesDetail' slug=recipe.slug %}><img src="{{ recipe.card_image_url }}"
+                class="card-img-top" alt="{{recipe.title}}Image" height="200px" width="200px"></a>
+            <div class="card-body">
+                <a  href={% url 'recipesDetail' slug=recipe.slug %}><h5 class="card-title">{{ recipe.title }}</h5></a>
+                <h6>Author: {{ recipe.author }} </h6>
+                <p class="dateString"> {{ recipe.date_posted }}</p>
+                <span> Likes: {{ recipe.like_count }}</span>
+                <p class="mt-2 card-text"><strong>{{ recipe.summary|truncatewords:10 }}</strong></p>
+            </div>
+        </div>
+    {% endfor %}''',
+    'component': "{% load recipe_cache %}{% recipe_cards recipes 'grid' %}",
+    'memoized': "{% load recipe_cache %}{% recipe_cards recipes 'grid' %}",
+}
+CARD_CACHES = {
+    'inline': {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+    'component': {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+    'memoized': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                             'LOCATION': 'benchmark-cards'}},
+}
+
+
+def seed(users=50, recipes=2000, ingredients=8, categories=12, likes=20, seed=0, batch_size=1000):
+    # ingredients e likes sono per ricetta e per utente; tutti gli utenti hanno la stessa password
+    rng = random.Random(seed)
+    now = timezone.now()
+    password = make_password(PASSWORD)
+    first = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+    usernames = [f'{USERNAME_PREFIX}{first + i}' for i in range(users)]
+    User.objects.bulk_create([User(username=username, password=password) for username in usernames],
+                             batch_size=batch_size)
+    category_names = [CATEGORY_NAMES[i % len(CATEGORY_NAMES)] + (f' {i // len(CATEGORY_NAMES) + 1}'
+                                                                 if i >= len(CATEGORY_NAMES) else '')
+                      for i in range(categories)]
+
+    def records():
+        for _ in range(recipes):
+            main = rng.sample(INGREDIENTS, min(ingredients, len(INGREDIENTS)))
+            yield {
+                'title': f'{main[0].title()} {rng.choice(DISHES)}',
+                'description': f'A {rng.choice(DISHES)} with ' + ', '.join(main) + '.',
+                'content': ' '.join(f'Add the {name} and stir.' for name in main),
+                'author': rng.choice(usernames),
+                'difficulty': rng.randint(1, 5),
+                'portions': rng.randint(1, 8),
+                'cooking_time': rng.randint(5, 180),
+                'date_posted': (now - datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 365))).isoformat(),
+                'categories': rng.sample(category_names, min(2, len(category_names))),
+                'ingredients': [{'name': name, 'quantity': f'{rng.randint(1, 500)}g'} for name in main],
+            }
+
+    importer = RecipeImporter(batch_size=batch_size)
+    importer.run(records())
+
+    recipe_ids = list(Recipe.objects.filter(author__username__in=usernames).values_list('pk', flat=True))
+    user_ids = User.objects.filter(username__in=usernames).values_list('pk', flat=True)
+    Like.objects.bulk_create([
+        Like(recipe_id=recipe_id, user_id=user_id, created_at=now - datetime.timedelta(minutes=rng.randint(0, 43200)))
+        for user_id in user_ids for recipe_id in rng.sample(recipe_ids, min(likes, len(recipe_ids)))
+    ], batch_size=batch_size, ignore_conflicts=True)
+    leaderboard.rebuild(Recipe, Like)
+    return {'users': users, 'recipes': importer.recipes, 'ingredients': importer.ingredients,
+            'categories': categories, 'likes': Like.objects.filter(user__username__in=usernames).count()}
+
+
+def dataset_size():
+    return {'users': User.objects.count(), 'recipes': Recipe.objects.count(), 'categories': Category.objects.count(),
+            'likes': Like.objects.count()}
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summarize(latencies, queries, statuses, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'avg_queries': round(sum(queries) / len(queries), 2),
+        'max_queries': max(queries),
+        'throughput': round(len(latencies) / elapsed, 1),
+        'errors': sum(status >= 400 for status in statuses),
+    }
+
+
+class Journeys:
+    # i percorsi misurati: (nome, anonimo?, funzione che fa la richiesta con il client)
+    def __init__(self, rng):
+        self.rng = rng
+        recipes = list(Recipe.objects.order_by('pk').values_list('pk', 'slug'))
+        categories = list(Category.objects.order_by('pk').values_list('pk', 'slug'))
+        if not recipes or not categories:
+            raise ValueError('The database has no recipes or categories: seed it first.')
+        self.recipes = rng.sample(recipes, min(TARGETS, len(recipes)))
+        self.categories = rng.sample(categories, min(TARGETS, len(categories)))
+
+    def all(self):
+        return [
+            ('home', True, lambda client: client.get(reverse('home'))),
+            ('recipe_list', True, lambda client: client.get(reverse('recipes'))),
+            ('recipe_detail', True,
+             lambda client: client.get(reverse('recipesDetail', args=[self.rng.choice(self.recipes)[1]]))),
+            ('search', True, lambda client: client.get(reverse('recipeSearch'), {'q': self.rng.choice(INGREDIENTS)})),
+            ('category', True,
+             lambda client: client.get(reverse('categoryDetail', args=[self.rng.choice(self.categories)[1]]))),
+            ('toggle_like', False,
+             lambda client: client.post(reverse('toggleLike', args=[self.rng.choice(self.recipes)[0]]))),
+            ('create_recipe', False, self.create_recipe),
+        ]
+
+    def create_recipe(self, client):
+        names = self.rng.sample(INGREDIENTS, 3)
+        data = {'title': f'{names[0].title()} {self.rng.choice(DISHES)}', 'description': 'Benchmark recipe',
+                'content': 'Mix everything.', 'difficulty': 2, 'portions': 2, 'cooking_time': 30,
+                'category': [self.rng.choice(self.categories)[0]],
+                'ingredient_set-TOTAL_FORMS': len(names), 'ingredient_set-INITIAL_FORMS': 0}
+        for i, name in enumerate(names):
+            data[f'ingredient_set-{i}-name'] = name
+        return client.post(reverse('recipesCreate'), data)
+
+
+def run(iterations=100, warmup=5, seed=0, only=None, keep=False):
+    # ogni percorso viene ripetuto iterations volte dopo warmup richieste non misurate (cache calde).
+    # Tutto gira in una transazione annullata alla fine, così like e ricette create non restano nel
+    # database (keep=True le conserva); le invalidazioni on_commit quindi non scattano.
+    rng = random.Random(seed)
+    user = User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('pk').first()
+    if user is None:
+        raise ValueError('No benchmark users: run "manage.py seed_benchmark" first.')
+    anonymous, logged_in = Client(), Client()
+    logged_in.force_login(user)
+
+    results = {}
+    with override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']), transaction.atomic():
+        journeys = Journeys(rng)
+        for name, anonymous_journey, request in journeys.all():
+            if only and name not in only:
+                continue
+            client = anonymous if anonymous_journey else logged_in
+            for _ in range(warmup):
+                request(client)
+            latencies, queries, statuses = [], [], []
+            started = time.perf_counter()
+            for _ in range(iterations):
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    response = request(client)
+                    latencies.append(time.perf_counter() - start)
+                queries.append(len(captured))
+                statuses.append(response.status_code)
+            results[name] = summarize(latencies, queries, statuses, time.perf_counter() - started)
+        if not keep:
+            transaction.set_rollback(True)
+
+    return {
+        'commit': current_commit(),
+        'created_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'dataset': dataset_size(),
+        'iterations': iterations,
+        'journeys': results,
+    }
+
+
+def render_cards(cards=100, iterations=50, warmup=3):
+    # tempo di rendering di una pagina di cards card, per ognuno dei CARD_TEMPLATES (solo il template:
+    # le ricette sono già caricate). La cache di ogni variante è separata da quella del sito
+    recipes = list(Recipe.objects.for_cards().order_by('-date_posted', '-id')[:cards])
+    if not recipes:
+        raise ValueError('The database has no recipes: seed it first.')
+    engine = Engine.get_default()
+    results = {}
+    for name, source in CARD_TEMPLATES.items():
+        template = engine.from_string(source)
+        with override_settings(CACHES=CARD_CACHES[name]):
+            for _ in range(warmup):
+                template.render(Context({'recipes': recipes, 'liked_recipes': frozenset()}))
+            timings = []
+            for _ in range(iterations):
+                context = Context({'recipes': recipes, 'liked_recipes': frozenset()})
+                start = time.perf_counter()
+                template.render(context)
+                timings.append(time.perf_counter() - start)
+        page = percentile(sorted(timings), 0.50)
+        results[name] = {'page_ms': round(page * 1000, 2), 'card_us': round(page / len(recipes) * 1e6, 1)}
+
+    return {
+        'commit': current_commit(),
+        'created_at': timezone.now().isoformat(),
+        'cards': len(recipes),
+        'iterations': iterations,
+        'templates': results,
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, tolerance=0.2):
+    # regressioni rispetto a un risultato precedente: p95 oltre la tolleranza, più query o nuovi errori
+    regressions = []
+    for name, now in current['journeys'].items():
+        before = baseline['journeys'].get(name)
+        if before is None:
+            continue
+        if now['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {now['p95_ms']} ms")
+        if now['avg_queries'] > before['avg_queries']:
+            regressions.append(f"{name}: queries {before['avg_queries']} -> {now['avg_queries']}")
+        if now['errors'] > before['errors']:
+            regressions.append(f"{name}: errors {before['errors']} -> {now['errors']}")
+    return regressions
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save(result, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+        f.write('\n')
@@ -0,0 +1,211 @@
+import csv
+import itertools
+import json
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.utils.dateparse import parse_datetime
+
+from . import facets, search
+from .caching import CATEGORIES, INGREDIENTS, RECIPES, bump_on_commit
+from .models import (SLUG_ATTEMPTS, Category, Ingredient, IngredientTerm, Recipe, last_slug_number,
+                     normalize_ingredient_name, slug_base)
+
+# import/export delle ricette in blocco, in JSON Lines o CSV, a memoria costante: si legge e si scrive un
+# record alla volta e il database viene scritto a lotti con bulk_create. bulk_create non chiama save() né
+# i signal, quindi qui si fa a mano quello che farebbero: slug, termini degli ingredienti, indice di
+# ricerca e invalidazione delle cache. Le immagini non vengono elaborate: ci pensa process_images.
+
+FORMATS = ('jsonl', 'csv')
+BATCH_SIZE = 1000
+FIELDS = ['slug', 'title', 'description', 'content', 'author', 'difficulty', 'portions', 'cooking_time',
+          'date_posted', 'image', 'categories', 'ingredients']
+# nel CSV categorie e ingredienti sono liste codificate in JSON dentro la cella
+LIST_FIELDS = ('categories', 'ingredients')
+
+
+def guess_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_records(stream, format):
+    if format == 'csv':
+        for row in csv.DictReader(stream):
+            for field in LIST_FIELDS:
+                row[field] = json.loads(row[field]) if row.get(field) else []
+            yield row
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_records(stream, records, format):
+    count = 0
+    if format == 'csv':
+        writer = csv.DictWriter(stream, FIELDS)
+        writer.writeheader()
+        for record in records:
+            for field in LIST_FIELDS:
+                record[field] = json.dumps(record[field])
+            writer.writerow(record)
+            count += 1
+    else:
+        for record in records:
+            stream.write(json.dumps(record) + '\n')
+            count += 1
+    return count
+
+
+def _group_by_recipe(rows):
+    # righe (recipe_id, ...) ordinate per recipe_id -> iteratore di (recipe_id, [righe])
+    return ((recipe_id, list(group)) for recipe_id, group in itertools.groupby(rows, key=lambda row: row[0]))
+
+
+def export_records(chunk_size=2000):
+    # tre letture ordinate per id della ricetta con cursori lato server, unite al volo (merge join):
+    # nessuna query per ricetta e in memoria c'è un solo record alla volta
+    recipes = (Recipe.objects.order_by('pk')
+               .values_list('pk', 'slug', 'title', 'description', 'content', 'author__username', 'difficulty',
+                            'portions', 'cooking_time', 'date_posted', 'image')
+               .iterator(chunk_size=chunk_size))
+    ingredients = _group_by_recipe(
+        Ingredient.objects.filter(recipe__isnull=False).order_by('recipe_id', 'pk')
+        .values_list('recipe_id', 'name', 'quantity').iterator(chunk_size=chunk_size))
+    categories = _group_by_recipe(
+        Recipe.category.through.objects.order_by('recipe_id', 'category__name')
+        .values_list('recipe_id', 'category__name').iterator(chunk_size=chunk_size))
+    next_ingredients, next_categories = next(ingredients, None), next(categories, None)
+
+    for pk, *values in recipes:
+        record = dict(zip(FIELDS, values))
+        record['date_posted'] = record['date_posted'].isoformat()
+        record['categories'], record['ingredients'] = [], []
+        while next_ingredients and next_ingredients[0] <= pk:
+            if next_ingredients[0] == pk:
+                record['ingredients'] = [{'name': name, 'quantity': quantity}
+                                         for _, name, quantity in next_ingredients[1]]
+            next_ingredients = next(ingredients, None)
+        while next_categories and next_categories[0] <= pk:
+            if next_categories[0] == pk:
+                record['categories'] = [name for _, name in next_categories[1]]
+            next_categories = next(categories, None)
+        yield record
+
+
+class RecipeImporter:
+    def __init__(self, default_author=None, batch_size=BATCH_SIZE):
+        self.default_author = default_author
+        self.batch_size = batch_size
+        self.authors = {}  # username -> id
+        self.categories = {}  # nome -> id
+        self.recipes = 0
+        self.ingredients = 0
+
+    def run(self, records):
+        iterator = iter(records)
+        while True:
+            batch = list(itertools.islice(iterator, self.batch_size))
+            if not batch:
+                break
+            with transaction.atomic():
+                self.import_batch(batch)
+        bump_on_commit(RECIPES, CATEGORIES, INGREDIENTS)
+
+    def import_batch(self, records):
+        authors = self.author_ids({record.get('author') or self.default_author for record in records})
+        categories = self.category_ids({name for record in records for name in record.get('categories') or []})
+
+        recipes = []
+        for record in records:
+            username = record.get('author') or self.default_author
+            if username not in authors:
+                raise ValueError(f"Unknown author {username!r} for recipe {record['title']!r}")
+            recipe = Recipe(title=record['title'], description=record.get('description', ''),
+                            content=record.get('content', ''), author_id=authors[username],
+                            portions=int(record['portions']), cooking_time=int(record['cooking_time']))
+            if record.get('difficulty'):
+                recipe.difficulty = int(record['difficulty'])
+            if record.get('date_posted'):
+                recipe.date_posted = parse_datetime(record['date_posted'])
+            if record.get('image'):
+                # image_processed resta vuoto: process_images genererà le rendition
+                recipe.image = record['image']
+            recipes.append(recipe)
+        self.create_with_slugs(recipes, [record.get('slug') or record['title'] for record in records])
+        if recipes[0].pk is None:
+            # solo PostgreSQL restituisce gli id da bulk_create: altrove si recuperano dagli slug
+            ids = dict(Recipe.objects.filter(slug__in=[recipe.slug for recipe in recipes]).values_list('slug', 'pk'))
+            for recipe in recipes:
+                recipe.pk = ids[recipe.slug]
+
+        self.create_ingredients(records, recipes)
+        Recipe.category.through.objects.bulk_create([
+            Recipe.category.through(recipe_id=recipe.pk, category_id=categories[name])
+            for record, recipe in zip(records, recipes) for name in set(record.get('categories') or [])
+        ], batch_size=self.batch_size)
+        search.reindex([recipe.pk for recipe in recipes])
+        facets.recipes_added([recipe.pk for recipe in recipes])
+        self.recipes += len(recipes)
+
+    def author_ids(self, usernames):
+        missing = usernames - self.authors.keys() - {None}
+        if missing:
+            self.authors.update(User.objects.filter(username__in=missing).values_list('username', 'pk'))
+        return self.authors
+
+    def category_ids(self, names):
+        missing = names - self.categories.keys()
+        if missing:
+            self.categories.update(Category.objects.filter(name__in=missing).values_list('name', 'pk'))
+            new = sorted(missing - self.categories.keys())
+            if new:
+                self.create_with_slugs([Category(name=name) for name in new], new)
+                self.categories.update(Category.objects.filter(name__in=new).values_list('name', 'pk'))
+        return self.categories
+
+    def create_with_slugs(self, objects, texts):
+        # bulk_create in un savepoint: se un inserimento concorrente prende uno degli slug il vincolo unique fa
+        # fallire il lotto e si riprova con slug nuovi, come UniqueSlugMixin.save
+        model = type(objects[0])
+        for attempt in range(SLUG_ATTEMPTS):
+            for obj, slug in zip(objects, self.allocate_slugs(texts, model)):
+                obj.slug = slug
+            try:
+                with transaction.atomic():
+                    return model.objects.bulk_create(objects, batch_size=self.batch_size)
+            except IntegrityError:
+                # errori non dovuti agli slug o troppi tentativi: si rilancia
+                if (attempt == SLUG_ATTEMPTS - 1
+                        or not model.objects.filter(slug__in=[obj.slug for obj in objects]).exists()):
+                    raise
+
+    def allocate_slugs(self, texts, model=Recipe):
+        # come generate_unique_slug ma per un lotto: una query per sapere quali basi sono già usate e
+        # una sola query in più per ogni base in collisione, poi i suffissi si contano in memoria saltando
+        # quelli già assegnati nel lotto (anche come slug espliciti, es. "soup-2" e poi "Soup")
+        bases = [slug_base(model, text) for text in texts]
+        taken = set(model.objects.filter(slug__in=set(bases)).values_list('slug', flat=True))
+        numbers = {}
+        slugs, allocated = [], set()
+        for base in bases:
+            slug = base
+            while slug in taken or slug in allocated:
+                if base not in numbers:
+                    numbers[base] = last_slug_number(model, base) or 0
+                numbers[base] += 1
+                slug = f'{base}-{numbers[base]}'
+            allocated.add(slug)
+            slugs.append(slug)
+        return slugs
+
+    def create_ingredients(self, records, recipes):
+        rows = [(recipe.pk, item['name'], item.get('quantity'))
+                for record, recipe in zip(records, recipes) for item in record.get('ingredients') or []]
+        terms = IngredientTerm.ids_for_names(name for _, name, _ in rows)
+        Ingredient.objects.bulk_create([
+            Ingredient(recipe_id=recipe_id, name=name, quantity=quantity,
+                       term_id=terms.get(normalize_ingredient_name(name)))
+            for recipe_id, name, quantity in rows
+        ], batch_size=self.batch_size)
+        self.ingredients += len(rows)
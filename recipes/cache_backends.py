@@ -0,0 +1,99 @@
+import pickle
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+
+# backend di cache per server compatibili Redis (Redis, KeyDB, Valkey...). Il client viene creato da
+# OPTIONS['CLIENT_FACTORY'] (default redis.Redis.from_url, richiede "pip install redis"), così nei test
+# si può sostituire con uno stub locale che implementa gli stessi comandi.
+class RedisCache(BaseCache):
+    def __init__(self, server, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        factory = import_string(options.get('CLIENT_FACTORY', 'redis.Redis.from_url'))
+        self._client = factory(server)
+
+    # gli interi restano in chiaro per poter usare INCRBY, il resto viene serializzato con pickle
+    def _dumps(self, value):
+        if type(value) is int:
+            return str(value).encode()
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def _loads(self, data):
+        if data is None:
+            return None
+        if data[:1] == b'\x80':
+            return pickle.loads(data)
+        return int(data)
+
+    def _ttl(self, timeout):
+        # secondi di vita per Redis: None = nessuna scadenza
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return None if timeout is None else max(int(timeout), 0)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        ttl = self._ttl(timeout)
+        if ttl == 0:
+            return False
+        return bool(self._client.set(self._key(key, version), self._dumps(value), ex=ttl, nx=True))
+
+    def get(self, key, default=None, version=None):
+        value = self._loads(self._client.get(self._key(key, version)))
+        return default if value is None else value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        ttl = self._ttl(timeout)
+        if ttl == 0:
+            self.delete(key, version=version)
+            return
+        self._client.set(self._key(key, version), self._dumps(value), ex=ttl)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        ttl = self._ttl(timeout)
+        key = self._key(key, version)
+        if ttl is None:
+            return bool(self._client.persist(key))
+        return bool(self._client.expire(key, ttl))
+
+    def delete(self, key, version=None):
+        return bool(self._client.delete(self._key(key, version)))
+
+    def has_key(self, key, version=None):
+        return bool(self._client.exists(self._key(key, version)))
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        if not self._client.exists(key):
+            raise ValueError("Key '%s' not found" % key)
+        return self._client.incrby(key, delta)
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self._client.mget([self._key(key, version) for key in keys])
+        return {key: self._loads(value) for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        for key, value in data.items():
+            self.set(key, value, timeout, version)
+        return []
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        if keys:
+            self._client.delete(*keys)
+
+    def clear(self):
+        self._client.flushdb()
+
+    def eviction_policy(self):
+        # maxmemory-policy del server (recipes.checks); alcuni servizi gestiti non permettono CONFIG GET
+        return self._client.config_get('maxmemory-policy').get('maxmemory-policy')
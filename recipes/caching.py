@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+
+# cache delle pagine anonime e delle card delle ricette: ogni voce dipende da uno o più namespace con un numero
+# di versione, e i signal in recipes.signals incrementano la versione dei namespace toccati da una modifica.
+# Le voci vecchie non vengono più lette e scadono con il timeout di default della cache (CACHE_TIMEOUT), che fa
+# solo da garbage collection: versioni e voci si scrivono tutte con quello, nessuna resta per sempre.
+#   RECIPES     elenchi di ricette (home, categorie) e contatori dei like
+#   CATEGORIES  nomi e slug delle categorie
+#   recipe_namespace(slug)  pagina di dettaglio di una ricetta
+#   RECOMMENDATIONS  ricette simili mostrate nel dettaglio (recipes.recommendations)
+#   INGREDIENTS  ingredienti delle ricette: versione dell'indice in memoria di recipes.matching
+
+RECIPES = 'recipes'
+CATEGORIES = 'categories'
+RECOMMENDATIONS = 'recommendations'
+INGREDIENTS = 'ingredients'
+STATS_KINDS = ('page', 'card')
+# backend in cui ogni processo ha la propria copia: un'invalidazione non arriva agli altri worker
+LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+def is_shared(alias='default'):
+    return settings.CACHES[alias]['BACKEND'] not in LOCAL_CACHES
+
+
+def recipe_namespace(slug):
+    return f'recipe:{slug}'
+
+
+def _version_key(namespace):
+    return f'ns:{namespace}'
+
+
+def namespace_versions(namespaces):
+    keys = [_version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        # una versione sparita (es. espulsa dal backend) riparte dall'orologio, mai da un numero già usato
+        cache.set_many(missing)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump(*namespaces):
+    for namespace in namespaces:
+        try:
+            cache.incr(_version_key(namespace))
+        except ValueError:
+            cache.set(_version_key(namespace), time.time_ns())
+
+
+def bump_on_commit(*namespaces):
+    # dopo il commit, altrimenti una richiesta concorrente potrebbe rimettere in cache i dati vecchi
+    transaction.on_commit(lambda: bump(*namespaces))
+
+
+def record(kind, hit, count=1):
+    if not count:
+        return
+    # contatori fissi, pochi e sempre gli stessi: senza scadenza
+    key = f'stats:{kind}:{"hits" if hit else "misses"}'
+    try:
+        cache.incr(key, count)
+    except ValueError:
+        cache.set(key, count, None)
+
+
+def get_stats():
+    keys = [f'stats:{kind}:{outcome}' for kind in STATS_KINDS for outcome in ('hits', 'misses')]
+    values = cache.get_many(keys)
+    return {kind: {outcome: values.get(f'stats:{kind}:{outcome}', 0) for outcome in ('hits', 'misses')}
+            for kind in STATS_KINDS}
+
+
+def reset_stats():
+    cache.delete_many([f'stats:{kind}:{outcome}' for kind in STATS_KINDS for outcome in ('hits', 'misses')])
+
+
+def _cacheable(request):
+    # solo GET anonimi senza messaggi in attesa: la pagina è identica per tutti i visitatori
+    return (request.method in ('GET', 'HEAD') and not request.user.is_authenticated
+            and CookieStorage.cookie_name not in request.COOKIES)
+
+
+def _lookup_page(request, namespaces, kwargs):
+    # -> (chiave, risposta in cache); chiave None se la richiesta non va servita dalla cache
+    if not _cacheable(request):
+        return None, None
+    names = [namespace(**kwargs) if callable(namespace) else namespace for namespace in namespaces]
+    versions = namespace_versions(names)
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    key = 'page:%s:%s' % (path, ':'.join(str(version) for version in versions))
+    cached = cache.get(key)
+    record('page', cached is not None)
+    if cached is None:
+        return key, None
+    content, content_type = cached
+    return key, HttpResponse(content, content_type=content_type)
+
+
+def _store_page(key, response):
+    if hasattr(response, 'render') and callable(response.render):
+        response.render()
+    if response.status_code == 200 and not response.streaming:
+        cache.set(key, (response.content, response['Content-Type']))
+
+
+def cache_anonymous_page(*namespaces):
+    # namespaces: nomi fissi o funzioni (kwargs della URL) -> nome. Funziona anche sulle viste async:
+    # la lettura della cache (e di request.user) avviene in un thread
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                key, cached = await sync_to_async(_lookup_page)(request, namespaces, kwargs)
+                if cached is not None:
+                    return cached
+                response = await view(request, *args, **kwargs)
+                if key is not None:
+                    await sync_to_async(_store_page)(key, response)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key, cached = _lookup_page(request, namespaces, kwargs)
+            if cached is not None:
+                return cached
+            response = view(request, *args, **kwargs)
+            if key is not None:
+                _store_page(key, response)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,77 @@
+import hashlib
+
+from django.core.cache import cache
+from django.template import Context
+from django.utils.text import Truncator
+
+from .caching import record
+from .models import recipe_url_parts
+
+# card delle ricette negli elenchi: un template per variante in templates/recipes/cards/ al posto del markup
+# copiato in ogni pagina, usato dal tag {% recipe_cards %} (recipes.templatetags.recipe_cache). Il template
+# riceve un contesto già pronto, fatto solo di valori: l'URL si compone con recipe_url_parts (niente reverse()
+# per card) e l'estratto è troncato qui con Truncator, lo stesso del filtro truncatewords. L'HTML di ogni card
+# resta in cache per versione della ricetta (updated_at), dell'autore mostrato e del cuore dei preferiti,
+# quindi non serve mai invalidarlo: quelle delle versioni vecchie scadono con il timeout di default della cache
+# (CACHE_TIMEOUT). Le card di un elenco si leggono e si scrivono con una get_many / set_many.
+
+CARDS = {
+    # variante: (template, immagine, parole dell'estratto)
+    'home': ('recipes/cards/home.html', 'home_image_url', 10),
+    'grid': ('recipes/cards/grid.html', 'card_image_url', 10),
+    'row': ('recipes/cards/row.html', 'card_image_url', 30),
+    'similar': ('recipes/cards/similar.html', 'card_image_url', None),
+    'link': ('recipes/cards/link.html', None, None),
+    'match': ('recipes/cards/match.html', 'card_image_url', 30),
+}
+# attributi calcolati per la richiesta (es. dalla vista what_can_i_cook) che la variante mostra: entrano nel
+# contesto e nella chiave, quindi c'è una card in cache per ogni combinazione di valori
+EXTRA_FIELDS = {
+    'match': ('matched', 'total'),
+}
+
+
+def card_key(recipe, variant, liked):
+    version = f'{recipe.pk}:{recipe.updated_at.timestamp()}:{recipe.author.username}:{liked:d}'
+    for field in EXTRA_FIELDS.get(variant, ()):
+        version += f':{getattr(recipe, field)}'
+    return 'card:%s:%s' % (variant, hashlib.md5(version.encode()).hexdigest())
+
+
+def card_context(recipe, variant, liked, url_parts):
+    _, image, words = CARDS[variant]
+    extra = {field: getattr(recipe, field) for field in EXTRA_FIELDS.get(variant, ())}
+    return {
+        **extra,
+        'url': url_parts[0] + recipe.slug + url_parts[1],
+        'title': recipe.title,
+        'author': recipe.author.username,
+        'date_posted': recipe.date_posted,
+        'like_count': recipe.like_count,
+        'liked': liked,
+        'image': getattr(recipe, image) if image else None,
+        'summary': Truncator(recipe.summary).words(words, truncate=' …') if words else None,
+    }
+
+
+def render(engine, recipes, variant, liked_recipes=(), autoescape=True):
+    # HTML delle card, nell'ordine delle ricette
+    if variant not in CARDS:
+        raise ValueError(f'Unknown card variant: {variant}')
+    recipes = list(recipes)
+    liked = [recipe.pk in liked_recipes for recipe in recipes]
+    keys = [card_key(recipe, variant, is_liked) for recipe, is_liked in zip(recipes, liked)]
+    cached = cache.get_many(keys)
+    template = engine.get_template(CARDS[variant][0])
+    url_parts = recipe_url_parts()
+    cards, missing = [], {}
+    for recipe, is_liked, key in zip(recipes, liked, keys):
+        html = cached.get(key)
+        if html is None:
+            html = missing[key] = template.render(Context(card_context(recipe, variant, is_liked, url_parts),
+                                                          autoescape=autoescape))
+        cards.append(html)
+    record('card', True, len(recipes) - len(missing))
+    record('card', False, len(missing))
+    cache.set_many(missing)
+    return cards
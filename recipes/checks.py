@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.checks import Error, Tags, Warning, register
+
+from .caching import is_shared
+
+# politiche con cui Redis espelle le chiavi meno usate quando raggiunge maxmemory
+EVICTION_POLICIES = ('allkeys-lru', 'allkeys-lfu', 'volatile-lru', 'volatile-lfu')
+
+
+# manage.py check --deploy: in produzione la cache deve essere condivisa tra i processi (recipes.caching,
+# recipes.liked), altrimenti le pagine restano vecchie sugli altri worker fino alla scadenza
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if settings.DEBUG or is_shared():
+        return []
+    return [Error('The default cache is local to each process.',
+                  hint='Set CACHE_BACKEND=redis (or file on a single host) when DEBUG is off.',
+                  id='recipes.E001')]
+
+
+# le voci invalidate restano in Redis fino alla scadenza: senza una politica di espulsione, a memoria piena
+# il server rifiuta le scritture invece di togliere le più vecchie
+@register(Tags.caches, deploy=True)
+def check_cache_eviction(app_configs, **kwargs):
+    backend = caches['default']
+    if not hasattr(backend, 'eviction_policy'):
+        return []
+    hint = 'Set maxmemory and "maxmemory-policy allkeys-lru" on the cache server.'
+    try:
+        policy = backend.eviction_policy()
+    except Exception as e:
+        return [Warning(f'Could not read the eviction policy of the cache server: {e}', hint=hint,
+                        id='recipes.W002')]
+    if policy in EVICTION_POLICIES:
+        return []
+    return [Warning(f'The cache server does not evict keys (maxmemory-policy {policy}).', hint=hint,
+                    id='recipes.W001')]
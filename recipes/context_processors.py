@@ -0,0 +1,9 @@
+from django.utils.functional import SimpleLazyObject
+
+from . import liked
+
+
+# liked_recipes nei template: le ricette preferite dell'utente (recipes.liked), lette solo se il template
+# le usa
+def liked_recipes(request):
+    return {'liked_recipes': SimpleLazyObject(lambda: liked.liked_recipes(request.user))}
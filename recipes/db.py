@@ -0,0 +1,127 @@
+import asyncio
+import contextvars
+import random
+import time
+
+from django.conf import settings
+from django.db import connections
+
+# connessioni persistenti e repliche in lettura.
+#
+# Con CONN_MAX_AGE la connessione resta aperta tra una richiesta e l'altra dello stesso worker; prima di
+# riusarne una rimasta ferma più di DB_HEALTH_CHECK_IDLE secondi check_connections verifica che sia ancora
+# viva (riavvio del database, timeout di un pooler) e altrimenti la chiude, così la richiesta ne apre una
+# nuova invece di fallire. È il CONN_HEALTH_CHECKS di Django 4.1, limitato alle connessioni inattive.
+#
+# ReplicaRouter manda le letture delle viste marcate con @replica_reads a una delle DATABASE_REPLICAS
+# (scelta una volta per richiesta). Tutto il resto, e ogni scrittura, va sul primario; utenti e sessioni
+# si leggono sempre dal primario. Dopo una scrittura di un modello (mark_written, chiamata dai signal
+# post_save/post_delete/m2m_changed in recipes.signals) il client riceve il cookie STICKY_COOKIE e per
+# REPLICA_STICKY_SECONDS legge solo dal primario, così vede subito quello che ha appena scritto anche se la
+# replica è in ritardo.
+
+STICKY_COOKIE = 'db_primary'
+# app lette solo dal primario: una sessione appena creata che manca sulla replica verrebbe considerata
+# scaduta (logout), un utente appena registrato non potrebbe entrare
+PRIMARY_APPS = ('auth', 'sessions')
+
+_state = contextvars.ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    def __init__(self, replica=None):
+        self.replica = replica  # alias da usare per le letture, None = primario
+        self.wrote = False
+
+
+def mark_written(model=None):
+    # dopo una scrittura anche le letture della stessa richiesta tornano sul primario. Da chiamare a mano
+    # dopo le scritture in blocco che non mandano signal
+    state = _state.get()
+    if state is not None and (model is None or model._meta.app_label not in PRIMARY_APPS):
+        state.wrote = True
+        state.replica = None
+
+
+def replica_reads(view):
+    # marca una vista in sola lettura: le sue query possono andare su una replica
+    view.replica_reads = True
+    return view
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.replica or model._meta.app_label in PRIMARY_APPS:
+            return 'default'
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # come MiddlewareMixin: Django deve riconoscere l'istanza come coroutine function
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = _state.set(RoutingState())
+        try:
+            return self.stick(self.get_response(request))
+        finally:
+            _state.reset(token)
+
+    async def __acall__(self, request):
+        # lo stato è un oggetto condiviso: lo vedono anche i thread di sync_to_async della richiesta
+        token = _state.set(RoutingState())
+        try:
+            return self.stick(await self.get_response(request))
+        finally:
+            _state.reset(token)
+
+    def stick(self, response):
+        if _state.get().wrote:
+            response.set_cookie(STICKY_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS, httponly=True,
+                                samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        replicas = settings.DATABASE_REPLICAS
+        view = getattr(view_func, 'view_class', view_func)
+        if (replicas and getattr(view, 'replica_reads', False) and request.method in ('GET', 'HEAD')
+                and STICKY_COOKIE not in request.COOKIES):
+            _state.get().replica = random.choice(replicas)
+
+
+def check_connections(**kwargs):
+    # request_started: chiude le connessioni persistenti ferme da troppo e non più utilizzabili
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None:
+            continue
+        idle = now - getattr(connection, 'last_used', now)
+        if idle >= settings.DB_HEALTH_CHECK_IDLE and not connection.is_usable():
+            connection.close()
+
+
+def mark_connections_used(**kwargs):
+    # request_finished
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.last_used = now
@@ -0,0 +1,128 @@
+import random
+import re
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .benchmark import USERNAME_PREFIX, Journeys, current_commit, dataset_size
+
+# piani di esecuzione delle query di ogni pagina: run() percorre gli stessi percorsi del benchmark (più qualche
+# pagina in sola lettura) con la cache disattivata, così ogni query arriva al database, e passa ogni query
+# catturata a EXPLAIN. I piani con una scansione completa di tabella o un ordinamento senza indice vengono
+# segnalati; compare() confronta le segnalazioni con quelle di un risultato salvato, così un indice perso o
+# una query nuova che non ne usa nessuno si vedono prima di arrivare in produzione.
+
+EXPLAIN_PREFIX = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN ', 'mysql': 'EXPLAIN '}
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+# SQLite: "SCAN recipes_recipe" (o "SCAN TABLE ..." nelle versioni vecchie), se non seguito da USING INDEX
+SQLITE_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)(.*)$')
+SQLITE_SORT_RE = re.compile(r'^USE TEMP B-TREE FOR (.+)$')
+POSTGRES_SCAN_RE = re.compile(r'Seq Scan on (\w+)')
+DUMMY_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+def pages(journeys):
+    return journeys.all() + [
+        ('categories', True, lambda client: client.get(reverse('categories'))),
+        ('browse', True, lambda client: client.get(reverse('browse'), {'difficulty': 2, 'time': 30})),
+        ('leaderboard', True, lambda client: client.get(reverse('leaderboard'))),
+        ('favourites', False, lambda client: client.get(reverse('favourites'))),
+        ('my_recipes', False, lambda client: client.get(reverse('myRecipes'))),
+        ('api_recipes', True, lambda client: client.get(reverse('apiRecipes'))),
+    ]
+
+
+def plan(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(EXPLAIN_PREFIX[connection.vendor] + sql)
+        rows = cursor.fetchall()
+    if connection.vendor == 'sqlite':
+        # (id, parent, notused, detail): il dettaglio indentato secondo la profondità
+        depth = {0: -1}
+        lines = []
+        for node, parent, _, detail in rows:
+            depth[node] = depth.get(parent, -1) + 1
+            lines.append('  ' * depth[node] + detail)
+        return lines
+    return [' '.join(str(value) for value in row) for row in rows]
+
+
+def problems(lines):
+    found = []
+    for line in lines:
+        line = line.strip()
+        if connection.vendor == 'sqlite':
+            scan, sort = SQLITE_SCAN_RE.match(line), SQLITE_SORT_RE.match(line)
+            if scan and 'USING' not in scan.group(2) and 'VIRTUAL TABLE' not in scan.group(2):
+                found.append(f'full scan of {scan.group(1)}')
+            elif sort:
+                found.append(f'temporary b-tree for {sort.group(1).lower()}')
+        elif connection.vendor == 'postgresql':
+            found.extend(f'full scan of {table}' for table in POSTGRES_SCAN_RE.findall(line))
+    return found
+
+
+def explain_queries(queries):
+    # piani delle query catturate, una volta per testo SQL (con i parametri già sostituiti)
+    explained, seen = [], set()
+    for query in queries:
+        sql = query['sql']
+        if sql in seen or not sql.lstrip().upper().startswith(EXPLAINABLE):
+            continue
+        seen.add(sql)
+        lines = plan(sql)
+        explained.append({'sql': sql, 'plan': lines, 'problems': problems(lines)})
+    return explained
+
+
+def run(seed=0, only=None):
+    # ogni pagina viene richiesta una volta, in una transazione annullata alla fine
+    if connection.vendor not in EXPLAIN_PREFIX:
+        raise ValueError(f'EXPLAIN is not supported on {connection.vendor}.')
+    user = User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('pk').first()
+    if user is None:
+        raise ValueError('No benchmark users: run "manage.py seed_benchmark" first.')
+    anonymous, logged_in = Client(), Client()
+    logged_in.force_login(user)
+
+    results = {}
+    with override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver'], CACHES=DUMMY_CACHE), \
+            transaction.atomic():
+        for name, anonymous_page, request in pages(Journeys(random.Random(seed))):
+            if only and name not in only:
+                continue
+            with CaptureQueriesContext(connection) as captured:
+                response = request(anonymous if anonymous_page else logged_in)
+            queries = explain_queries(captured.captured_queries)
+            results[name] = {
+                'status': response.status_code,
+                'queries': len(captured),
+                'problems': sorted({problem for query in queries for problem in query['problems']}),
+                'plans': queries,
+            }
+        transaction.set_rollback(True)
+
+    return {
+        'commit': current_commit(),
+        'created_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'dataset': dataset_size(),
+        'pages': results,
+    }
+
+
+def compare(baseline, current):
+    # regressioni rispetto a un risultato precedente: segnalazioni nuove nei piani di una pagina
+    regressions = []
+    for name, now in current['pages'].items():
+        before = baseline['pages'].get(name)
+        if before is None:
+            continue
+        for problem in sorted(set(now['problems']) - set(before['problems'])):
+            regressions.append(f'{name}: {problem}')
+    return regressions
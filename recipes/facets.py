@@ -0,0 +1,249 @@
+from bisect import bisect_left
+from collections import Counter
+from urllib.parse import urlencode
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+
+from .models import Category, FacetCount, Recipe, RecipeCategory
+
+# navigazione a faccette: categorie (in AND tra loro), difficoltà (in OR) e tempo massimo di preparazione,
+# combinabili ("Vegetarian + Easy + fino a 30 min"), ognuna con il numero di ricette che si otterrebbero
+# scegliendola. I conteggi non vengono da una GROUP BY sul catalogo a ogni richiesta ma dal cubo FacetCount,
+# tenuto aggiornato dai signal (recipes.signals) e dall'importazione in blocco: per ogni ricetta le celle
+# (0, 0), (0, c), (c, 0) e (c, o) per ogni coppia delle sue categorie, nella sua difficoltà e fascia di tempo.
+# Con nessuna o una categoria selezionata i conteggi si leggono dal cubo (righe con quel selected); con due
+# o più si contano le sole ricette dell'intersezione, già ristretta dalle categorie scelte.
+
+TIME_LIMITS = [15, 30, 60]  # minuti: la fascia di una ricetta è la prima in cui rientra, poi una per "oltre"
+TIME_LABELS = {15: 'Up to 15 min', 30: 'Up to 30 min', 60: 'Up to 1 hour'}
+ALL = 0
+
+
+def time_bucket(minutes):
+    return bisect_left(TIME_LIMITS, minutes)
+
+
+def bucket_expression(field='cooking_time'):
+    return Case(*[When(**{f'{field}__lte': limit}, then=Value(i)) for i, limit in enumerate(TIME_LIMITS)],
+                default=Value(len(TIME_LIMITS)), output_field=IntegerField())
+
+
+def cells(difficulty, bucket, categories):
+    pairs = [(ALL, ALL)] + [(ALL, c) for c in categories] + [(c, o) for c in categories for o in [ALL, *categories]]
+    return {(selected, category, difficulty, bucket) for selected, category in pairs}
+
+
+def load(recipe_ids=None):
+    # ricetta -> (difficoltà, fascia di tempo, categorie); recipe_ids None = tutte
+    recipes, links = Recipe.objects.order_by(), RecipeCategory.objects.order_by()
+    if recipe_ids is not None:
+        recipes, links = recipes.filter(pk__in=recipe_ids), links.filter(recipe_id__in=recipe_ids)
+    state = {pk: (difficulty, time_bucket(minutes), set())
+             for pk, difficulty, minutes in recipes.values_list('pk', 'difficulty', 'cooking_time').iterator()}
+    for recipe_id, category_id in links.values_list('recipe_id', 'category_id').iterator():
+        if recipe_id in state:
+            state[recipe_id][2].add(category_id)
+    return state
+
+
+def delta(before, after):
+    changes = Counter()
+    for pk in before.keys() | after.keys():
+        old = cells(*before[pk]) if pk in before else set()
+        new = cells(*after[pk]) if pk in after else set()
+        changes.update({cell: 1 for cell in new - old})
+        changes.update({cell: -1 for cell in old - new})
+    return changes
+
+
+def apply(changes):
+    # in ordine, così due transazioni concorrenti bloccano le righe nella stessa sequenza
+    for (selected, category, difficulty, bucket), n in sorted(changes.items()):
+        if not n:
+            continue
+        cell = FacetCount.objects.filter(selected=selected, category=category, difficulty=difficulty,
+                                         time_bucket=bucket)
+        if cell.update(recipes=F('recipes') + n):
+            continue
+        try:
+            with transaction.atomic():
+                FacetCount.objects.create(selected=selected, category=category, difficulty=difficulty,
+                                          time_bucket=bucket, recipes=n)
+        except IntegrityError:
+            # creata nel frattempo da un'altra transazione
+            cell.update(recipes=F('recipes') + n)
+
+
+def rebuild(batch_size=1000):
+    # ricalcola da zero tutto il cubo (rebuild_facets); restituisce il numero di celle
+    FacetCount.objects.all().delete()
+    changes = delta({}, load())
+    FacetCount.objects.bulk_create([
+        FacetCount(selected=selected, category=category, difficulty=difficulty, time_bucket=bucket, recipes=n)
+        for (selected, category, difficulty, bucket), n in changes.items()
+    ], batch_size=batch_size)
+    return len(changes)
+
+
+# aggiornamenti incrementali, chiamati da recipes.signals e da RecipeImporter
+
+def recipes_added(recipe_ids):
+    apply(delta({}, load(recipe_ids)))
+
+
+def remember(instance, update_fields=None):
+    # pre_save: difficoltà e tempo prima del salvataggio
+    instance._facet_before = None
+    if not instance._state.adding and (update_fields is None or {'difficulty', 'cooking_time'} & set(update_fields)):
+        instance._facet_before = (Recipe._base_manager.filter(pk=instance.pk)
+                                  .values_list('difficulty', 'cooking_time').first())
+
+
+def recipe_saved(instance, created):
+    if created:
+        apply(delta({}, {instance.pk: (instance.difficulty, time_bucket(instance.cooking_time), set())}))
+        return
+    before = getattr(instance, '_facet_before', None)
+    if before is None or before == (instance.difficulty, instance.cooking_time):
+        return
+    categories = set(RecipeCategory.objects.filter(recipe_id=instance.pk).values_list('category_id', flat=True))
+    apply(delta({instance.pk: (before[0], time_bucket(before[1]), categories)},
+                {instance.pk: (instance.difficulty, time_bucket(instance.cooking_time), categories)}))
+
+
+def recipe_deleted(instance):
+    # pre_delete: le righe della M2M spariscono in cascata senza m2m_changed
+    apply(delta(load([instance.pk]), {}))
+
+
+def categories_changing(instance, reverse, pk_set):
+    # pre_add / pre_remove / pre_clear: lo stato delle ricette coinvolte prima della modifica
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif pk_set is None:
+        recipe_ids = list(RecipeCategory.objects.filter(category_id=instance.pk).values_list('recipe_id', flat=True))
+    else:
+        recipe_ids = list(pk_set)
+    instance._facet_categories_before = load(recipe_ids)
+
+
+def categories_changed(instance):
+    # post_add / post_remove / post_clear
+    before = instance._facet_categories_before
+    after = {pk: (difficulty, bucket, set()) for pk, (difficulty, bucket, _) in before.items()}
+    for recipe_id, category_id in RecipeCategory.objects.filter(recipe_id__in=list(before)).values_list(
+            'recipe_id', 'category_id'):
+        after[recipe_id][2].add(category_id)
+    apply(delta(before, after))
+
+
+def category_deleted(category_id):
+    FacetCount.objects.filter(selected=category_id).delete()
+    FacetCount.objects.filter(category=category_id).delete()
+
+
+class Selection:
+    def __init__(self, categories=(), difficulties=(), max_time=None):
+        self.categories = list(categories)
+        self.difficulties = sorted(set(difficulties))
+        self.max_time = max_time
+
+    @classmethod
+    def from_query(cls, query, base=None):
+        # parametri category (slug, ripetibile), difficulty (ripetibile) e time; i valori non validi si ignorano
+        slugs = list(dict.fromkeys(query.getlist('category')))
+        found = {category.slug: category for category in Category.objects.filter(slug__in=slugs)}
+        categories = [base] if base else []
+        categories += [found[slug] for slug in slugs if slug in found and found[slug] not in categories]
+        levels = dict(Recipe.DIFFICULTY_LEVELS)
+        difficulties = [int(value) for value in query.getlist('difficulty') if value.isdigit() and int(value) in levels]
+        max_time = query.get('time', '')
+        max_time = int(max_time) if max_time.isdigit() and int(max_time) in TIME_LIMITS else None
+        return cls(categories, difficulties, max_time)
+
+    def filter(self, queryset):
+        for category in self.categories:
+            queryset = queryset.filter(category=category)
+        if self.difficulties:
+            queryset = queryset.filter(difficulty__in=self.difficulties)
+        if self.max_time:
+            queryset = queryset.filter(cooking_time__lte=self.max_time)
+        return queryset
+
+    def querystring(self, categories=None, difficulties=None, max_time=False):
+        categories = self.categories if categories is None else categories
+        difficulties = self.difficulties if difficulties is None else difficulties
+        max_time = self.max_time if max_time is False else max_time
+        params = [('category', category.slug) for category in categories]
+        params += [('difficulty', level) for level in sorted(difficulties)]
+        if max_time:
+            params.append(('time', max_time))
+        return urlencode(params)
+
+    def toggle_category(self, category):
+        if category in self.categories:
+            return self.querystring(categories=[other for other in self.categories if other != category])
+        return self.querystring(categories=self.categories + [category])
+
+    def toggle_difficulty(self, level):
+        return self.querystring(difficulties=set(self.difficulties) ^ {level})
+
+    def toggle_time(self, limit):
+        return self.querystring(max_time=None if limit == self.max_time else limit)
+
+
+def counted_cells(selection):
+    # (categoria contata o 0 per il totale, difficoltà, fascia, ricette) delle ricette nelle categorie scelte
+    if len(selection.categories) < 2:
+        selected = selection.categories[0].pk if selection.categories else ALL
+        return list(FacetCount.objects.filter(selected=selected, recipes__gt=0)
+                    .values_list('category', 'difficulty', 'time_bucket', 'recipes'))
+    recipes = Selection(selection.categories).filter(Recipe.objects.order_by())
+    totals = (recipes.annotate(bucket=bucket_expression()).values('difficulty', 'bucket')
+              .annotate(n=Count('pk')).values_list('difficulty', 'bucket', 'n'))
+    by_category = (RecipeCategory.objects.order_by().filter(recipe__in=recipes.values('pk'))
+                   .annotate(difficulty=F('recipe__difficulty'), bucket=bucket_expression('recipe__cooking_time'))
+                   .values('category_id', 'difficulty', 'bucket').annotate(n=Count('pk'))
+                   .values_list('category_id', 'difficulty', 'bucket', 'n'))
+    return [(ALL, *row) for row in totals] + list(by_category)
+
+
+def options(selection):
+    # opzioni di ogni faccetta con il conteggio che si avrebbe scegliendola e il link che la attiva o toglie
+    rows = counted_cells(selection)
+    bucket_limit = TIME_LIMITS.index(selection.max_time) if selection.max_time else len(TIME_LIMITS)
+
+    def total(category=ALL, difficulties=selection.difficulties, limit=bucket_limit):
+        return sum(n for counted, difficulty, bucket, n in rows
+                   if counted == category and bucket <= limit and (not difficulties or difficulty in difficulties))
+
+    categories = [
+        {'label': category.name, 'count': total(category.pk), 'selected': category in selection.categories,
+         'querystring': selection.toggle_category(category)}
+        for category in Category.objects.order_by('name')
+    ]
+    difficulties = [
+        {'label': label, 'count': total(difficulties=[level]), 'selected': level in selection.difficulties,
+         'querystring': selection.toggle_difficulty(level)}
+        for level, label in Recipe.DIFFICULTY_LEVELS
+    ]
+    times = [
+        {'label': TIME_LABELS[limit], 'count': total(limit=i), 'selected': limit == selection.max_time,
+         'querystring': selection.toggle_time(limit)}
+        for i, limit in enumerate(TIME_LIMITS)
+    ]
+    return {
+        'total': total(),
+        'groups': [('Categories', [option for option in categories if option['count'] or option['selected']]),
+                   ('Difficulty', difficulties), ('Cooking time', times)],
+    }
+
+
+def category_counts():
+    # ricette per categoria (id -> numero), per l'elenco delle categorie
+    counts = Counter()
+    rows = FacetCount.objects.filter(selected=ALL).exclude(category=ALL).values_list('category', 'recipes')
+    for category, n in rows:
+        counts[category] += n
+    return counts
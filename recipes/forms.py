@@ -1,6 +1,6 @@
 from django import forms
-from .models import Recipe, Ingredient
-
+from django.forms import BaseInlineFormSet, inlineformset_factory
+from .models import Recipe, Ingredient, IngredientTerm, normalize_ingredient_name
 
 
 class RecipeForm(forms.ModelForm):
@@ -14,3 +14,47 @@ class IngredientForm(forms.ModelForm):
     class Meta:
         model = Ingredient
         fields = ['name', 'quantity']
+
+
+class BaseIngredientFormSet(BaseInlineFormSet):
+    # salva il confronto tra righe inviate e righe esistenti con una query per tipo di modifica
+    # (insert, update, delete) invece di un save() per ingrediente. bulk_create e bulk_update non mandano
+    # signal: dopo il salvataggio la vista chiama signals.ingredients_changed se has_saved_changes()
+    def save(self, commit=True):
+        recipe = self.instance
+        self.new_objects, self.changed_objects, self.deleted_objects = [], [], []
+        for form in self.initial_forms:
+            if self.can_delete and self._should_delete_form(form):
+                self.deleted_objects.append(form.instance)
+            elif form.has_changed():
+                self.changed_objects.append((form.instance, form.changed_data))
+        for form in self.extra_forms:
+            if form.has_changed() and not (self.can_delete and self._should_delete_form(form)):
+                form.instance.recipe = recipe
+                self.new_objects.append(form.instance)
+
+        changed = [ingredient for ingredient, fields in self.changed_objects]
+        if not commit:
+            # come BaseModelFormSet: il chiamante salva gli oggetti e cancella deleted_objects
+            self.saved_forms = []
+            self.save_m2m = lambda: None
+            return changed + self.new_objects
+        terms = IngredientTerm.ids_for_names(ingredient.name for ingredient in changed + self.new_objects)
+        for ingredient in changed + self.new_objects:
+            ingredient.term_id = terms.get(normalize_ingredient_name(ingredient.name))
+
+        if self.deleted_objects:
+            ids = [ingredient.pk for ingredient in self.deleted_objects]
+            Ingredient.objects.filter(recipe=recipe, pk__in=ids).delete()
+        if changed:
+            Ingredient.objects.bulk_update(changed, ['name', 'quantity', 'term'])
+        if self.new_objects:
+            Ingredient.objects.bulk_create(self.new_objects)
+        return changed + self.new_objects
+
+    def has_saved_changes(self):
+        return bool(self.deleted_objects or self.changed_objects or self.new_objects)
+
+
+IngredientFormSet = inlineformset_factory(Recipe, Ingredient, form=IngredientForm, formset=BaseIngredientFormSet,
+                                          extra=3, can_delete=True)
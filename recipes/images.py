@@ -0,0 +1,80 @@
+import os
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.dispatch import Signal
+from PIL import Image, ImageOps, features
+
+from .tasks import run_in_background
+
+RENDITIONS_DIR = 'renditions'
+
+# inviato quando le rendition di un oggetto sono pronte (kwargs: instance_pk)
+renditions_ready = Signal()
+
+
+def rendition_format():
+    # WebP dove Pillow lo sa scrivere, altrimenti JPEG
+    fmt = getattr(settings, 'IMAGE_RENDITION_FORMAT', 'WEBP').upper()
+    if fmt == 'WEBP' and not features.check('webp'):
+        fmt = 'JPEG'
+    return fmt
+
+
+def rendition_name(source_name, size, fmt):
+    # nome deterministico: la stessa sorgente produce sempre gli stessi file, quindi ogni immagine
+    # (compresa default.jpg, condivisa da tante ricette) viene elaborata una volta sola
+    stem = os.path.splitext(source_name)[0]
+    extension = 'webp' if fmt == 'WEBP' else 'jpg'
+    return f'{RENDITIONS_DIR}/{stem}-{size}.{extension}'
+
+
+def render_renditions(source_name, sizes, storage=default_storage):
+    # sizes: {nome_campo: lato massimo in pixel}; restituisce {nome_campo: path della rendition}
+    fmt = rendition_format()
+    names = {field: rendition_name(source_name, size, fmt) for field, size in sizes.items()}
+    missing = [field for field, name in names.items() if not storage.exists(name)]
+    if not missing:
+        return names
+
+    # la sorgente viene decodificata una volta e ridotta a scalare, dalla rendition più grande alla più piccola
+    with storage.open(source_name) as source:
+        img = ImageOps.exif_transpose(Image.open(source))
+        img.load()
+    if fmt == 'JPEG' or img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGB')
+    for field in sorted(missing, key=lambda f: sizes[f], reverse=True):
+        img = img.copy()
+        img.thumbnail((sizes[field], sizes[field]))
+        buffer = BytesIO()
+        img.save(buffer, fmt, quality=82)
+        names[field] = storage.save(names[field], ContentFile(buffer.getvalue()))
+    return names
+
+
+def process_image(model_label, pk):
+    model = apps.get_model(model_label)
+    source = model.objects.filter(pk=pk).values_list('image', flat=True).first()
+    if not source:
+        return
+    paths = render_renditions(source, model.RENDITIONS)
+    # se nel frattempo l'immagine è cambiata l'update non tocca nulla: ci penserà il lavoro accodato dopo
+    if model.objects.filter(pk=pk, image=source).update(image_processed=source, **paths):
+        renditions_ready.send(sender=model, instance_pk=pk)
+
+
+def schedule_image_processing(instance):
+    # accoda l'elaborazione solo se l'immagine attuale non è ancora stata elaborata
+    if instance.image.name and instance.image.name != instance.image_processed:
+        run_in_background(process_image, instance._meta.label, instance.pk)
+
+
+def rendition_url(instance, field):
+    # finché il worker non ha prodotto la rendition si usa l'originale
+    name = getattr(instance, field)
+    if name and instance.image_processed == instance.image.name:
+        return default_storage.url(name)
+    return instance.image.url
@@ -0,0 +1,244 @@
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from django.conf import settings
+from django.core.cache import cache
+from asgiref.sync import sync_to_async
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+# strumentazione delle richieste: per una frazione campionata delle richieste (INSTRUMENTATION_SAMPLE_RATE)
+# InstrumentationMiddleware conta query e tempo sul database, misura il rendering dei template e la dimensione
+# della risposta. I valori finiscono nell'header Server-Timing e in una tabella in memoria con gli ultimi
+# WINDOW campioni di ogni vista; ogni PUBLISH_INTERVAL secondi il processo ne pubblica una copia nella cache,
+# così il comando requeststats vede tutti i worker. Una stessa SQL ripetuta almeno INSTRUMENTATION_N_PLUS_ONE
+# volte nella stessa richiesta (con parametri diversi) viene segnalata come probabile N+1.
+# Il middleware è ibrido (WSGI e ASGI); ogni connessione al database ha un execute_wrapper permanente
+# (record_query, installato su connection_created da recipes.signals) che passa la query al campione della
+# richiesta corrente: il contextvar segue la richiesta anche nei thread di sync_to_async.
+
+WINDOW = 200
+PUBLISH_INTERVAL = 30
+SNAPSHOT_TIMEOUT = 600
+PROCESSES_KEY = 'instrumentation:processes'
+
+logger = logging.getLogger(__name__)
+_current = contextvars.ContextVar('instrumentation_sample', default=None)
+
+
+class Sample:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.statements = Counter()
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def repeated_statement(self):
+        # (sql, volte) della query più ripetuta se supera la soglia, altrimenti None
+        if not self.statements:
+            return None
+        sql, count = self.statements.most_common(1)[0]
+        return (sql, count) if count >= getattr(settings, 'INSTRUMENTATION_N_PLUS_ONE', 5) else None
+
+
+def record_query(execute, sql, params, many, context):
+    sample = _current.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    return sample.record_query(execute, sql, params, many, context)
+
+
+def install(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        sample = _current.get()
+        if sample is None or sample.template_depth:
+            return super().render(context, request)
+        # solo il render più esterno: i template resi dentro un altro (es. i form crispy) sono già nel suo tempo
+        sample.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            sample.template_time += time.perf_counter() - start
+            sample.template_depth -= 1
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    # backend dei template che cronometra il tempo di rendering
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class StatsTable:
+    def __init__(self, window=WINDOW):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+        self.n_plus_one = {}  # vista -> ultima SQL ripetuta segnalata
+        self.published_at = 0.0
+
+    def add(self, view, row, repeated):
+        with self.lock:
+            self.samples[view].append(row)
+            if repeated:
+                self.n_plus_one[view] = repeated
+
+    def snapshot(self):
+        with self.lock:
+            return {'samples': {view: list(rows) for view, rows in self.samples.items()},
+                    'n_plus_one': dict(self.n_plus_one)}
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            self.n_plus_one.clear()
+
+
+stats = StatsTable()
+
+
+def process_key():
+    return f'instrumentation:snapshot:{socket.gethostname()}:{os.getpid()}'
+
+
+def publish():
+    key = process_key()
+    cache.set(key, stats.snapshot(), SNAPSHOT_TIMEOUT)
+    processes = cache.get(PROCESSES_KEY, [])
+    if key not in processes:
+        cache.set(PROCESSES_KEY, processes + [key], None)
+    stats.published_at = time.monotonic()
+
+
+def collect():
+    # unisce le copie pubblicate da tutti i processi ancora vivi (le altre sono scadute)
+    keys = cache.get(PROCESSES_KEY, [])
+    snapshots = cache.get_many(keys)
+    if len(snapshots) != len(keys):
+        cache.set(PROCESSES_KEY, list(snapshots), None)
+    merged = {'samples': defaultdict(list), 'n_plus_one': {}}
+    for snapshot in snapshots.values():
+        for view, rows in snapshot['samples'].items():
+            merged['samples'][view].extend(rows)
+        merged['n_plus_one'].update(snapshot['n_plus_one'])
+    return merged
+
+
+def summarize(snapshot):
+    # una riga per vista, ordinate per tempo totale speso (media * richieste)
+    rows = []
+    for view, samples in snapshot['samples'].items():
+        count = len(samples)
+        totals = sorted(sample['total'] for sample in samples)
+        repeated = snapshot['n_plus_one'].get(view)
+        rows.append({
+            'view': view,
+            'requests': count,
+            'avg_ms': sum(totals) / count * 1000,
+            'p95_ms': totals[min(count - 1, int(count * 0.95))] * 1000,
+            'avg_queries': sum(sample['queries'] for sample in samples) / count,
+            'max_queries': max(sample['queries'] for sample in samples),
+            'avg_db_ms': sum(sample['db'] for sample in samples) / count * 1000,
+            'avg_template_ms': sum(sample['template'] for sample in samples) / count * 1000,
+            'avg_kb': sum(sample['size'] for sample in samples) / count / 1024,
+            'n_plus_one': sum(sample['n_plus_one'] for sample in samples),
+            'repeated_sql': repeated[0] if repeated else '',
+            'repeated_count': repeated[1] if repeated else 0,
+        })
+    return sorted(rows, key=lambda row: row['avg_ms'] * row['requests'], reverse=True)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match._func_path if match else 'unresolved'
+
+
+def sampled():
+    return random.random() < getattr(settings, 'INSTRUMENTATION_SAMPLE_RATE', 0)
+
+
+def publish_due():
+    return time.monotonic() - stats.published_at > PUBLISH_INTERVAL
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # come MiddlewareMixin: Django deve riconoscere l'istanza come coroutine function
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not sampled():
+            return self.get_response(request)
+        sample = Sample()
+        token = _current.set(sample)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, sample, time.perf_counter() - start)
+        if publish_due():
+            publish()
+        return response
+
+    async def __acall__(self, request):
+        if not sampled():
+            return await self.get_response(request)
+        sample = Sample()
+        token = _current.set(sample)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, sample, time.perf_counter() - start)
+        if publish_due():
+            await sync_to_async(publish)()
+        return response
+
+    def record(self, request, response, sample, total):
+        view = view_name(request)
+        size = 0 if response.streaming else len(response.content)
+        repeated = sample.repeated_statement()
+        if repeated:
+            logger.warning('Possible N+1 in %s: %d executions of %s', view, repeated[1], repeated[0][:300])
+        response['Server-Timing'] = (f'db;dur={sample.db_time * 1000:.1f};desc="{sample.queries} queries", '
+                                     f'tpl;dur={sample.template_time * 1000:.1f}, total;dur={total * 1000:.1f}')
+        stats.add(view, {'total': total, 'queries': sample.queries, 'db': sample.db_time,
+                         'template': sample.template_time, 'size': size, 'n_plus_one': bool(repeated)},
+                  (repeated[0][:500], repeated[1]) if repeated else None)
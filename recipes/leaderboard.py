@@ -0,0 +1,116 @@
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+# classifiche delle ricette, tutte mantenute in colonne indicizzate di Recipe e aggiornate dai signal dei like
+# (recipes.signals.count_likes) sotto il lock della riga, così la home legge i primi N scendendo lungo un indice:
+#   ALL_TIME  like_count, like totali
+#   WEEKLY    weekly_like_count, like degli ultimi WEEKLY_WINDOW giorni (refresh_leaderboards toglie quelli scaduti)
+#   TRENDING  trending_score, somma dei like pesati con decadimento esponenziale (emivita TRENDING_HALF_LIFE_DAYS)
+#
+# Il trending è salvato in forma logaritmica rispetto a un'epoca fissa: score = log(sum(exp(k * (t_i - EPOCH)))).
+# Il decadimento moltiplica tutti i punteggi per lo stesso fattore, quindi l'ordinamento non cambia col passare
+# del tempo e un nuovo like si somma senza rileggere gli altri. I like precedenti all'epoca pesano meno di 1 e
+# il punteggio può essere negativo: una ricetta è in classifica se ha like (like_count), non se il punteggio
+# è diverso da 0.
+
+ALL_TIME = 'all'
+WEEKLY = 'weekly'
+TRENDING = 'trending'
+BOARDS = {
+    ALL_TIME: 'like_count',
+    WEEKLY: 'weekly_like_count',
+    TRENDING: 'trending_score',
+}
+# colonna che dice se una ricetta compare nella classifica
+MEMBERSHIP = {
+    ALL_TIME: 'like_count',
+    WEEKLY: 'weekly_like_count',
+    TRENDING: 'like_count',
+}
+WEEKLY_WINDOW = timedelta(days=7)
+EPOCH = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def decay_rate():
+    half_life = getattr(settings, 'TRENDING_HALF_LIFE_DAYS', 3)
+    return math.log(2) / (half_life * 86400)
+
+
+def like_weight(liked_at):
+    # log del peso di un singolo like
+    return decay_rate() * (liked_at - EPOCH).total_seconds()
+
+
+def add_to_score(score, liked_at, likes):
+    # likes: like della ricetta prima di questo
+    weight = like_weight(liked_at)
+    if not likes:
+        return weight
+    high, low = max(score, weight), min(score, weight)
+    return high + math.log1p(math.exp(low - high))
+
+
+def remove_from_score(score, liked_at, likes):
+    # likes: like che restano dopo aver tolto questo
+    if not likes:
+        return 0.0
+    # errori di arrotondamento: il like tolto era (quasi) tutto il punteggio, i rimanenti valgono al più 1e-9
+    difference = min(like_weight(liked_at) - score, -1e-9)
+    return score + math.log1p(-math.exp(difference))
+
+
+def score_from_likes(liked_at_list):
+    score = 0.0
+    for likes, liked_at in enumerate(liked_at_list):
+        score = add_to_score(score, liked_at, likes)
+    return score
+
+
+def add_like(counters, liked_at, now):
+    return {
+        'like_count': counters['like_count'] + 1,
+        'weekly_like_count': counters['weekly_like_count'] + (1 if liked_at >= now - WEEKLY_WINDOW else 0),
+        'trending_score': add_to_score(counters['trending_score'], liked_at, counters['like_count']),
+    }
+
+
+def remove_like(counters, liked_at, now):
+    in_window = liked_at >= now - WEEKLY_WINDOW
+    likes = max(counters['like_count'] - 1, 0)
+    return {
+        'like_count': likes,
+        'weekly_like_count': max(counters['weekly_like_count'] - (1 if in_window else 0), 0),
+        'trending_score': remove_from_score(counters['trending_score'], liked_at, likes),
+    }
+
+
+def refresh_weekly(recipe_model, like_model, now=None):
+    # toglie dalla classifica settimanale i like usciti dalla finestra: solo le ricette con un conteggio
+    # settimanale diverso da zero possono scendere, quindi si ricalcolano solo quelle (indice su weekly_like_count)
+    since = (now or timezone.now()) - WEEKLY_WINDOW
+    weekly = (like_model.objects.filter(recipe_id=OuterRef('pk'), created_at__gte=since).order_by()
+              .values('recipe_id').annotate(c=Count('*')).values('c'))
+    return recipe_model.objects.filter(weekly_like_count__gt=0).update(weekly_like_count=Coalesce(Subquery(weekly), 0))
+
+
+def rebuild(recipe_model, like_model, now=None, batch_size=1000):
+    # ricalcola da zero tutti i contatori leggendo la tabella dei like (migrazione e refresh_leaderboards --rebuild)
+    since = (now or timezone.now()) - WEEKLY_WINDOW
+    recipe_model.objects.filter(Q(like_count__gt=0) | Q(weekly_like_count__gt=0) | ~Q(trending_score=0)).update(
+        like_count=0, weekly_like_count=0, trending_score=0)
+    counters = {}
+    likes = like_model.objects.order_by().values_list('recipe_id', 'created_at')
+    for recipe_id, liked_at in likes.iterator(chunk_size=10000):
+        recipe = counters.setdefault(recipe_id, recipe_model(pk=recipe_id, like_count=0, weekly_like_count=0,
+                                                             trending_score=0.0))
+        recipe.trending_score = add_to_score(recipe.trending_score, liked_at, recipe.like_count)
+        recipe.like_count += 1
+        if liked_at >= since:
+            recipe.weekly_like_count += 1
+    recipe_model.objects.bulk_update(counters.values(), list(BOARDS.values()), batch_size=batch_size)
+    return len(counters)
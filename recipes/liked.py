@@ -0,0 +1,93 @@
+from array import array
+from bisect import bisect_left
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .caching import is_shared
+from .models import Like
+
+# ricette a cui un utente ha messo like, materializzate in cache come array ordinato di interi (8 byte per
+# like): caricate con una query la prima volta, poi le card e la pagina di dettaglio sanno se una ricetta
+# è tra i preferiti con una ricerca binaria, senza query. Il toggle aggiorna l'array a transazione
+# confermata (recipes.signals); la scadenza rimedia a un eventuale aggiornamento perso tra due toggle
+# concorrenti dello stesso utente. Serve una cache condivisa tra i processi: con la memoria locale un worker
+# non vedrebbe i toggle ricevuti dagli altri, quindi lì l'array non si materializza e si legge dal database.
+
+LIKED_TIMEOUT = 24 * 60 * 60
+TYPECODE = 'q'
+
+
+def _key(user_id):
+    return f'liked:{user_id}'
+
+
+class LikedSet:
+    def __init__(self, ids=()):
+        self.ids = ids if isinstance(ids, array) else array(TYPECODE, ids)
+
+    def __contains__(self, recipe_id):
+        i = bisect_left(self.ids, recipe_id)
+        return i < len(self.ids) and self.ids[i] == recipe_id
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+
+EMPTY = LikedSet()
+
+
+def _load(user_id):
+    if not is_shared():
+        return None
+    data = cache.get(_key(user_id))
+    if data is None:
+        return None
+    ids = array(TYPECODE)
+    ids.frombytes(data)
+    return ids
+
+
+def _store(user_id, ids):
+    if is_shared():
+        cache.set(_key(user_id), ids.tobytes(), LIKED_TIMEOUT)
+
+
+def liked_recipes(user):
+    if not user.is_authenticated:
+        return EMPTY
+    ids = _load(user.pk)
+    if ids is None:
+        ids = array(TYPECODE, Like.objects.filter(user_id=user.pk).order_by('recipe_id')
+                    .values_list('recipe_id', flat=True))
+        _store(user.pk, ids)
+    return LikedSet(ids)
+
+
+def _apply(user_id, recipe_id, liked):
+    ids = _load(user_id)
+    if ids is None:
+        # non ancora materializzato: lo farà la prossima lettura
+        return
+    i = bisect_left(ids, recipe_id)
+    present = i < len(ids) and ids[i] == recipe_id
+    if liked and not present:
+        ids.insert(i, recipe_id)
+    elif not liked and present:
+        del ids[i]
+    else:
+        return
+    _store(user_id, ids)
+
+
+def record_like(user_id, recipe_id, liked):
+    transaction.on_commit(lambda: _apply(user_id, recipe_id, liked))
+
+
+def forget(user_ids):
+    # cambiamenti in blocco: gli array vengono ricaricati alla prossima lettura
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: cache.delete_many([_key(user_id) for user_id in user_ids]))
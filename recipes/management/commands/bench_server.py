@@ -0,0 +1,128 @@
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# i due modi di servire il progetto: gunicorn con worker sincroni (WSGI) e gunicorn con worker uvicorn (ASGI)
+SERVERS = {
+    'wsgi': ['gunicorn', 'djangoProjectRecipe.wsgi:application'],
+    'asgi': ['gunicorn', 'djangoProjectRecipe.asgi:application', '-k', 'uvicorn.workers.UvicornWorker'],
+}
+DEFAULT_PATHS = ['/recipes/', '/categories/', '/api/recipes/']
+
+
+async def fetch(host, port, path, slow):
+    # una richiesta HTTP/1.1 su una connessione nuova; slow simula un client lento che manda gli header a pezzi
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\n'.encode())
+        await writer.drain()
+        if slow:
+            await asyncio.sleep(slow)
+        writer.write(f'Host: {host}\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+    finally:
+        writer.close()
+    return int(status_line.split()[1]), time.perf_counter() - start
+
+
+async def run_load(base_url, paths, requests, concurrency, slow):
+    url = urlsplit(base_url)
+    host, port = url.hostname, url.port or 80
+    latencies, errors = [], 0
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(paths[i % len(paths)])
+
+    async def client():
+        nonlocal errors
+        while not queue.empty():
+            path = queue.get_nowait()
+            try:
+                status, elapsed = await fetch(host, port, path, slow)
+            except OSError:
+                errors += 1
+                continue
+            if status >= 400:
+                errors += 1
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start, sorted(latencies), errors
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError(f'Server on {host}:{port} did not start in {timeout}s')
+
+
+# confronta throughput e latenze degli stessi URL serviti in WSGI e in ASGI, con client normali o lenti.
+# Il database usato è quello configurato: va popolato prima (es. con import_recipes)
+class Command(BaseCommand):
+    help = 'Benchmark the site under gunicorn WSGI and ASGI (uvicorn workers), or against a running server.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', help='Base URL of an already running server; skips starting gunicorn.')
+        parser.add_argument('--mode', choices=sorted(SERVERS), action='append',
+                            help='Server setups to compare (default: both).')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help=f'Paths to request (default: {DEFAULT_PATHS}).')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--slow-ms', type=int, default=0,
+                            help='Delay between the request line and the headers, to simulate slow clients.')
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or DEFAULT_PATHS
+        if options['server']:
+            self.report(options['server'], self.load(options['server'], paths, options))
+            return
+        for mode in options['mode'] or sorted(SERVERS, reverse=True):
+            base_url = f"http://127.0.0.1:{options['port']}"
+            command = SERVERS[mode] + ['-w', str(options['workers']), '-b', f"127.0.0.1:{options['port']}",
+                                       '--log-level', 'warning']
+            try:
+                server = subprocess.Popen(command, cwd=settings.BASE_DIR, env=os.environ.copy())
+            except FileNotFoundError:
+                raise CommandError('gunicorn is not installed (pip install -r requirements.txt)')
+            try:
+                wait_for_port('127.0.0.1', options['port'])
+                self.report(mode, self.load(base_url, paths, options))
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait()
+
+    def load(self, base_url, paths, options):
+        return asyncio.run(run_load(base_url, paths, options['requests'], options['concurrency'],
+                                    options['slow_ms'] / 1000))
+
+    def report(self, name, result):
+        elapsed, latencies, errors = result
+        if not latencies:
+            raise CommandError(f'{name}: every request failed')
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write(f'{name:6} req/s: {len(latencies) / elapsed:8.1f}  p50: {percentile(0.50):7.1f} ms  '
+                          f'p95: {percentile(0.95):7.1f} ms  p99: {percentile(0.99):7.1f} ms  errors: {errors}')
+        sys.stdout.flush()
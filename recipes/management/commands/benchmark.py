@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import benchmark
+
+
+# misura i percorsi principali (home, lista, dettaglio, ricerca, categoria, like, nuova ricetta) sul database
+# configurato, popolato prima con seed_benchmark. Con --output salva il risultato in JSON, con --compare
+# lo confronta con uno precedente ed esce con errore se trova regressioni
+class Command(BaseCommand):
+    help = 'Benchmark the core user journeys in-process and report latency percentiles and queries per request.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--journey', action='append', dest='journeys', help='Only run these journeys.')
+        parser.add_argument('--keep', action='store_true', help='Keep the likes and recipes created by the run.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--compare', help='A previous JSON result to compare against.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed p95 slowdown before it counts as a regression (default 0.2 = 20%%).')
+
+    def handle(self, *args, **options):
+        try:
+            result = benchmark.run(options['iterations'], options['warmup'], options['seed'], options['journeys'],
+                                   options['keep'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"{'journey':14} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'req/s':>8} errors")
+        for name, row in result['journeys'].items():
+            self.stdout.write(f"{name:14} {row['p50_ms']:8.1f} {row['p95_ms']:8.1f} {row['p99_ms']:8.1f} "
+                              f"{row['avg_queries']:8.1f} {row['throughput']:8.1f} {row['errors']}")
+        if options['output']:
+            benchmark.save(result, options['output'])
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options['compare']:
+            try:
+                baseline = benchmark.load(options['compare'])
+            except (OSError, json.JSONDecodeError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+            regressions = benchmark.compare(baseline, result, options['tolerance'])
+            if regressions:
+                raise CommandError(f"Regressions against {baseline.get('commit')}:\n" + '\n'.join(regressions))
+            self.stdout.write(f"No regressions against {baseline.get('commit')}")
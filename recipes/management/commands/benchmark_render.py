@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import benchmark
+
+
+# tempo di rendering di una pagina di card (per pagina e per card): il markup com'era nei template,
+# il tag recipe_cards a cache vuota e con le card già in cache
+class Command(BaseCommand):
+    help = 'Benchmark rendering a page of recipe cards, inline markup against the recipe_cards component.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=100)
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        try:
+            result = benchmark.render_cards(options['cards'], options['iterations'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"{result['cards']} cards per page")
+        self.stdout.write(f"{'template':10} {'page ms':>8} {'card us':>8}")
+        for name, row in result['templates'].items():
+            self.stdout.write(f"{name:10} {row['page_ms']:8.2f} {row['card_us']:8.1f}")
+        if options['output']:
+            benchmark.save(result, options['output'])
+            self.stdout.write(f"Results written to {options['output']}")
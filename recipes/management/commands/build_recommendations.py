@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from recipes import recommendations
+
+
+# da lanciare periodicamente (es. ogni notte): di norma ricalcola solo le ricette toccate dall'ultima build,
+# con --full tutte (serve anche dopo la cancellazione di utenti, che toglie like senza toccare le ricette)
+class Command(BaseCommand):
+    help = 'Build the "users who liked this also liked" lists from the likes table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every recipe, not only the changed ones.')
+        parser.add_argument('--top-k', type=int, default=recommendations.TOP_K)
+        parser.add_argument('--max-pairs', type=int, default=recommendations.MAX_PAIRS,
+                            help='Memory budget: co-occurrence pairs expanded per block.')
+
+    def handle(self, *args, **options):
+        count = recommendations.build(options['full'], options['top_k'], options['max_pairs'])
+        self.stdout.write(f'{count} recipes updated')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from recipes import sitemaps
+
+
+# da lanciare periodicamente (es. ogni ora): riscrive le shard della sitemap con ricette nuove, modificate o
+# cancellate dall'ultima volta e i feed cambiati, l'indice. Con --full riscrive tutto
+class Command(BaseCommand):
+    help = 'Regenerate the precomputed sitemap shards and RSS/Atom feeds that changed since the last run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Rewrite every shard and feed, not only the changed ones.')
+
+    def handle(self, *args, **options):
+        result = sitemaps.build(options['full'])
+        self.stdout.write(f"{result['rebuilt']} of {result['shards']} sitemap shards rewritten, "
+                          f"{result['deleted']} removed, {result['feeds']} feeds rewritten")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from recipes.caching import get_stats, reset_stats
+
+
+# contatori di hit/miss della cache di pagine e card, per dimensionare il backend
+class Command(BaseCommand):
+    help = 'Show hit/miss counters of the page and recipe card caches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them.')
+
+    def handle(self, *args, **options):
+        for kind, counters in get_stats().items():
+            total = counters['hits'] + counters['misses']
+            ratio = counters['hits'] / total * 100 if total else 0
+            self.stdout.write(f"{kind:6} hits: {counters['hits']:>10}  misses: {counters['misses']:>10}  "
+                              f"hit ratio: {ratio:5.1f}%")
+        if options['reset']:
+            reset_stats()
@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import benchmark, explain
+
+
+# EXPLAIN delle query di ogni pagina sul database configurato (popolato con seed_benchmark): segnala le
+# scansioni complete e gli ordinamenti senza indice. Con --output salva i piani in JSON, con --compare esce
+# con errore se una pagina ha segnalazioni che il risultato precedente non aveva
+class Command(BaseCommand):
+    help = 'Run EXPLAIN on the queries of each page and report full table scans and unindexed sorts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--page', action='append', dest='pages', help='Only explain these pages.')
+        parser.add_argument('--plans', action='store_true', help='Print every query with its plan.')
+        parser.add_argument('--output', help='Write the plans as JSON to this file.')
+        parser.add_argument('--compare', help='A previous JSON result to compare against.')
+
+    def handle(self, *args, **options):
+        try:
+            result = explain.run(options['seed'], options['pages'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for name, page in result['pages'].items():
+            self.stdout.write(f"{name}: {page['queries']} queries, status {page['status']}")
+            for problem in page['problems']:
+                self.stdout.write(f'  {problem}')
+            if options['plans']:
+                for query in page['plans']:
+                    self.stdout.write(f"\n  {query['sql']}")
+                    self.stdout.write('\n'.join(f'    {line}' for line in query['plan']))
+                self.stdout.write('')
+        if options['output']:
+            benchmark.save(result, options['output'])
+            self.stdout.write(f"Plans written to {options['output']}")
+
+        if options['compare']:
+            try:
+                baseline = benchmark.load(options['compare'])
+            except (OSError, json.JSONDecodeError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+            regressions = explain.compare(baseline, result)
+            if regressions:
+                raise CommandError(f"New plan problems against {baseline.get('commit')}:\n" + '\n'.join(regressions))
+            self.stdout.write(f"No new plan problems against {baseline.get('commit')}")
@@ -0,0 +1,25 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from recipes.bulk import FORMATS, export_records, guess_format, write_records
+
+
+# scrive tutte le ricette in JSON Lines o CSV, nello stesso formato letto da import_recipes
+class Command(BaseCommand):
+    help = 'Export all recipes as JSON Lines or CSV ("-" writes to stdout).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to csv for .csv files, jsonl otherwise.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or guess_format(path)
+        stream = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+        try:
+            count = write_records(stream, export_records(), format)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        self.stderr.write(f'{count} recipes exported')
@@ -0,0 +1,73 @@
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import storage
+from recipes.models import Recipe
+from recipes.signals import invalidate_recipes, touch_recipes
+
+
+# da lanciare periodicamente: cancella i file indirizzati per contenuto che nessuna riga usa più (quelli
+# sfuggiti a release(), ad es. ancora nel periodo di grazia). Con --rehash sposta prima nello schema per
+# hash i file caricati prima dello storage indirizzato per contenuto, unendo i duplicati
+class Command(BaseCommand):
+    help = 'Delete unreferenced content-addressed media files; --rehash migrates legacy uploads first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rehash', action='store_true', help='Move legacy uploads to content-addressed names.')
+        parser.add_argument('--grace', type=int, default=storage.GRACE_SECONDS,
+                            help='Keep orphans modified less than this many seconds ago.')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['rehash']:
+            self.rehash(options['dry_run'])
+
+        names = []
+        directories = default_storage.listdir(storage.CONTENT_DIR)[0] if default_storage.exists(
+            storage.CONTENT_DIR) else []
+        for directory in directories:
+            files = default_storage.listdir(f'{storage.CONTENT_DIR}/{directory}')[1]
+            names.extend(f'{storage.CONTENT_DIR}/{directory}/{name}' for name in files)
+
+        deleted = 0
+        for start in range(0, len(names), 1000):
+            chunk = names[start:start + 1000]
+            if options['dry_run']:
+                deleted += len(set(chunk) - storage.referenced(chunk))
+            else:
+                deleted += len(storage.collect(chunk, options['grace']))
+        self.stdout.write(f'{len(names)} content-addressed files, {deleted} unreferenced deleted'
+                          + (' (dry run)' if options['dry_run'] else ''))
+
+    def rehash(self, dry_run):
+        moved = 0
+        for label, field in storage.IMAGE_FIELDS:
+            model = apps.get_model(label)
+            default = model._meta.get_field(field).default
+            legacy = (model.objects.exclude(**{f'{field}__startswith': f'{storage.CONTENT_DIR}/'})
+                      .exclude(**{field: default}).exclude(**{field: ''})
+                      .values_list(field, flat=True).distinct())
+            for name in legacy.iterator():
+                if not default_storage.exists(name):
+                    self.stderr.write(f'{label}: missing file {name}')
+                    continue
+                moved += 1
+                if dry_run:
+                    continue
+                with default_storage.open(name) as f:
+                    new_name = default_storage.save(name, f)
+                # image_processed non corrisponde più: le pagine usano l'originale finché process_images
+                # non rigenera le rendition
+                with transaction.atomic():
+                    ids = list(Recipe.objects.filter(image=name).values_list('pk', flat=True))
+                    for other_label, other_field in storage.IMAGE_FIELDS:
+                        apps.get_model(other_label).objects.filter(**{other_field: name}).update(
+                            **{other_field: new_name})
+                    touch_recipes(ids)
+                    invalidate_recipes(ids)
+                storage.delete_file(name)
+        self.stdout.write(f'{moved} legacy files moved to content-addressed names')
+        if moved and not dry_run:
+            self.stdout.write('Run "manage.py process_images" to generate the renditions of the moved files.')
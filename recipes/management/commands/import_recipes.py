@@ -0,0 +1,31 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.bulk import BATCH_SIZE, FORMATS, RecipeImporter, guess_format, read_records
+
+
+# carica ricette in blocco da JSON Lines o CSV (vedi recipes.bulk per il formato dei record)
+class Command(BaseCommand):
+    help = 'Import recipes from a JSON Lines or CSV file ("-" reads from stdin).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to csv for .csv files, jsonl otherwise.')
+        parser.add_argument('--author', help='Username used for records without an author.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or guess_format(path)
+        importer = RecipeImporter(options['author'], options['batch_size'])
+        stream = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        try:
+            importer.run(read_records(stream, format))
+        except (ValueError, KeyError) as e:
+            raise CommandError(f'Import stopped after {importer.recipes} recipes: {e!r}')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write(f'{importer.recipes} recipes and {importer.ingredients} ingredients imported')
+        self.stdout.write('Run "manage.py process_images" to generate the image renditions.')
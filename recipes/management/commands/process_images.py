@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from recipes.images import process_image
+from recipes.models import Recipe
+from users.models import Profile
+
+
+# recupera le immagini non ancora elaborate (es. lavori persi a un riavvio del processo web,
+# dati importati o precedenti alla pipeline) elaborandole in modo sincrono
+class Command(BaseCommand):
+    help = 'Generate the missing image renditions for recipes and profiles.'
+
+    def handle(self, *args, **options):
+        for model in (Recipe, Profile):
+            pending = model.objects.exclude(image_processed=F('image')).values_list('pk', flat=True)
+            count = 0
+            for pk in pending.iterator():
+                process_image(model._meta.label, pk)
+                count += 1
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {count} processed')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import facets
+from recipes.caching import CATEGORIES, RECIPES, bump_on_commit
+
+
+# ricalcola da zero il cubo dei conteggi delle faccette (recipes.facets), che i signal tengono aggiornato:
+# serve solo come riparazione, es. dopo modifiche fatte direttamente sul database o un loaddata
+class Command(BaseCommand):
+    help = 'Rebuild the facet counts (recipes per category, difficulty and cooking time) from the recipes.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = facets.rebuild()
+            bump_on_commit(RECIPES, CATEGORIES)
+        self.stdout.write(f'{count} facet counts rebuilt')
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import leaderboard
+from recipes.caching import RECIPES, bump_on_commit
+from recipes.models import Like, Recipe
+from recipes.signals import invalidate_recipes, touch_recipes
+
+
+# da lanciare periodicamente (es. ogni ora): la classifica settimanale perde i like usciti dalla finestra.
+# Con --rebuild ricalcola tutti i contatori dalla tabella dei like (riparazione, dati importati)
+class Command(BaseCommand):
+    help = 'Refresh the weekly leaderboard, or rebuild every like counter with --rebuild.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recompute all counters from the likes table.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['rebuild']:
+                before = dict(Recipe.objects.filter(like_count__gt=0).values_list('pk', 'like_count'))
+                count = leaderboard.rebuild(Recipe, Like)
+                after = dict(Recipe.objects.filter(like_count__gt=0).values_list('pk', 'like_count'))
+                # le card mostrano like_count: le ricette cambiate vanno ridisegnate
+                changed = {pk for pk in before.keys() | after.keys() if before.get(pk) != after.get(pk)}
+                touch_recipes(changed)
+                invalidate_recipes(changed)
+                self.stdout.write(f'{count} recipes with likes rebuilt, {len(changed)} changed')
+            else:
+                count = leaderboard.refresh_weekly(Recipe, Like)
+                self.stdout.write(f'{count} weekly counters refreshed')
+            bump_on_commit(RECIPES)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from recipes.instrumentation import collect, summarize
+
+
+# misure per vista pubblicate nella cache dai processi web (recipes.instrumentation). Con la cache
+# in memoria locale ogni processo ha la sua copia: serve il backend file o redis (CACHE_BACKEND)
+class Command(BaseCommand):
+    help = 'Show per-view query counts, DB/template time, response size and N+1 warnings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help='Number of views to show.')
+        parser.add_argument('--sql', action='store_true', help='Print the repeated SQL of views flagged as N+1.')
+
+    def handle(self, *args, **options):
+        rows = summarize(collect())[:options['limit']]
+        if not rows:
+            self.stdout.write('No samples published yet (the cache backend must be shared by all processes).')
+            return
+        self.stdout.write(f"{'view':55} {'reqs':>6} {'avg ms':>8} {'p95 ms':>8} {'queries':>8} {'max q':>6} "
+                          f"{'db ms':>7} {'tpl ms':>7} {'KB':>7} {'N+1':>5}")
+        for row in rows:
+            self.stdout.write(f"{row['view'][:55]:55} {row['requests']:>6} {row['avg_ms']:>8.1f} {row['p95_ms']:>8.1f} "
+                              f"{row['avg_queries']:>8.1f} {row['max_queries']:>6} {row['avg_db_ms']:>7.1f} "
+                              f"{row['avg_template_ms']:>7.1f} {row['avg_kb']:>7.1f} {row['n_plus_one']:>5}")
+        if options['sql']:
+            for row in rows:
+                if row['repeated_sql']:
+                    self.stdout.write(f"\n{row['view']}: {row['repeated_count']} executions of\n{row['repeated_sql']}")
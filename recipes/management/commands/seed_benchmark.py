@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from recipes import benchmark
+
+
+# popola il database con un dataset sintetico per il comando benchmark; si può lanciare più volte
+# (gli utenti nuovi continuano la numerazione). Da non usare sul database di produzione
+class Command(BaseCommand):
+    help = 'Seed the database with a synthetic dataset for the benchmark command.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--ingredients', type=int, default=8, help='Ingredients per recipe.')
+        parser.add_argument('--categories', type=int, default=12)
+        parser.add_argument('--likes', type=int, default=20, help='Likes per user.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        created = benchmark.seed(options['users'], options['recipes'], options['ingredients'], options['categories'],
+                                 options['likes'], options['seed'])
+        self.stdout.write(', '.join(f'{count} {name}' for name, count in created.items()) + ' created')
+        self.stdout.write('Run "manage.py process_images" if the pages should show image renditions.')
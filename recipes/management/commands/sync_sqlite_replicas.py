@@ -0,0 +1,30 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+# per provare le repliche in locale: copia il database SQLite primario sui file delle repliche
+# (DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3), come farebbe la replicazione di PostgreSQL
+class Command(BaseCommand):
+    help = 'Copy the SQLite primary database onto the SQLite replica files.'
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('No replicas configured (DATABASE_REPLICA_URLS).')
+        primary = connections['default']
+        if primary.vendor != 'sqlite':
+            raise CommandError('Only SQLite databases can be synced this way.')
+        primary.ensure_connection()
+        for alias in settings.DATABASE_REPLICAS:
+            replica_settings = connections[alias].settings_dict
+            if 'sqlite' not in replica_settings['ENGINE']:
+                raise CommandError(f'{alias} is not an SQLite database.')
+            connections[alias].close()
+            target = sqlite3.connect(replica_settings['NAME'])
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(f"{alias}: copied to {replica_settings['NAME']}")
@@ -0,0 +1,114 @@
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .caching import INGREDIENTS, namespace_versions
+from .models import Ingredient, IngredientTerm, normalize_ingredient_name
+from .tasks import run_in_background
+
+# "cosa posso cucinare": indice invertito termine -> ricette, tenuto in memoria come array NumPy.
+# Ogni ricetta ha una posizione densa; per ogni termine la posting list è l'array ordinato delle
+# posizioni delle ricette che lo usano. Una ricerca somma le posting list dei termini dell'utente in un
+# vettore di contatori e lo divide per il numero di ingredienti di ogni ricetta (copertura).
+# La versione dell'indice è quella del namespace INGREDIENTS nella cache condivisa, incrementata dai signal
+# sugli ingredienti: quando cambia l'indice si ricostruisce in background e nel frattempo si usa quello vecchio.
+
+# dopo quanti secondi una ricostruzione che non è mai finita (es. lavoro perso) si può riaccodare
+REBUILD_TIMEOUT = 300
+
+
+class IngredientIndex:
+    def __init__(self, recipe_ids, sizes, postings):
+        self.recipe_ids = recipe_ids  # posizione -> id della ricetta
+        self.sizes = sizes  # posizione -> numero di ingredienti distinti della ricetta
+        self.postings = postings  # id del termine -> posizioni delle ricette
+
+    @classmethod
+    def build(cls):
+        pairs = (Ingredient.objects.filter(term__isnull=False, recipe__isnull=False).order_by()
+                 .values_list('term_id', 'recipe_id').distinct())
+        flat = np.fromiter((value for pair in pairs.iterator(chunk_size=10000) for value in pair), dtype=np.int64)
+        terms, recipes = flat[0::2], flat[1::2]
+        recipe_ids, positions = np.unique(recipes, return_inverse=True)
+        sizes = np.bincount(positions, minlength=len(recipe_ids)).astype(np.int32)
+
+        order = np.argsort(terms, kind='stable')
+        terms, positions = terms[order], positions[order].astype(np.int32)
+        term_ids, starts = np.unique(terms, return_index=True)
+        postings = {int(term_id): array for term_id, array in zip(term_ids, np.split(positions, starts[1:]))}
+        return cls(recipe_ids, sizes, postings)
+
+    def match(self, term_ids, limit=50):
+        # restituisce [(id_ricetta, ingredienti presenti, ingredienti totali)] per copertura decrescente
+        counts = np.zeros(len(self.recipe_ids), dtype=np.int32)
+        for term_id in set(term_ids):
+            posting = self.postings.get(term_id)
+            if posting is not None:
+                counts[posting] += 1
+        candidates = np.flatnonzero(counts)
+        if not len(candidates):
+            return []
+        matched, sizes = counts[candidates], self.sizes[candidates]
+        # a parità di copertura vince chi usa più ingredienti dell'utente
+        key = matched / sizes * 1000 + matched
+        if len(candidates) > limit:
+            best = np.argpartition(-key, limit)[:limit]
+            candidates, matched, sizes, key = candidates[best], matched[best], sizes[best], key[best]
+        order = np.argsort(-key, kind='stable')
+        return [(int(self.recipe_ids[candidates[i]]), int(matched[i]), int(sizes[i])) for i in order]
+
+
+_index = None
+_index_version = None
+_checked_at = 0.0
+_rebuilding_since = None
+_lock = threading.Lock()
+
+
+def _rebuild(version):
+    global _index, _index_version, _rebuilding_since
+    try:
+        index = IngredientIndex.build()
+        with _lock:
+            _index, _index_version = index, version
+    finally:
+        with _lock:
+            _rebuilding_since = None
+
+
+def get_index():
+    # la versione (una lettura dalla cache) si controlla al massimo una volta ogni INGREDIENT_INDEX_REFRESH
+    # secondi; se è cambiata la ricostruzione va in background, una per volta, e le richieste non aspettano.
+    # Solo il primo indice del processo si costruisce nella richiesta, sotto il lock
+    global _index, _index_version, _checked_at, _rebuilding_since
+    refresh = getattr(settings, 'INGREDIENT_INDEX_REFRESH', 30)
+    if _index is not None and time.monotonic() - _checked_at < refresh:
+        return _index
+    with _lock:
+        now = time.monotonic()
+        if _index is not None and now - _checked_at < refresh:
+            return _index
+        _checked_at = now
+        version = namespace_versions([INGREDIENTS])[0]
+        if _index is None:
+            _index, _index_version = IngredientIndex.build(), version
+            return _index
+        if version == _index_version or (_rebuilding_since is not None and now - _rebuilding_since < REBUILD_TIMEOUT):
+            return _index
+        _rebuilding_since = now
+    run_in_background(_rebuild, version)
+    # il vecchio, o già il nuovo se il lavoro è girato subito (BACKGROUND_TASKS_EAGER)
+    return _index
+
+
+def parse_ingredients(text):
+    # "Eggs, flour; milk" -> nomi normalizzati distinti, nell'ordine scritto dall'utente
+    names = [normalize_ingredient_name(part) for part in text.replace(';', ',').replace('\n', ',').split(',')]
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def match_recipes(names, limit=50):
+    term_ids = IngredientTerm.objects.filter(name__in=names).values_list('pk', flat=True)
+    return get_index().match(list(term_ids), limit)
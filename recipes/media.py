@@ -0,0 +1,146 @@
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+from .images import RENDITIONS_DIR
+from .storage import CONTENT_DIR, is_content_addressed
+
+# servizio dei media in produzione senza S3 (SERVE_MEDIA). Il file può essere consegnato da Django in
+# streaming (gunicorn lo spedisce con sendfile, senza copiarlo in user space, anche per le richieste Range)
+# oppure, con MEDIA_SENDFILE, delegato al server web davanti: 'x-accel-redirect' per nginx (location
+# interna MEDIA_ACCEL_REDIRECT_PREFIX che punta a MEDIA_ROOT), 'x-sendfile' per Apache/lighttpd.
+# I file indirizzati per contenuto (recipes.storage) e le loro rendition non cambiano mai: cache di un anno
+# con immutable; gli altri (es. default.jpg) hanno una scadenza breve e si rivalidano con ETag.
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+MEDIA_MAX_AGE = 24 * 60 * 60
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def is_immutable(path):
+    return is_content_addressed(path) or path.startswith(f'{RENDITIONS_DIR}/{CONTENT_DIR}/')
+
+
+def cache_control(path):
+    if is_immutable(path):
+        return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return f'public, max-age={MEDIA_MAX_AGE}'
+
+
+def parse_range(header, size):
+    # (inizio, fine inclusa) di un singolo intervallo; None se l'header va ignorato (più intervalli o
+    # sintassi non valida: si risponde con il file intero), ValueError se l'intervallo non è soddisfacibile
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        # ultimi N byte
+        length = int(end)
+        if not length:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def limited(file, length, block_size):
+    while length > 0:
+        chunk = file.read(min(block_size, length))
+        if not chunk:
+            break
+        length -= len(chunk)
+        yield chunk
+
+
+class RangeFileResponse(FileResponse):
+    # risposta 206 per i length byte a partire dalla posizione corrente del file. Con wsgi.file_wrapper
+    # gunicorn li spedisce con sendfile (parte dalla posizione del file e si ferma a Content-Length),
+    # gli altri server leggono streaming_content, limitato qui agli stessi byte
+    def __init__(self, file, length, *args, **kwargs):
+        self.range_length = length
+        super().__init__(file, *args, status=206, **kwargs)
+
+    def _set_streaming_content(self, value):
+        super()._set_streaming_content(value)
+        if self.file_to_stream is not None:
+            self._iterator = limited(self.file_to_stream, self.range_length, self.block_size)
+            self['Content-Length'] = self.range_length
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        stats = os.stat(fullpath)
+    except (OSError, ValueError, SuspiciousFileOperation):
+        # path inesistente, con caratteri non validi o fuori da MEDIA_ROOT
+        raise Http404('No such media file')
+    if not stat.S_ISREG(stats.st_mode):
+        raise Http404('No such media file')
+
+    etag = quote_etag(f'{int(stats.st_mtime):x}-{stats.st_size:x}')
+    headers = {'Cache-Control': cache_control(path), 'ETag': etag, 'Last-Modified': http_date(stats.st_mtime)}
+    if not_modified(request, etag, stats.st_mtime):
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    content_type = mimetypes.guess_type(fullpath)[0] or 'application/octet-stream'
+    mode = getattr(settings, 'MEDIA_SENDFILE', '')
+    if mode == 'x-accel-redirect':
+        # nginx gestisce da sé Range e sendfile; Cache-Control e Content-Type vengono conservati
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + path
+    elif mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = fullpath
+    else:
+        response = file_response(request, fullpath, stats.st_size, etag, content_type)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def not_modified(request, etag, mtime):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return since is not None and int(mtime) <= since
+
+
+def file_response(request, fullpath, size, etag, content_type):
+    header = request.META.get('HTTP_RANGE')
+    # If-Range: l'intervallo vale solo se il client ha ancora questa versione del file
+    if header and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        try:
+            byte_range = parse_range(header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+    else:
+        byte_range = None
+
+    file = open(fullpath, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        file.seek(start)
+        response = RangeFileResponse(file, end - start + 1, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
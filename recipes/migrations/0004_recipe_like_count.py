@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:05
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_like_count(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Like = Recipe.likes.through
+    counts = (Like.objects.filter(recipe_id=OuterRef('pk')).order_by()
+              .values('recipe_id').annotate(c=Count('*')).values('c'))
+    Recipe.objects.update(like_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_alter_ingredient_recipe'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='like_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_like_count, migrations.RunPython.noop),
+    ]
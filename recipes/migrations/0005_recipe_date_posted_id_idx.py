@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_like_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['date_posted', 'id'], name='recipe_date_posted_id_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+from django.db import migrations
+
+# indice full-text delle ricette (vedi recipes.search): colonna tsvector con indice GIN su PostgreSQL,
+# tabella virtuale FTS5 su SQLite. Non è nello stato dei modelli perché dipende dal database.
+
+POSTGRES_FORWARD = [
+    'ALTER TABLE recipes_recipe ADD COLUMN search_vector tsvector',
+    'CREATE INDEX recipe_search_vector_gin ON recipes_recipe USING gin (search_vector)',
+    """
+    UPDATE recipes_recipe AS r SET search_vector =
+        setweight(to_tsvector('english', coalesce(r.title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce((
+            SELECT string_agg(i.name, ' ') FROM recipes_ingredient i WHERE i.recipe_id = r.id), '')), 'B') ||
+        setweight(to_tsvector('english', coalesce((
+            SELECT string_agg(c.name, ' ') FROM recipes_category c
+            JOIN recipes_recipe_category rc ON rc.category_id = c.id WHERE rc.recipe_id = r.id), '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(r.description, '')), 'C')
+    """,
+]
+POSTGRES_BACKWARD = [
+    'DROP INDEX recipe_search_vector_gin',
+    'ALTER TABLE recipes_recipe DROP COLUMN search_vector',
+]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5(
+        title, description, ingredients, categories, tokenize = 'porter unicode61'
+    )
+    """,
+    """
+    INSERT INTO recipes_recipe_fts (rowid, title, description, ingredients, categories)
+    SELECT r.id, r.title, r.description,
+        (SELECT group_concat(i.name, ' ') FROM recipes_ingredient i WHERE i.recipe_id = r.id),
+        (SELECT group_concat(c.name, ' ') FROM recipes_category c
+         JOIN recipes_recipe_category rc ON rc.category_id = c.id WHERE rc.recipe_id = r.id)
+    FROM recipes_recipe r
+    """,
+]
+SQLITE_BACKWARD = [
+    'DROP TABLE recipes_recipe_fts',
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_image_renditions'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            run_for_vendor({'postgresql': POSTGRES_BACKWARD, 'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:11
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# copia di recipes.models.normalize_ingredient_name com'era quando è stata scritta la migrazione
+def normalize_ingredient_name(name):
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    words = re.sub(r'[^a-z0-9 ]+', ' ', name.lower()).split()
+    if words:
+        last = words[-1]
+        if len(last) > 4 and last.endswith(('oes', 'ies')):
+            last = last[:-3] + ('o' if last.endswith('oes') else 'y')
+        elif len(last) > 3 and last.endswith('s') and not last.endswith('ss'):
+            last = last[:-1]
+        words[-1] = last
+    return ' '.join(words)
+
+
+def link_ingredient_terms(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientTerm = apps.get_model('recipes', 'IngredientTerm')
+    names = {}
+    for pk, name in Ingredient.objects.values_list('pk', 'name').iterator():
+        normalized = normalize_ingredient_name(name)
+        if normalized:
+            names.setdefault(normalized, []).append(pk)
+    IngredientTerm.objects.bulk_create([IngredientTerm(name=name) for name in names], batch_size=500)
+    for term in IngredientTerm.objects.iterator():
+        Ingredient.objects.filter(pk__in=names[term.name]).update(term=term)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=250, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='term',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ingredients', to='recipes.ingredientterm'),
+        ),
+        migrations.RunPython(link_ingredient_terms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,86 @@
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+import django.utils.timezone
+
+# formula delle classifiche com'era quando è stata scritta la migrazione (recipes.leaderboard)
+EPOCH = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def backfill_likes(apps, schema_editor):
+    # l'ora dei like esistenti non è nota: si usa la data di pubblicazione della ricetta
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Like = apps.get_model('recipes', 'Like')
+    posted = Recipe.objects.filter(pk=OuterRef('recipe_id')).values('date_posted')
+    Like.objects.update(created_at=Subquery(posted))
+
+    rate = math.log(2) / (getattr(settings, 'TRENDING_HALF_LIFE_DAYS', 3) * 86400)
+    since = django.utils.timezone.now() - timedelta(days=7)
+    counters = {}
+    likes = Like.objects.order_by().values_list('recipe_id', 'created_at')
+    for recipe_id, liked_at in likes.iterator(chunk_size=10000):
+        recipe = counters.setdefault(recipe_id, Recipe(pk=recipe_id, like_count=0, weekly_like_count=0,
+                                                       trending_score=0.0))
+        weight = rate * (liked_at - EPOCH).total_seconds()
+        if recipe.like_count:
+            high, low = max(recipe.trending_score, weight), min(recipe.trending_score, weight)
+            weight = high + math.log1p(math.exp(low - high))
+        recipe.trending_score = weight
+        recipe.like_count += 1
+        recipe.weekly_like_count += liked_at >= since
+    Recipe.objects.filter(like_count__gt=0).update(like_count=0)
+    Recipe.objects.bulk_update(counters.values(), ['like_count', 'weekly_like_count', 'trending_score'],
+                               batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0009_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='trending_score',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='weekly_like_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        # la tabella recipes_recipe_likes esiste già (era quella automatica della M2M): cambia solo lo stato
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Like',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='recipes.recipe')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'recipes_recipe_likes',
+                        'unique_together': {('recipe', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='recipe',
+                    name='likes',
+                    field=models.ManyToManyField(blank=True, related_name='likes', through='recipes.Like', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='like',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_likes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_like_leaderboards'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(db_index=True, default='default.jpg', upload_to='recipesPics'),
+        ),
+    ]
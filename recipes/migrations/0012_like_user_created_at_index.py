@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_image_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='like_user_created_at_idx'),
+        ),
+    ]
@@ -0,0 +1,106 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def adopt_m2m_ingredients(apps, schema_editor):
+    # la M2M Recipe.ingredients duplicava la FK Ingredient.recipe: gli ingredienti collegati solo dalla M2M
+    # passano alla FK, quelli collegati a più ricette vengono copiati per le ricette in più
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    Through = Recipe.ingredients.through
+    owners = dict(Ingredient.objects.filter(pk__in=Through.objects.values('ingredient_id'))
+                  .values_list('pk', 'recipe_id'))
+    adopted, copies = {}, []
+    rows = Through.objects.order_by('ingredient_id', 'recipe_id').values_list('ingredient_id', 'recipe_id')
+    for ingredient_id, recipe_id in rows.iterator():
+        if owners[ingredient_id] is None:
+            owners[ingredient_id] = recipe_id
+            adopted.setdefault(recipe_id, []).append(ingredient_id)
+        elif owners[ingredient_id] != recipe_id:
+            copies.append((ingredient_id, recipe_id))
+    for recipe_id, ids in adopted.items():
+        Ingredient.objects.filter(pk__in=ids).update(recipe_id=recipe_id)
+    sources = Ingredient.objects.in_bulk({ingredient_id for ingredient_id, _ in copies})
+    Ingredient.objects.bulk_create([
+        Ingredient(recipe_id=recipe_id, name=sources[ingredient_id].name, quantity=sources[ingredient_id].quantity,
+                   term_id=sources[ingredient_id].term_id)
+        for ingredient_id, recipe_id in copies
+    ], batch_size=500)
+
+
+def restore_m2m_ingredients(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    Through = Recipe.ingredients.through
+    Through.objects.bulk_create([
+        Through(recipe_id=recipe_id, ingredient_id=ingredient_id)
+        for ingredient_id, recipe_id in Ingredient.objects.filter(recipe__isnull=False)
+        .values_list('pk', 'recipe_id').iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0013_recipe_similarity'),
+    ]
+
+    operations = [
+        migrations.RunPython(adopt_m2m_ingredients, restore_m2m_ingredients),
+        migrations.RemoveField(
+            model_name='recipe',
+            name='ingredients',
+        ),
+        # la tabella recipes_recipe_category esiste già (era quella automatica della M2M): cambia solo lo stato
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='RecipeCategory',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='recipes.category')),
+                        ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='recipes.recipe')),
+                    ],
+                    options={
+                        'db_table': 'recipes_recipe_category',
+                        'unique_together': {('recipe', 'category')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='recipe',
+                    name='category',
+                    field=models.ManyToManyField(through='recipes.RecipeCategory', to='recipes.Category'),
+                ),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='recipecategory',
+            name='category',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='recipes.category'),
+        ),
+        migrations.AlterField(
+            model_name='recipecategory',
+            name='recipe',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='recipes.recipe'),
+        ),
+        migrations.AddIndex(
+            model_name='recipecategory',
+            index=models.Index(fields=['category', 'recipe'], name='recipe_category_category_idx'),
+        ),
+        migrations.AlterField(
+            model_name='like',
+            name='recipe',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='recipes.recipe'),
+        ),
+        migrations.AlterField(
+            model_name='like',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['user', 'recipe'], name='like_user_recipe_idx'),
+        ),
+    ]
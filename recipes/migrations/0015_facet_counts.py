@@ -0,0 +1,50 @@
+from bisect import bisect_left
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def build_facet_counts(apps, schema_editor):
+    # copia di recipes.facets.rebuild sui modelli storici: per ogni ricetta le celle (0, 0), (0, c), (c, 0)
+    # e (c, o) per ogni coppia delle sue categorie, nella sua difficoltà e fascia di tempo (15, 30, 60 minuti)
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeCategory = apps.get_model('recipes', 'RecipeCategory')
+    FacetCount = apps.get_model('recipes', 'FacetCount')
+    state = {pk: (difficulty, bisect_left([15, 30, 60], minutes), set())
+             for pk, difficulty, minutes in Recipe.objects.values_list('pk', 'difficulty', 'cooking_time').iterator()}
+    for recipe_id, category_id in RecipeCategory.objects.values_list('recipe_id', 'category_id').iterator():
+        if recipe_id in state:
+            state[recipe_id][2].add(category_id)
+    counts = Counter()
+    for difficulty, bucket, categories in state.values():
+        pairs = [(0, 0)] + [(0, c) for c in categories] + [(c, o) for c in categories for o in [0, *categories]]
+        counts.update({(selected, category, difficulty, bucket) for selected, category in pairs})
+    FacetCount.objects.bulk_create([
+        FacetCount(selected=selected, category=category, difficulty=difficulty, time_bucket=bucket, recipes=n)
+        for (selected, category, difficulty, bucket), n in counts.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_schema_cleanup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('selected', models.PositiveIntegerField()),
+                ('category', models.PositiveIntegerField()),
+                ('difficulty', models.PositiveSmallIntegerField()),
+                ('time_bucket', models.PositiveSmallIntegerField()),
+                ('recipes', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('selected', 'category', 'difficulty', 'time_bucket')},
+            },
+        ),
+        migrations.RunPython(build_facet_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def copy_updated_at(apps, schema_editor):
+    # per le ricette esistenti l'ora dell'ultima modifica vera non è nota: si parte da updated_at
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Recipe.objects.update(content_updated_at=F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_ingredient_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='content_updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_updated_at, migrations.RunPython.noop),
+    ]
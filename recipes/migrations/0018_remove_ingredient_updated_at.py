@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:43
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0017_recipe_content_updated_at'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='ingredient',
+            name='updated_at',
+        ),
+    ]
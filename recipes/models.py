@@ -1,51 +1,222 @@
+import re
+import unicodedata
+
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import ManyToManyField
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, ManyToManyField
+from django.db.models.functions import Length, Substr
 from django.utils import timezone
-from PIL import Image
 from django.utils.text import slugify
-from django.urls import reverse
+from django.urls import get_script_prefix, get_urlconf, reverse
+
+from . import leaderboard
+from .images import rendition_url, schedule_image_processing
 
 
 # Create your models here.
 
+# spazio lasciato in fondo allo slug per il suffisso numerico
+SLUG_SUFFIX_LENGTH = 10
+# tentativi di salvataggio quando un inserimento concorrente prende lo stesso slug
+SLUG_ATTEMPTS = 5
+
+
+def slug_base(model, text):
+    max_length = model._meta.get_field('slug').max_length
+    return slugify(text)[:max_length - SLUG_SUFFIX_LENGTH].strip('-') or model._meta.model_name
+
+
+def last_slug_number(model, base):
+    # una sola query qualunque sia il numero di doppioni: tra base, base-1, base-2, ... si prende lo slug
+    # col suffisso più alto (il più lungo, a parità di lunghezza l'ultimo in ordine alfabetico). I suffissi con
+    # zeri iniziali (es. pasta-007 da un'importazione) non si confrontano così e non sono mai generati qui, quindi
+    # non possono collidere: vengono ignorati. None se la base è libera, 0 se è usata solo la base senza suffisso
+    last = (model.objects.filter(slug__startswith=base, slug__regex=r'^%s(-[1-9][0-9]*)?$' % re.escape(base))
+            .order_by(Length('slug').desc(), '-slug').values_list('slug', flat=True).first())
+    if last is None or last == base:
+        return None if last is None else 0
+    return int(last[len(base) + 1:])
+
+
+def generate_unique_slug(model, text):
+    base = slug_base(model, text)
+    number = last_slug_number(model, base)
+    return base if number is None else f'{base}-{number + 1}'
+
+
+class UniqueSlugMixin:
+    # assegna lo slug da slug_source al primo salvataggio; se un inserimento concorrente ha preso lo stesso
+    # slug il vincolo unique fa fallire il savepoint e si riprova con uno slug nuovo
+    slug_source = 'title'
+
+    def save(self, *args, **kwargs):
+        if self.slug:
+            return super().save(*args, **kwargs)
+        for attempt in range(SLUG_ATTEMPTS):
+            self.slug = generate_unique_slug(type(self), getattr(self, self.slug_source))
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                # errori non dovuti allo slug (es. nome duplicato) o troppi tentativi: si rilancia
+                if attempt == SLUG_ATTEMPTS - 1 or not type(self).objects.filter(slug=self.slug).exists():
+                    self.slug = ''
+                    raise
+
+
 # vengono create dall'amministratore (admin) l'utente le sceglie
-class Category(models.Model):
+class Category(UniqueSlugMixin, models.Model):
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=100, unique=True, blank=True)
+    # validatore delle risposte dell'API che mostrano le categorie (recipes.api)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    slug_source = 'name'
 
     def __str__(self):
         return self.name
 
-    def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = generate_unique_slug(self.name)
-        super().save(*args, **kwargs)
+
+def normalize_ingredient_name(name):
+    # forma canonica del nome: minuscolo, senza accenti né punteggiatura, ultima parola al singolare
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    words = re.sub(r'[^a-z0-9 ]+', ' ', name.lower()).split()
+    if words:
+        last = words[-1]
+        if len(last) > 4 and last.endswith(('oes', 'ies')):
+            last = last[:-3] + ('o' if last.endswith('oes') else 'y')
+        elif len(last) > 3 and last.endswith('s') and not last.endswith('ss'):
+            last = last[:-1]
+        words[-1] = last
+    return ' '.join(words)
+
+
+# vocabolario normalizzato degli ingredienti: "Eggs", "egg" ed "EGG " sono lo stesso termine
+class IngredientTerm(models.Model):
+    name = models.CharField(max_length=250, unique=True)
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def for_name(cls, name):
+        normalized = normalize_ingredient_name(name)
+        if not normalized:
+            return None
+        return cls.objects.get_or_create(name=normalized)[0]
+
+    @classmethod
+    def ids_for_names(cls, names):
+        # per i salvataggi in blocco (bulk_create non chiama Ingredient.save): nome normalizzato -> id,
+        # creando i termini mancanti, con due o tre query in tutto
+        names = {normalize_ingredient_name(name) for name in names} - {''}
+        terms = dict(cls.objects.filter(name__in=names).values_list('name', 'pk'))
+        missing = names - terms.keys()
+        if missing:
+            cls.objects.bulk_create([cls(name=name) for name in missing], ignore_conflicts=True)
+            terms.update(cls.objects.filter(name__in=missing).values_list('name', 'pk'))
+        return terms
 
 
 class Ingredient(models.Model):
     recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE, null=True)
     name = models.CharField(max_length=250)
     quantity = models.CharField(max_length=250, blank=True, null=True)
+    term = models.ForeignKey(IngredientTerm, on_delete=models.SET_NULL, null=True, editable=False,
+                             related_name='ingredients')
 
     def __str__(self):
         return f"{self.quantity} of {self.name}"
 
+    def save(self, *args, **kwargs):
+        self.term = IngredientTerm.for_name(self.name)
+        super().save(*args, **kwargs)
+
     class Meta:
         app_label = 'recipes'
 
 
-def generate_unique_slug(title):
-    slug = slugify(title)
-    unique_slug = slug
-    counter = 1
-    while Recipe.objects.filter(slug=unique_slug).exists():
-        unique_slug = f"{slug}-{counter}"
-        counter += 1
-    return unique_slug
+# lunghezza dell'estratto di description mostrato nelle card
+SUMMARY_LENGTH = 300
+# preferiti dall'ultimo like al primo (indice (user, created_at, id) della tabella dei like)
+LIKED_ORDERING = ('-liked_at', '-like_id')
+
+
+class RecipeQuerySet(models.QuerySet):
+    def for_cards(self):
+        # tutto quello che serve alle card in una sola query: autore in join, i TextField pesanti
+        # restano sul database e della description viene caricato solo un estratto (summary)
+        return (self.select_related('author')
+                .defer('content', 'description')
+                .annotate(summary=Substr('description', 1, SUMMARY_LENGTH)))
+
+    def liked_by(self, user):
+        # ricette apprezzate dall'utente con l'ora del like, da ordinare con LIKED_ORDERING
+        return self.filter(like__user=user).annotate(liked_at=F('like__created_at'), like_id=F('like__id'))
 
+    def leaderboard(self, board):
+        # board: leaderboard.ALL_TIME / WEEKLY / TRENDING, ognuna ha la sua colonna indicizzata; solo le ricette
+        # che hanno like nella classifica
+        return (self.filter(**{leaderboard.MEMBERSHIP[board] + '__gt': 0})
+                .order_by('-' + leaderboard.BOARDS[board]))
 
-class Recipe(models.Model):
+
+# tabella dei like (era la tabella automatica della M2M Recipe.likes), con l'ora del like per le classifiche
+class Like(models.Model):
+    # senza indici propri: le ricerche per ricetta usano il vincolo unique (recipe, user), quelle per utente
+    # i due indici qui sotto, che iniziano da user
+    recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE, db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = 'recipes_recipe_likes'
+        unique_together = [('recipe', 'user')]
+        indexes = [
+            # pagina dei preferiti ordinata per data del like (chiave della paginazione a cursore)
+            models.Index(fields=['user', 'created_at', 'id'], name='like_user_created_at_idx'),
+            # ricette apprezzate da un utente già in ordine di id (recipes.liked), senza leggere la tabella
+            models.Index(fields=['user', 'recipe'], name='like_user_recipe_idx'),
+        ]
+
+
+# tabella delle categorie di una ricetta (era la tabella automatica della M2M Recipe.category)
+class RecipeCategory(models.Model):
+    # senza indice proprio: coperto dal vincolo unique (recipe, category)
+    recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE, db_index=False)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, db_index=False)
+
+    class Meta:
+        db_table = 'recipes_recipe_category'
+        unique_together = [('recipe', 'category')]
+        indexes = [
+            # ricette di una categoria (pagina della categoria, API, ricette simili) senza leggere la tabella
+            models.Index(fields=['category', 'recipe'], name='recipe_category_category_idx'),
+        ]
+
+
+# URL del dettaglio senza un reverse() per ricetta (card, sitemap): il pattern viene risolto una volta per
+# script prefix e URLconf con uno slug segnaposto, poi basta sostituirlo. Uno slug valido non va mai quotato
+_URL_PLACEHOLDER = 'recipe-slug'
+_detail_urls = {}
+
+
+def recipe_url_parts():
+    # (prima, dopo lo slug): chi costruisce molti URL lo chiede una volta sola
+    key = (get_script_prefix(), get_urlconf())
+    parts = _detail_urls.get(key)
+    if parts is None:
+        parts = _detail_urls[key] = tuple(reverse('recipesDetail', kwargs={'slug': _URL_PLACEHOLDER}).rsplit(
+            _URL_PLACEHOLDER, 1))
+    return parts
+
+
+def recipe_url(slug):
+    before, after = recipe_url_parts()
+    return before + slug + after
+
+
+class Recipe(UniqueSlugMixin, models.Model):
     DIFFICULTY_LEVELS = [
         (1, 'Very Easy'),
         (2, 'Easy'),
@@ -53,38 +224,111 @@ class Recipe(models.Model):
         (4, 'Hard'),
         (5, 'Very Hard'),
     ]
-    image = models.ImageField(default='default.jpg', upload_to='recipesPics')
+    # rendition generate in background (recipes.images): campo -> lato massimo in pixel
+    RENDITIONS = {'image_card': 200, 'image_home': 300, 'image_detail': 500}
+    # indicizzato: recipes.storage conta i riferimenti a un file cercandolo qui
+    image = models.ImageField(default='default.jpg', upload_to='recipesPics', db_index=True)
+    image_card = models.CharField(max_length=255, blank=True, editable=False)
+    image_home = models.CharField(max_length=255, blank=True, editable=False)
+    image_detail = models.CharField(max_length=255, blank=True, editable=False)
+    # immagine sorgente da cui sono state generate le rendition
+    image_processed = models.CharField(max_length=255, blank=True, editable=False)
     title = models.CharField(max_length=100)
     description = models.TextField()
     content = models.TextField()
     date_posted = models.DateTimeField(default=timezone.now)
+    # cambia a ogni modifica di quello che la ricetta mostra (anche like, ingredienti, categorie, immagini)
+    updated_at = models.DateTimeField(auto_now=True)
+    # solo le modifiche al contenuto (testo, ingredienti, categorie, immagine), non i like: lastmod di sitemap e feed
+    content_updated_at = models.DateTimeField(auto_now=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     difficulty = models.IntegerField(choices=DIFFICULTY_LEVELS, default=3)
     portions = models.IntegerField()
     cooking_time = models.IntegerField()
-    ingredients = models.ManyToManyField(Ingredient, related_name='recipes')
     slug = models.SlugField(max_length=100, unique=True, blank=True)
-    category = ManyToManyField(Category)
-    likes = models.ManyToManyField(User, related_name='likes', blank=True)
+    category = ManyToManyField(Category, through=RecipeCategory)
+    likes = models.ManyToManyField(User, related_name='likes', blank=True, through=Like)
+    # contatori denormalizzati dei like e classifiche (recipes.leaderboard), mantenuti dai signal dei like
+    # (recipes.signals.count_likes) per ogni like aggiunto o tolto, da toggle_like come dall'admin o dalla shell
+    like_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+    weekly_like_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+    trending_score = models.FloatField(default=0, db_index=True, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # ordinamento dei feed e chiave della paginazione a cursore (date_posted, id)
+            models.Index(fields=['date_posted', 'id'], name='recipe_date_posted_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def is_liked_by(self, user):
+        # una sola lookup sull'indice univoco (recipe_id, user_id) della tabella dei like
+        if not user.is_authenticated:
+            return False
+        return Like.objects.filter(recipe_id=self.pk, user_id=user.pk).exists()
+
+    def toggle_like(self, user):
+        # il lock sulla riga della ricetta serializza i toggle concorrenti; contatori, classifiche e updated_at
+        # li aggiornano i signal dei like (recipes.signals.count_likes), come per ogni altro likes.add/remove
+        with transaction.atomic():
+            Recipe.objects.select_for_update().filter(pk=self.pk).values_list('pk').get()
+            liked = Like.objects.filter(recipe_id=self.pk, user_id=user.pk).exists()
+            if liked:
+                self.likes.remove(user)
+            else:
+                self.likes.add(user)
+            self.refresh_from_db(fields=[*leaderboard.BOARDS.values(), 'updated_at'])
+        return not liked
+
     def get_absolute_url(self):
-        return reverse('recipes:recipe_detail', kwargs={'pk': self.slug})
+        return recipe_url(self.slug)
 
     def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = generate_unique_slug(self.title)
         super().save(*args, **kwargs)
 
-        self.resize_image()
+        schedule_image_processing(self)
+
+    @property
+    def card_image_url(self):
+        return rendition_url(self, 'image_card')
+
+    @property
+    def home_image_url(self):
+        return rendition_url(self, 'image_home')
+
+    @property
+    def detail_image_url(self):
+        return rendition_url(self, 'image_detail')
 
-    def resize_image(self):
-        image = Image.open(self.image)
-        img = Image.open(self.image.path)
-        # metodo che serve a risparmiare spazio perché ridimensiona le immagini
-        if img.height > 300 or img.width > 300:
-            output_size = (300, 300)
-            img.thumbnail(output_size)
-            img.save(self.image.path)
+
+class FacetCount(models.Model):
+    # cubo dei conteggi della navigazione a faccette (recipes.facets): quante ricette ci sono con una certa
+    # difficoltà e fascia di tempo, tra quelle della categoria selected, contando solo quelle che sono anche
+    # in category. 0 al posto di una categoria vuol dire nessuna: (0, 0) sono tutte le ricette. Interi e non
+    # FK perché il vincolo unique non vale sulle righe con NULL
+    selected = models.PositiveIntegerField()
+    category = models.PositiveIntegerField()
+    difficulty = models.PositiveSmallIntegerField()
+    time_bucket = models.PositiveSmallIntegerField()
+    # può scendere sotto zero solo temporaneamente, tra due aggiornamenti concorrenti
+    recipes = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [('selected', 'category', 'difficulty', 'time_bucket')]
+
+
+class RecipeSimilarity(models.Model):
+    # le top-K ricette più simili a ogni ricetta secondo i like (recipes.recommendations), in ordine di rank
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='similarities')
+    similar = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='similar_to')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+    # inizio della build che ha scritto la riga: le modifiche successive vanno ricalcolate
+    built_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = [('recipe', 'rank')]
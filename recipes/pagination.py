@@ -0,0 +1,143 @@
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from django.http import Http404
+
+# ricette per pagina nei feed
+PAGE_SIZE = 24
+CURSOR_PARAM = 'cursor'
+CURSOR_SALT = 'recipes.pagination'
+
+
+# paginazione keyset (a cursore): invece di OFFSET la pagina successiva parte dai valori di ordinamento
+# dell'ultima riga mostrata, così il database scende lungo l'indice e la pagina 10.000 costa come la prima
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, previous_cursor, querydict):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.querydict = querydict
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def _querystring(self, cursor):
+        query = self.querydict.copy()
+        query[CURSOR_PARAM] = cursor
+        return query.urlencode()
+
+    # querystring complete (mantengono gli altri parametri, es. la ricerca) per i link del template
+    def next_querystring(self):
+        return self._querystring(self.next_cursor)
+
+    def previous_querystring(self):
+        return self._querystring(self.previous_cursor)
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, per_page=PAGE_SIZE, ordering=('-date_posted', '-id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = ordering
+        self.fields = [field.lstrip('-') for field in ordering]
+
+    def encode(self, obj, direction):
+        values = [self._to_json(getattr(obj, field)) for field in self.fields]
+        return signing.dumps([direction, values], salt=CURSOR_SALT, compress=True)
+
+    def decode(self, cursor):
+        try:
+            direction, values = signing.loads(cursor, salt=CURSOR_SALT)
+        except (signing.BadSignature, ValueError, TypeError):
+            raise Http404('Invalid cursor')
+        if direction not in ('n', 'p') or len(values) != len(self.fields):
+            raise Http404('Invalid cursor')
+        return direction, [self._from_json(field, value) for field, value in zip(self.fields, values)]
+
+    def _to_json(self, value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
+
+    def _from_json(self, field, value):
+        try:
+            model_field = self.queryset.model._meta.get_field(field)
+        except FieldDoesNotExist:
+            # annotazioni (es. il punteggio della ricerca): il valore JSON è già quello giusto
+            return value
+        try:
+            return model_field.to_python(value)
+        except Exception:
+            raise Http404('Invalid cursor')
+
+    def _after(self, values, reverse=False):
+        # (a, b) "dopo" (x, y) nell'ordinamento: a oltre x, oppure a = x e b oltre y, e così via
+        condition = Q()
+        for i, ordering in enumerate(self.ordering):
+            descending = ordering.startswith('-') != reverse
+            lookup = '%s__%s' % (self.fields[i], 'lt' if descending else 'gt')
+            step = Q(**{lookup: values[i]})
+            for field, value in zip(self.fields[:i], values[:i]):
+                step &= Q(**{field: value})
+            condition |= step
+        return condition
+
+    def _reversed_ordering(self):
+        return [field[1:] if field.startswith('-') else '-' + field for field in self.ordering]
+
+    def fetch(self, values, backwards, limit):
+        # righe successive a values (None = dall'inizio) nell'ordinamento, o precedenti se backwards
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._after(values, reverse=backwards))
+        ordering = self._reversed_ordering() if backwards else self.ordering
+        return list(queryset.order_by(*ordering)[:limit])
+
+    def page(self, cursor=None, querydict=None):
+        querydict = querydict if querydict is not None else {}
+        if not cursor:
+            rows = self.fetch(None, False, self.per_page + 1)
+            has_more, rows = len(rows) > self.per_page, rows[:self.per_page]
+            next_cursor = self.encode(rows[-1], 'n') if has_more else None
+            return KeysetPage(rows, next_cursor, None, querydict)
+
+        direction, values = self.decode(cursor)
+        if direction == 'n':
+            rows = self.fetch(values, False, self.per_page + 1)
+            has_more, rows = len(rows) > self.per_page, rows[:self.per_page]
+            next_cursor = self.encode(rows[-1], 'n') if has_more else None
+            previous_cursor = self.encode(rows[0], 'p') if rows else None
+        else:
+            # all'indietro si legge l'indice nel verso opposto e poi si ribalta la pagina
+            rows = self.fetch(values, True, self.per_page + 1)
+            has_more, rows = len(rows) > self.per_page, rows[:self.per_page][::-1]
+            previous_cursor = self.encode(rows[0], 'p') if has_more else None
+            next_cursor = self.encode(rows[-1], 'n') if rows else None
+        return KeysetPage(rows, next_cursor, previous_cursor, querydict)
+
+
+def paginate_keyset(request, queryset, per_page=PAGE_SIZE, ordering=('-date_posted', '-id')):
+    paginator = KeysetPaginator(queryset, per_page, ordering)
+    return paginator.page(request.GET.get(CURSOR_PARAM), request.GET)
+
+
+class KeysetPaginationMixin:
+    # sostituisce la paginazione a OFFSET di ListView con quella a cursore
+    paginate_by = PAGE_SIZE
+    keyset_ordering = ('-date_posted', '-id')
+
+    def paginate_queryset(self, queryset, page_size):
+        page = paginate_keyset(self.request, queryset, page_size, self.keyset_ordering)
+        return None, page, page.object_list, page.has_other_pages()
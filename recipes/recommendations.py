@@ -0,0 +1,147 @@
+import numpy as np
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .caching import RECOMMENDATIONS, bump_on_commit
+from .models import Like, Recipe, RecipeSimilarity
+
+# "chi ha messo like a questa ricetta ha apprezzato anche": similarità item-to-item calcolata offline
+# (comando build_recommendations) dalla matrice sparsa utenti x ricette dei like. Per due ricette a e b la
+# co-occorrenza è il numero di utenti che le hanno apprezzate entrambe e la similarità è il coseno
+# co(a, b) / sqrt(like(a) * like(b)). Le top-K di ogni ricetta finiscono in RecipeSimilarity, così la
+# pagina di dettaglio fa una sola lookup sull'indice (recipe, rank).
+#
+# La matrice sta in memoria in forma CSR (array NumPy di interi, due per like) e la co-occorrenza si
+# calcola a blocchi di ricette, ognuno limitato a MAX_PAIRS coppie (ricetta, ricetta) espanse: la memoria
+# dipende da MAX_PAIRS, non dal numero di ricette al quadrato. Gli utenti con più di MAX_USER_LIKES like
+# (bot, account di test) vengono ignorati: da soli genererebbero milioni di coppie poco informative.
+
+TOP_K = 8
+MAX_PAIRS = 5_000_000
+MAX_USER_LIKES = 1000
+MAX_BLOCK = 2000  # ricette per blocco, anche quando hanno pochi like
+
+
+def _gather(ptr, values, rows):
+    # tutte le righe CSR indicate: (indice della riga in rows, valore) per ogni elemento
+    starts, lengths = ptr[rows], ptr[rows + 1] - ptr[rows]
+    owners = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return owners, values[np.repeat(starts, lengths) + offsets]
+
+
+def _csr(rows, values, size):
+    order = np.argsort(rows, kind='stable')
+    ptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=ptr[1:])
+    return ptr, values[order]
+
+
+class CoLikes:
+    def __init__(self, user_ids, recipe_ids, max_user_likes=MAX_USER_LIKES):
+        _, users, user_likes = np.unique(user_ids, return_inverse=True, return_counts=True)
+        keep = user_likes[users] <= max_user_likes
+        self.recipe_ids, recipes = np.unique(recipe_ids[keep], return_inverse=True)
+        user_ids, users = np.unique(users[keep], return_inverse=True)
+        n_users, n_recipes = len(user_ids), len(self.recipe_ids)
+        self.likes = np.bincount(recipes, minlength=n_recipes)
+        self.user_ptr, self.user_recipes = _csr(users, recipes, n_users)
+        self.recipe_ptr, self.recipe_users = _csr(recipes, users, n_recipes)
+        # coppie espanse da ogni ricetta: somma dei like dei suoi utenti
+        self.cost = np.bincount(recipes, weights=np.diff(self.user_ptr)[users], minlength=n_recipes)
+
+    @classmethod
+    def load(cls, max_user_likes=MAX_USER_LIKES):
+        likes = Like.objects.order_by().values_list('user_id', 'recipe_id')
+        flat = np.fromiter((value for pair in likes.iterator(chunk_size=10000) for value in pair), dtype=np.int64)
+        return cls(flat[0::2], flat[1::2], max_user_likes)
+
+    def positions(self, recipe_ids):
+        recipe_ids = np.asarray(sorted(set(recipe_ids)), dtype=np.int64)
+        found = np.searchsorted(self.recipe_ids, recipe_ids)
+        found = found[found < len(self.recipe_ids)]
+        return found[np.isin(self.recipe_ids[found], recipe_ids)]
+
+    def neighbours(self, positions):
+        # ricette che condividono almeno un utente con quelle date
+        _, users = _gather(self.recipe_ptr, self.recipe_users, positions)
+        _, recipes = _gather(self.user_ptr, self.user_recipes, np.unique(users))
+        return np.unique(recipes)
+
+    def blocks(self, positions, max_pairs=MAX_PAIRS):
+        # ricette raggruppate in modo che ogni blocco espanda al più max_pairs coppie (almeno una ricetta)
+        start, total = 0, 0
+        for i, cost in enumerate(self.cost[positions].tolist()):
+            if i > start and (total + cost > max_pairs or i - start >= MAX_BLOCK):
+                yield positions[start:i]
+                start, total = i, 0
+            total += cost
+        if start < len(positions):
+            yield positions[start:]
+
+    def top_k(self, targets, k=TOP_K):
+        # (ricetta, simile, punteggio, rank) come array, per le ricette targets (posizioni)
+        owners, users = _gather(self.recipe_ptr, self.recipe_users, targets)
+        pairs, others = _gather(self.user_ptr, self.user_recipes, users)
+        local = owners[pairs]
+        keep = others != targets[local]
+        keys, counts = np.unique(local[keep].astype(np.int64) * len(self.recipe_ids) + others[keep],
+                                 return_counts=True)
+        local, others = keys // len(self.recipe_ids), keys % len(self.recipe_ids)
+        scores = counts / np.sqrt(self.likes[targets[local]] * self.likes[others])
+        order = np.lexsort((others, -scores, local))
+        local, others, scores = local[order], others[order], scores[order]
+        ranks = np.arange(len(local)) - np.searchsorted(local, local)
+        best = ranks < k
+        return (self.recipe_ids[targets[local[best]]], self.recipe_ids[others[best]], scores[best],
+                ranks[best])
+
+
+def build(full=False, k=TOP_K, max_pairs=MAX_PAIRS, now=None):
+    # ricalcola le liste e restituisce quante ricette sono state aggiornate. Senza full solo quelle la cui
+    # lista può essere cambiata dall'ultima build: le ricette modificate (anche i like aggiornano updated_at),
+    # quelle che condividono utenti con loro e quelle che le avevano in lista
+    now = now or timezone.now()
+    since = None if full else RecipeSimilarity.objects.aggregate(Max('built_at'))['built_at__max']
+    colikes = CoLikes.load()
+
+    if since is None:
+        targets = np.arange(len(colikes.recipe_ids))
+        stale = RecipeSimilarity.objects.all()
+    else:
+        changed = list(Recipe.objects.filter(updated_at__gte=since).values_list('pk', flat=True))
+        listing = RecipeSimilarity.objects.filter(similar__updated_at__gte=since).values_list('recipe_id', flat=True)
+        changed_positions = colikes.positions(changed)
+        targets = np.union1d(np.union1d(changed_positions, colikes.neighbours(changed_positions)),
+                             colikes.positions(listing))
+        # ricette modificate che non hanno più like: la lista va solo svuotata
+        stale = RecipeSimilarity.objects.filter(recipe_id__in=changed)
+
+    updated = 0
+    for block in colikes.blocks(targets, max_pairs):
+        recipes, similar, scores, ranks = colikes.top_k(block, k)
+        with transaction.atomic():
+            RecipeSimilarity.objects.filter(recipe_id__in=colikes.recipe_ids[block].tolist()).delete()
+            RecipeSimilarity.objects.bulk_create([
+                RecipeSimilarity(recipe_id=recipe_id, similar_id=similar_id, score=score, rank=rank, built_at=now)
+                for recipe_id, similar_id, score, rank in zip(recipes.tolist(), similar.tolist(), scores.tolist(),
+                                                              ranks.tolist())
+            ], batch_size=1000)
+        updated += len(block)
+
+    with transaction.atomic():
+        # righe non riscritte da questa build: ricette senza più like (o tutte quelle vecchie con full)
+        stale.filter(built_at__lt=now).delete()
+        bump_on_commit(RECOMMENDATIONS)
+    return updated
+
+
+def for_recipe(recipe, limit=TOP_K):
+    # le ricette simili salvate; se sono meno di limit si completano con le più apprezzate delle stesse categorie
+    similar = list(Recipe.objects.for_cards().filter(similar_to__recipe=recipe).order_by('similar_to__rank')[:limit])
+    if len(similar) < limit:
+        exclude = [recipe.pk] + [other.pk for other in similar]
+        similar += list(Recipe.objects.for_cards().filter(category__in=recipe.category.all()).exclude(pk__in=exclude)
+                        .order_by('-like_count', '-id').distinct()[:limit - len(similar)])
+    return similar
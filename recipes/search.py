@@ -0,0 +1,253 @@
+import re
+from collections import namedtuple
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Recipe
+from .pagination import CURSOR_PARAM, PAGE_SIZE, KeysetPaginator
+
+# ricerca full-text sulle ricette: titolo, descrizione, nomi degli ingredienti e delle categorie.
+# Su PostgreSQL l'indice è la colonna tsvector recipes_recipe.search_vector (indice GIN), su SQLite
+# la tabella virtuale FTS5 recipes_recipe_fts (rowid = id della ricetta). Entrambi vengono creati
+# dalla migrazione 0007 e aggiornati a ogni modifica da recipes.signals tramite reindex/unindex. Sugli altri
+# database si ripiega su icontains, senza indice né punteggio.
+#
+# La query dell'utente viene letta una volta sola da parse_query, con la sintassi di websearch_to_tsquery:
+# termini in AND, "frase esatta", -termine escluso e OR tra alternative. Ogni backend traduce lo stesso
+# risultato nella propria sintassi, così una query trova le stesse ricette su PostgreSQL e su SQLite.
+
+SEARCH_CONFIG = 'english'
+# quanti id per singola istruzione SQL durante la reindicizzazione
+BATCH_SIZE = 500
+TOKEN_RE = re.compile(r'(-?)"([^"]*)"?|(-?)([^\s"]+)')
+
+# words: parole (\w+) della frase o del termine; prefix: termine singolo non tra virgolette, cercato anche
+# come prefisso; negated: escluso con il meno
+Term = namedtuple('Term', 'words prefix negated')
+
+
+def parse_query(text):
+    # -> alternative in OR, ognuna una lista di Term in AND. Il resto della punteggiatura viene ignorato;
+    # le alternative senza termini positivi si scartano (FTS5 non sa cercare solo per esclusione)
+    groups = [[]]
+    for match in TOKEN_RE.finditer(text):
+        phrase_negated, phrase, negated, token = match.groups()
+        if phrase is not None:
+            words = re.findall(r'\w+', phrase)
+            term = Term(tuple(words), False, bool(phrase_negated))
+        elif token.upper() == 'OR' and not negated:
+            groups.append([])
+            continue
+        else:
+            words = re.findall(r'\w+', token)
+            term = Term(tuple(words), len(words) == 1, bool(negated))
+        if words:
+            groups[-1].append(term)
+    return [group for group in groups if any(not term.negated for term in group)]
+
+
+class PostgresSearchBackend:
+    document_sql = """
+        UPDATE recipes_recipe AS r SET search_vector =
+            setweight(to_tsvector(%(config)s::regconfig, coalesce(r.title, '')), 'A') ||
+            setweight(to_tsvector(%(config)s::regconfig, coalesce((
+                SELECT string_agg(i.name, ' ') FROM recipes_ingredient i WHERE i.recipe_id = r.id), '')), 'B') ||
+            setweight(to_tsvector(%(config)s::regconfig, coalesce((
+                SELECT string_agg(c.name, ' ') FROM recipes_category c
+                JOIN recipes_recipe_category rc ON rc.category_id = c.id WHERE rc.recipe_id = r.id), '')), 'B') ||
+            setweight(to_tsvector(%(config)s::regconfig, coalesce(r.description, '')), 'C')
+    """
+
+    def reindex(self, cursor, ids):
+        if ids is None:
+            cursor.execute(self.document_sql, {'config': SEARCH_CONFIG})
+        else:
+            cursor.execute(self.document_sql + ' WHERE r.id = ANY(%(ids)s)', {'config': SEARCH_CONFIG, 'ids': ids})
+
+    def unindex(self, cursor, ids):
+        # il tsvector sta nella riga della ricetta e sparisce con lei
+        pass
+
+    def tsquery(self, groups):
+        # -> (espressione tsquery, parametri): i prefissi con to_tsquery('parola:*'), le frasi con phraseto_tsquery
+        alternatives, params = [], []
+        for group in groups:
+            clauses = []
+            for term in group:
+                if term.prefix:
+                    clauses.append('to_tsquery(%s::regconfig, %s)')
+                    params += [SEARCH_CONFIG, term.words[0] + ':*']
+                else:
+                    clauses.append('phraseto_tsquery(%s::regconfig, %s)')
+                    params += [SEARCH_CONFIG, ' '.join(term.words)]
+                if term.negated:
+                    clauses[-1] = '(!!%s)' % clauses[-1]
+            alternatives.append('(%s)' % ' && '.join(clauses))
+        return ' || '.join(alternatives), params
+
+    def search(self, cursor, groups, after, backwards, limit):
+        if not groups:
+            return []
+        comparison, order = ('>', 'ASC') if backwards else ('<', 'DESC')
+        tsquery, params = self.tsquery(groups)
+        sql = f"""
+            SELECT id, score FROM (
+                SELECT r.id, ts_rank_cd(r.search_vector, query.q) AS score
+                FROM recipes_recipe r, (SELECT {tsquery} AS q) query
+                WHERE r.search_vector @@ query.q
+            ) hits
+        """
+        if after is not None:
+            sql += f' WHERE score {comparison} %s OR (score = %s AND id {comparison} %s)'
+            params += [after[0], after[0], after[1]]
+        cursor.execute(sql + f' ORDER BY score {order}, id {order} LIMIT %s', params + [limit])
+        return cursor.fetchall()
+
+
+class SqliteSearchBackend:
+    document_sql = """
+        INSERT INTO recipes_recipe_fts (rowid, title, description, ingredients, categories)
+        SELECT r.id, r.title, r.description,
+            (SELECT group_concat(i.name, ' ') FROM recipes_ingredient i WHERE i.recipe_id = r.id),
+            (SELECT group_concat(c.name, ' ') FROM recipes_category c
+             JOIN recipes_recipe_category rc ON rc.category_id = c.id WHERE rc.recipe_id = r.id)
+        FROM recipes_recipe r
+    """
+    # pesi bm25 delle colonne: title, description, ingredients, categories
+    rank_sql = 'bm25(recipes_recipe_fts, 10.0, 2.0, 4.0, 4.0)'
+
+    def reindex(self, cursor, ids):
+        if ids is None:
+            cursor.execute('DELETE FROM recipes_recipe_fts')
+            cursor.execute(self.document_sql)
+        else:
+            self.unindex(cursor, ids)
+            cursor.execute(self.document_sql + ' WHERE r.id IN (%s)' % ', '.join(['%s'] * len(ids)), ids)
+
+    def unindex(self, cursor, ids):
+        cursor.execute('DELETE FROM recipes_recipe_fts WHERE rowid IN (%s)' % ', '.join(['%s'] * len(ids)), ids)
+
+    def match_expression(self, groups):
+        # ogni termine va tra virgolette (parole \w+, quindi la sintassi FTS5 dell'utente non passa); NOT in
+        # FTS5 è binario: (a AND b) NOT c NOT d
+        def quoted(term):
+            return '"%s"*' % term.words[0] if term.prefix else '"%s"' % ' '.join(term.words)
+
+        alternatives = []
+        for group in groups:
+            positive = ' AND '.join(quoted(term) for term in group if not term.negated)
+            negative = ''.join(' NOT ' + quoted(term) for term in group if term.negated)
+            alternatives.append(f'(({positive}){negative})')
+        return ' OR '.join(alternatives)
+
+    def search(self, cursor, groups, after, backwards, limit):
+        if not groups:
+            return []
+        match = self.match_expression(groups)
+        comparison, order = ('>', 'ASC') if backwards else ('<', 'DESC')
+        # bm25 è tanto più basso quanto più il documento è rilevante: si usa il suo opposto come punteggio
+        sql = f"""
+            SELECT id, score FROM (
+                SELECT rowid AS id, -{self.rank_sql} AS score
+                FROM recipes_recipe_fts WHERE recipes_recipe_fts MATCH %s
+            )
+        """
+        params = [match]
+        if after is not None:
+            sql += f' WHERE score {comparison} %s OR (score = %s AND id {comparison} %s)'
+            params += [after[0], after[0], after[1]]
+        cursor.execute(sql + f' ORDER BY score {order}, id {order} LIMIT %s', params + [limit])
+        return cursor.fetchall()
+
+
+class BasicSearchBackend:
+    # altri database: icontains sugli stessi campi, senza indice; punteggio 0, quindi ordine per id
+    fields = ('title', 'description', 'ingredient__name', 'category__name')
+
+    def reindex(self, cursor, ids):
+        pass
+
+    def unindex(self, cursor, ids):
+        pass
+
+    def condition(self, groups):
+        condition = Q()
+        for group in groups:
+            alternative = Q()
+            for term in group:
+                text = ' '.join(term.words)
+                clause = Q()
+                for field in self.fields:
+                    clause |= Q(**{f'{field}__icontains': text})
+                alternative &= ~clause if term.negated else clause
+            condition |= alternative
+        return condition
+
+    def search(self, cursor, groups, after, backwards, limit):
+        if not groups:
+            return []
+        ids = (Recipe.objects.filter(self.condition(groups)).order_by('pk' if backwards else '-pk')
+               .values_list('pk', flat=True).distinct())
+        if after is not None:
+            ids = ids.filter(**{'pk__gt' if backwards else 'pk__lt': after[1]})
+        return [(pk, 0.0) for pk in ids[:limit]]
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+def get_backend():
+    return BACKENDS.get(connection.vendor, BasicSearchBackend)()
+
+
+def _batches(ids):
+    ids = sorted(set(ids))
+    for start in range(0, len(ids), BATCH_SIZE):
+        yield ids[start:start + BATCH_SIZE]
+
+
+def reindex(ids=None):
+    # ricostruisce i documenti delle ricette indicate (tutte se ids è None) con poche istruzioni SQL
+    backend = get_backend()
+    with connection.cursor() as cursor:
+        if ids is None:
+            backend.reindex(cursor, None)
+            return
+        for batch in _batches(ids):
+            backend.reindex(cursor, batch)
+
+
+def unindex(ids):
+    backend = get_backend()
+    with connection.cursor() as cursor:
+        for batch in _batches(ids):
+            backend.unindex(cursor, batch)
+
+
+class SearchPaginator(KeysetPaginator):
+    # paginazione a cursore sul punteggio: le righe arrivano dall'indice full-text già ordinate,
+    # poi le ricette della pagina vengono caricate con una sola query
+    def __init__(self, queryset, query, per_page=PAGE_SIZE):
+        super().__init__(queryset, per_page, ordering=('-score', '-id'))
+        self.groups = parse_query(query)
+
+    def fetch(self, values, backwards, limit):
+        with connection.cursor() as cursor:
+            hits = get_backend().search(cursor, self.groups, values, backwards, limit)
+        recipes = self.queryset.in_bulk([recipe_id for recipe_id, score in hits])
+        rows = []
+        for recipe_id, score in hits:
+            if recipe_id in recipes:
+                recipe = recipes[recipe_id]
+                recipe.score = score
+                rows.append(recipe)
+        return rows
+
+
+def search_recipes(request, queryset, query, per_page=PAGE_SIZE):
+    paginator = SearchPaginator(queryset, query, per_page)
+    return paginator.page(request.GET.get(CURSOR_PARAM), request.GET)
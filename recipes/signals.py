@@ -0,0 +1,272 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.core.signals import request_finished, request_started
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import db, facets, instrumentation, leaderboard, liked, search, storage
+from .caching import CATEGORIES, INGREDIENTS, RECIPES, bump_on_commit, recipe_namespace
+from .images import renditions_ready
+from .models import Category, Ingredient, Like, Recipe
+
+
+# indice full-text (recipes.search) aggiornato in modo incrementale: si ricostruiscono solo i documenti
+# delle ricette toccate dalla modifica
+@receiver(post_save, sender=Recipe)
+def index_recipe(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.reindex([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(sender, instance, **kwargs):
+    search.unindex([instance.pk])
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def index_ingredient_recipe(sender, instance, raw=False, **kwargs):
+    if not raw and instance.recipe_id:
+        search.reindex([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.category.through)
+def index_recipe_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # clear() dal lato della categoria non dice quali ricette perdono il legame: si leggono prima
+        instance._cleared_recipe_ids = list(instance.recipe_set.values_list('pk', flat=True))
+    elif action == 'post_clear' and reverse:
+        search.reindex(instance._cleared_recipe_ids)
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        search.reindex([instance.pk] if not reverse else pk_set)
+
+
+@receiver(post_save, sender=Category)
+def index_category_recipes(sender, instance, created, raw=False, **kwargs):
+    # una categoria rinominata cambia il documento di tutte le sue ricette
+    if not created and not raw:
+        search.reindex(instance.recipe_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Category)
+def remember_deleted_category_recipes(sender, instance, **kwargs):
+    instance._cleared_recipe_ids = list(instance.recipe_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def index_deleted_category_recipes(sender, instance, **kwargs):
+    search.reindex(instance._cleared_recipe_ids)
+
+
+# invalidazione della cache (recipes.caching): updated_at versiona le card, i namespace le pagine
+def touch_recipes(ids):
+    now = timezone.now()
+    Recipe.objects.filter(pk__in=list(ids)).update(updated_at=now, content_updated_at=now)
+
+
+def invalidate_recipes(ids):
+    slugs = Recipe.objects.filter(pk__in=list(ids)).values_list('slug', flat=True)
+    bump_on_commit(RECIPES, *[recipe_namespace(slug) for slug in slugs])
+
+
+def ingredients_changed(ids):
+    # da chiamare dopo le modifiche in blocco agli ingredienti, che non mandano i signal qui sopra
+    search.reindex(ids)
+    db.mark_written()
+    touch_recipes(ids)
+    invalidate_recipes(ids)
+    bump_on_commit(INGREDIENTS)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_on_commit(RECIPES, recipe_namespace(instance.slug))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_recipe(sender, instance, raw=False, **kwargs):
+    if not raw and instance.recipe_id:
+        touch_recipes([instance.recipe_id])
+        invalidate_recipes([instance.recipe_id])
+        bump_on_commit(INGREDIENTS)
+
+
+@receiver(m2m_changed, sender=Recipe.category.through)
+def invalidate_recipe_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        ids = [instance.pk]
+    else:
+        ids = instance._cleared_recipe_ids if action == 'post_clear' else pk_set
+    touch_recipes(ids)
+    invalidate_recipes(ids)
+
+
+@receiver(m2m_changed, sender=Recipe.likes.through)
+def invalidate_recipe_likes(sender, instance, action, reverse, pk_set, **kwargs):
+    # updated_at viene già aggiornato da count_likes insieme al contatore (content_updated_at no)
+    if action == 'pre_clear' and reverse:
+        instance._cleared_recipe_ids = list(instance.likes.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            bump_on_commit(RECIPES, recipe_namespace(instance.slug))
+        else:
+            invalidate_recipes(instance._cleared_recipe_ids if action == 'post_clear' else pk_set)
+
+
+# contatori dei like e classifiche (recipes.leaderboard) per ogni like aggiunto o tolto: likes.add() dai due
+# lati (bulk_create, quindi solo m2m_changed), Like.objects.create() (post_save) e ogni cancellazione, compresi
+# remove(), clear() e le cascate da utenti e ricette (post_delete). Solo bulk_create diretti e update() sulla
+# tabella dei like passano da leaderboard.rebuild
+def count_likes(likes, added):
+    # likes: [(recipe_id, created_at)]
+    now = timezone.now()
+    by_recipe = defaultdict(list)
+    for recipe_id, liked_at in likes:
+        by_recipe[recipe_id].append(liked_at)
+    with transaction.atomic():
+        # in ordine, così due transazioni concorrenti bloccano le ricette nella stessa sequenza
+        for recipe_id in sorted(by_recipe):
+            counters = (Recipe.objects.select_for_update().filter(pk=recipe_id)
+                        .values(*leaderboard.BOARDS.values()).first())
+            if counters is None:
+                continue
+            for liked_at in by_recipe[recipe_id]:
+                counters = (leaderboard.add_like if added else leaderboard.remove_like)(counters, liked_at, now)
+            Recipe.objects.filter(pk=recipe_id).update(updated_at=now, **counters)
+
+
+@receiver(m2m_changed, sender=Recipe.likes.through)
+def count_added_likes(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add' and pk_set:
+        likes = (Like.objects.filter(user_id=instance.pk, recipe_id__in=pk_set) if reverse
+                 else Like.objects.filter(recipe_id=instance.pk, user_id__in=pk_set))
+        count_likes(likes.values_list('recipe_id', 'created_at'), True)
+
+
+@receiver(post_save, sender=Like)
+def count_created_like(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        count_likes([(instance.recipe_id, instance.created_at)], True)
+
+
+@receiver(post_delete, sender=Like)
+def count_deleted_like(sender, instance, **kwargs):
+    count_likes([(instance.recipe_id, instance.created_at)], False)
+
+
+# insiemi dei preferiti in cache (recipes.liked): il toggle di una ricetta aggiorna l'array dell'utente,
+# le modifiche dal lato dell'utente o in blocco lo fanno ricaricare
+@receiver(m2m_changed, sender=Recipe.likes.through)
+def update_liked_sets(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and not reverse:
+        instance._cleared_user_ids = list(instance.likes.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        if reverse:
+            liked.forget([instance.pk])
+        else:
+            for user_id in pk_set:
+                liked.record_like(user_id, instance.pk, action == 'post_add')
+    elif action == 'post_clear':
+        liked.forget([instance.pk] if reverse else instance._cleared_user_ids)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_on_commit(CATEGORIES, RECIPES)
+
+
+@receiver(renditions_ready, sender=Recipe)
+def invalidate_recipe_image(sender, instance_pk, **kwargs):
+    touch_recipes([instance_pk])
+    invalidate_recipes([instance_pk])
+
+
+# file dei media indirizzati per contenuto (recipes.storage): l'immagine sostituita o quella di una ricetta
+# cancellata viene eliminata se nessun'altra riga la usa
+@receiver(pre_save, sender=Recipe)
+def remember_recipe_image(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw:
+        storage.remember_image(instance, update_fields)
+
+
+@receiver(post_save, sender=Recipe)
+def release_replaced_recipe_image(sender, instance, raw=False, **kwargs):
+    if not raw:
+        storage.release_replaced_image(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_image(sender, instance, **kwargs):
+    storage.release([instance.image.name])
+
+
+# cubo dei conteggi delle faccette (recipes.facets), aggiornato nella stessa transazione della modifica
+@receiver(pre_save, sender=Recipe)
+def remember_recipe_facets(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw:
+        facets.remember(instance, update_fields)
+
+
+@receiver(post_save, sender=Recipe)
+def count_recipe_facets(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        facets.recipe_saved(instance, created)
+
+
+@receiver(pre_delete, sender=Recipe)
+def uncount_recipe_facets(sender, instance, **kwargs):
+    facets.recipe_deleted(instance)
+
+
+@receiver(m2m_changed, sender=Recipe.category.through)
+def count_recipe_category_facets(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('pre_add', 'pre_remove', 'pre_clear'):
+        facets.categories_changing(instance, reverse, pk_set)
+    else:
+        facets.categories_changed(instance)
+
+
+@receiver(post_delete, sender=Category)
+def uncount_category_facets(sender, instance, **kwargs):
+    facets.category_deleted(instance.pk)
+
+
+# ogni connessione, in qualunque thread venga aperta, riporta le sue query alla strumentazione
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    instrumentation.install(connection)
+
+
+# repliche in lettura (recipes.db): dopo una scrittura il client legge dal primario
+@receiver(post_save)
+@receiver(post_delete)
+def mark_db_written(sender, raw=False, **kwargs):
+    if not raw:
+        db.mark_written(sender)
+
+
+@receiver(m2m_changed)
+def mark_db_m2m_written(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        db.mark_written(sender)
+
+
+# connessioni persistenti al database (recipes.db)
+@receiver(request_started)
+def check_db_connections(sender, **kwargs):
+    db.check_connections()
+
+
+@receiver(request_finished)
+def mark_db_connections_used(sender, **kwargs):
+    db.mark_connections_used()
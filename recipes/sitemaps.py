@@ -0,0 +1,250 @@
+import json
+import os
+import tempfile
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.http import FileResponse, Http404
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.views.decorators.http import require_safe
+
+from .models import Category, Recipe, recipe_url, recipe_url_parts
+
+# sitemap e feed per i crawler, precalcolati come file in SITEMAP_ROOT e serviti in streaming dal disco, così
+# i crawler non passano più dalle pagine dinamiche. Il comando build_sitemaps li aggiorna in modo incrementale:
+#   sitemap.xml                 indice delle shard (protocollo sitemaps.org: al massimo 50.000 URL per file)
+#   sitemap-pages.xml           pagine fisse e pagine delle categorie
+#   sitemap-recipes-<n>.xml     ricette con id tra n * SHARD_SIZE e (n + 1) * SHARD_SIZE, con lastmod
+#                               = content_updated_at (i like non contano come modifica)
+#   feeds/recipes.{rss,atom}    ultime ricette pubblicate, feeds/categories/<slug>.{rss,atom} per categoria
+# Le shard sono per intervallo di id, quindi una ricetta nuova, modificata o cancellata cambia solo la sua:
+# il manifest ricorda numero di ricette e content_updated_at massimo di ogni shard e vengono riscritte solo
+# quelle diverse (o mancanti sul disco). Allo stesso modo i feed, per tutte le ricette e per ogni categoria
+# (con anche l'ultima modifica della categoria). Ogni file si scrive leggendo le righe con iterator() e
+# scrivendo man mano: memoria costante qualunque sia la dimensione del catalogo. I file li scrive solo il
+# comando, mai la richiesta di un crawler: finché manca, un file risponde 404.
+
+SHARD_SIZE = 50000
+FEED_SIZE = 50
+CHUNK_SIZE = 2000
+INDEX = 'sitemap.xml'
+PAGES = 'sitemap-pages.xml'
+MANIFEST = 'manifest.json'
+CATEGORY_FEEDS = 'feeds/categories'
+MAX_AGE = 60 * 60
+FEEDS = {'rss': Rss201rev2Feed, 'atom': Atom1Feed}
+URLSET = '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+SITEMAPINDEX = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+
+
+def shard_name(shard):
+    return f'sitemap-recipes-{shard}.xml'
+
+
+def feed_name(kind, category_slug=None):
+    return f'{CATEGORY_FEEDS}/{category_slug}.{kind}' if category_slug else f'feeds/recipes.{kind}'
+
+
+def site_url():
+    return settings.SITE_URL.rstrip('/')
+
+
+def path(name):
+    return os.path.join(settings.SITEMAP_ROOT, name)
+
+
+def write(name, chunks):
+    # scrittura atomica: chi legge vede sempre il file vecchio o quello nuovo completo
+    target = path(name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    f = tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(target), delete=False)
+    try:
+        with f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(f.name, target)
+    except BaseException:
+        # es. un errore nel generatore: il file vecchio resta e il temporaneo non rimane sul disco
+        os.unlink(f.name)
+        raise
+
+
+def url_entry(loc, lastmod=None):
+    lastmod = f'<lastmod>{lastmod.isoformat()}</lastmod>' if lastmod else ''
+    return f'<url><loc>{escape(loc)}</loc>{lastmod}</url>\n'
+
+
+def recipe_urls(shard):
+    before, after = recipe_url_parts()
+    base = site_url() + before
+    recipes = (Recipe.objects.filter(pk__gte=shard * SHARD_SIZE, pk__lt=(shard + 1) * SHARD_SIZE)
+               .order_by('pk').values_list('slug', 'content_updated_at'))
+    yield URLSET
+    for slug, lastmod in recipes.iterator(chunk_size=CHUNK_SIZE):
+        yield url_entry(base + slug + after, lastmod)
+    yield '</urlset>\n'
+
+
+def page_urls():
+    base = site_url()
+    yield URLSET
+    for name in ('home', 'recipes', 'categories', 'browse', 'leaderboard'):
+        yield url_entry(base + reverse(name))
+    for slug in Category.objects.order_by('name').values_list('slug', flat=True).iterator():
+        yield url_entry(base + reverse('categoryDetail', args=[slug]))
+    yield '</urlset>\n'
+
+
+def sitemap_index(shards):
+    # shards: shard -> (ricette, content_updated_at massimo)
+    base = site_url()
+    yield SITEMAPINDEX
+    yield f"<sitemap><loc>{escape(base + reverse('sitemapPages'))}</loc></sitemap>\n"
+    for shard, (_, lastmod) in sorted(shards.items()):
+        loc = escape(base + reverse('sitemapRecipes', args=[shard]))
+        yield f'<sitemap><loc>{loc}</loc><lastmod>{lastmod.isoformat()}</lastmod></sitemap>\n'
+    yield '</sitemapindex>\n'
+
+
+def shard_stats():
+    # una passata sugli id in ordine: memoria proporzionale al numero di shard, non di ricette
+    shards = {}
+    rows = Recipe.objects.order_by().values_list('pk', 'content_updated_at')
+    for pk, changed in rows.iterator(chunk_size=CHUNK_SIZE * 5):
+        count, lastmod = shards.get(pk // SHARD_SIZE, (0, changed))
+        shards[pk // SHARD_SIZE] = (count + 1, max(lastmod, changed))
+    return shards
+
+
+def category_feed_stats():
+    # slug -> [ricette, content_updated_at massimo, ultima modifica della categoria], in una query
+    categories = Category.objects.order_by('pk').annotate(recipes=Count('recipe'),
+                                                          lastmod=Max('recipe__content_updated_at'))
+    return {category.slug: (category, [category.recipes, category.lastmod and category.lastmod.isoformat(),
+                                       category.updated_at.isoformat()]) for category in categories}
+
+
+def feed(kind, category=None):
+    base = site_url()
+    recipes = Recipe.objects.for_cards().order_by('-date_posted', '-id')
+    if category is None:
+        title, link = 'RecipeSharing: latest recipes', base + reverse('recipes')
+        description = 'The latest recipes published on RecipeSharing.'
+        feed_url = base + reverse('recipeFeed', args=[kind])
+    else:
+        recipes = recipes.filter(category=category)
+        title, link = f'RecipeSharing: {category.name}', base + reverse('categoryDetail', args=[category.slug])
+        description = f'The latest {category.name} recipes published on RecipeSharing.'
+        feed_url = base + reverse('categoryFeed', args=[category.slug, kind])
+    generator = FEEDS[kind](title=title, link=link, description=description, feed_url=feed_url, language='en')
+    for recipe in recipes[:FEED_SIZE]:
+        url = base + recipe_url(recipe.slug)
+        generator.add_item(title=recipe.title, link=url, unique_id=url, description=recipe.summary,
+                           pubdate=recipe.date_posted, updateddate=recipe.content_updated_at,
+                           author_name=recipe.author.username)
+    return generator
+
+
+def write_feeds(category=None):
+    for kind in FEEDS:
+        write(feed_name(kind, category and category.slug), [feed(kind, category).writeString('utf-8')])
+    return len(FEEDS)
+
+
+def feeds_missing(category_slug=None):
+    return not all(os.path.exists(path(feed_name(kind, category_slug))) for kind in FEEDS)
+
+
+def load_manifest():
+    try:
+        with open(path(MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def build(full=False):
+    # riscrive le shard e i feed cambiati dall'ultima build (tutti con full o se è cambiato SITE_URL), l'indice
+    # e le pagine fisse; restituisce il numero di shard riscritte e cancellate e di feed riscritti
+    manifest = load_manifest()
+    if full or manifest.get('site_url') != site_url():
+        manifest = {}
+    previous = manifest.get('shards', {})
+    stats = shard_stats()
+    current = {str(shard): [count, lastmod.isoformat()] for shard, (count, lastmod) in stats.items()}
+
+    rebuilt = [shard for shard in sorted(stats)
+               if previous.get(str(shard)) != current[str(shard)] or not os.path.exists(path(shard_name(shard)))]
+    for shard in rebuilt:
+        write(shard_name(shard), recipe_urls(shard))
+    deleted = [shard for shard in previous if shard not in current]
+    for shard in deleted:
+        try:
+            os.remove(path(shard_name(shard)))
+        except FileNotFoundError:
+            pass
+
+    write(PAGES, page_urls())
+    # il feed di tutte le ricette cambia con le shard: stesso numero di ricette e stessa modifica più recente
+    lastmod = max((lastmod for _, lastmod in stats.values()), default=None)
+    feed_state = [sum(count for count, _ in stats.values()), lastmod and lastmod.isoformat()]
+    feeds = 0
+    if manifest.get('feed') != feed_state or feeds_missing():
+        feeds += write_feeds()
+    previous_feeds = manifest.get('category_feeds', {})
+    categories = category_feed_stats()
+    for slug, (category, state) in categories.items():
+        if previous_feeds.get(slug) != state or feeds_missing(slug):
+            feeds += write_feeds(category)
+    # feed delle categorie cancellate o rinominate
+    keep = {f'{slug}.{kind}' for slug in categories for kind in FEEDS}
+    directory = path(CATEGORY_FEEDS)
+    for name in set(os.listdir(directory) if os.path.isdir(directory) else []) - keep:
+        os.remove(os.path.join(directory, name))
+    write(INDEX, sitemap_index(stats))
+    write(MANIFEST, [json.dumps({'site_url': site_url(), 'shards': current, 'feed': feed_state,
+                                 'category_feeds': {slug: state for slug, (_, state) in categories.items()}})])
+    return {'rebuilt': len(rebuilt), 'deleted': len(deleted), 'shards': len(stats), 'feeds': feeds}
+
+
+def serve(name, content_type):
+    # prima della prima build_sitemaps il file non c'è: 404, senza generarlo dentro la richiesta del crawler
+    try:
+        f = open(path(name), 'rb')
+    except FileNotFoundError:
+        raise Http404('No such file')
+    response = FileResponse(f, content_type=content_type)
+    response['Cache-Control'] = f'public, max-age={MAX_AGE}'
+    return response
+
+
+@require_safe
+def sitemap_index_view(request):
+    return serve(INDEX, 'application/xml')
+
+
+@require_safe
+def sitemap_pages_view(request):
+    return serve(PAGES, 'application/xml')
+
+
+@require_safe
+def sitemap_recipes_view(request, shard):
+    return serve(shard_name(shard), 'application/xml')
+
+
+@require_safe
+def recipe_feed_view(request, kind):
+    if kind not in FEEDS:
+        raise Http404('No such feed')
+    return serve(feed_name(kind), FEEDS[kind].content_type)
+
+
+@require_safe
+def category_feed_view(request, slug, kind):
+    if kind not in FEEDS:
+        raise Http404('No such feed')
+    return serve(feed_name(kind, slug), FEEDS[kind].content_type)
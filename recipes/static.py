@@ -0,0 +1,30 @@
+import asyncio
+
+from django.conf import settings
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+
+# WhiteNoise 5 è solo sincrono: sotto ASGI Django adatterebbe tutta la catena sotto di lui (e le viste
+# async) passando per un thread a ogni richiesta. La ricerca del file statico è in memoria, quindi si può
+# fare anche nel loop.
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # come MiddlewareMixin: Django deve riconoscere l'istanza come coroutine function
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import time
+
+from django.apps import apps
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+
+from .images import RENDITIONS_DIR, rendition_name
+
+# storage dei media indirizzato per contenuto: un file caricato viene salvato come cas/<xx>/<sha256>.<ext>,
+# quindi la stessa immagine caricata più volte (da ricette o profili diversi) occupa un solo file e un URL
+# non cambia mai contenuto (cache con scadenza lontana). Le rendition hanno un nome derivato da quello della
+# sorgente (recipes.images) e restano fuori dallo schema. Un file è referenziato finché una colonna di
+# IMAGE_FIELDS lo nomina: il conteggio si fa sulle colonne (indicizzate) invece che con un contatore, così
+# bulk_create e update in blocco non lo possono disallineare. release() cancella i file rimasti orfani.
+
+CONTENT_DIR = 'cas'
+IMAGE_FIELDS = [('recipes.Recipe', 'image'), ('users.Profile', 'image')]
+# un file appena ricaricato (anche come duplicato) non viene cancellato per questo tempo: copre il caso in
+# cui qualcuno lo sta riusando mentre l'ultimo riferimento precedente viene eliminato
+GRACE_SECONDS = 3600
+EXTENSIONS = {'.jpeg': '.jpg'}
+
+
+def is_content_addressed(name):
+    return bool(name) and name.startswith(f'{CONTENT_DIR}/')
+
+
+def content_name(content, original_name):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    extension = os.path.splitext(original_name)[1].lower()
+    extension = EXTENSIONS.get(extension, extension)
+    hexdigest = digest.hexdigest()
+    return f'{CONTENT_DIR}/{hexdigest[:2]}/{hexdigest}{extension}'
+
+
+class ContentAddressedMixin:
+    # da combinare con uno storage di Django (FileSystemStorage qui sotto, S3Boto3Storage in produzione)
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        if name.startswith(f'{RENDITIONS_DIR}/') or is_content_addressed(name):
+            return super().save(name, content, max_length)
+        name = content_name(content, name)
+        if self.exists(name):
+            self.touch(name)
+            return name
+        return super().save(name, content, max_length)
+
+    def touch(self, name):
+        pass
+
+
+class ContentAddressedStorage(ContentAddressedMixin, FileSystemStorage):
+    def touch(self, name):
+        os.utime(self.path(name))
+
+
+def referenced(names, using=None):
+    # i nomi tra quelli dati ancora usati da almeno una riga
+    names = list(names)
+    found = set()
+    for label, field in IMAGE_FIELDS:
+        model = apps.get_model(label)
+        found.update(model.objects.using(using).filter(**{f'{field}__in': names}).values_list(field, flat=True))
+    return found
+
+
+def rendition_names(name):
+    sizes = set()
+    for label, field in IMAGE_FIELDS:
+        sizes.update(getattr(apps.get_model(label), 'RENDITIONS', {}).values())
+    return [rendition_name(name, size, fmt) for size in sizes for fmt in ('WEBP', 'JPEG')]
+
+
+def delete_file(name, storage=default_storage):
+    storage.delete(name)
+    for rendition in rendition_names(name):
+        storage.delete(rendition)
+
+
+def collect(names, grace=None, storage=default_storage):
+    # cancella (con le rendition) i file indirizzati per contenuto che nessuno usa più; restituisce i nomi
+    names = {name for name in names if is_content_addressed(name)}
+    grace = GRACE_SECONDS if grace is None else grace
+    deleted = []
+    for name in sorted(names - referenced(names)):
+        if not storage.exists(name):
+            continue
+        if grace and time.time() - storage.get_modified_time(name).timestamp() < grace:
+            continue
+        delete_file(name, storage)
+        deleted.append(name)
+    return deleted
+
+
+def release(names, using=None):
+    # dopo la cancellazione o il cambio d'immagine di una riga: i file si controllano a transazione confermata.
+    # Gli orfani ancora nel periodo di grazia li recupera gc_media
+    names = {name for name in names if is_content_addressed(name)}
+    if names:
+        transaction.on_commit(lambda: collect(names), using=using)
+
+
+def remember_image(instance, update_fields=None, field='image'):
+    # pre_save: il nome dell'immagine prima del salvataggio, per sapere se quella vecchia va rilasciata
+    instance._previous_image = None
+    if not instance._state.adding and (update_fields is None or field in update_fields):
+        instance._previous_image = (type(instance)._base_manager.filter(pk=instance.pk)
+                                    .values_list(field, flat=True).first())
+
+
+def release_replaced_image(instance, field='image'):
+    previous = getattr(instance, '_previous_image', None)
+    if previous and previous != getattr(instance, field).name:
+        release([previous])
@@ -0,0 +1,53 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# coda locale di lavori in background: un pool di thread nel processo web, niente broker esterno.
+# I lavori partono solo dopo il commit, così il worker legge dati già visibili sulla sua connessione.
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            # due richieste concorrenti non devono creare due pool
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'BACKGROUND_TASK_WORKERS', 2),
+                                               thread_name_prefix='recipes-tasks')
+    return _executor
+
+
+def _call(func, args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Background task %s%r failed', func.__name__, args)
+
+
+def _run(func, args):
+    close_old_connections()
+    try:
+        _call(func, args)
+    finally:
+        close_old_connections()
+
+
+def run_in_background(func, *args):
+    # con BACKGROUND_TASKS_EAGER (test, comandi di gestione) il lavoro gira subito nel thread corrente
+    if getattr(settings, 'BACKGROUND_TASKS_EAGER', False):
+        func(*args)
+        return
+    if connection.vendor == 'sqlite':
+        # SQLite ammette un solo scrittore: un thread che scrive mentre un'altra connessione ha una
+        # transazione aperta fallisce con "database table is locked". Il lavoro gira quindi dopo il commit
+        # nel thread della richiesta, che aspetta la fine dell'elaborazione
+        transaction.on_commit(lambda: _call(func, args))
+        return
+    transaction.on_commit(lambda: _get_executor().submit(_run, func, args))
@@ -0,0 +1,23 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from recipes import cards
+
+register = template.Library()
+
+
+# {% recipe_cards recipes 'grid' %}: le card di un elenco di ricette nella variante indicata (recipes.cards),
+# ognuna in cache per versione della ricetta. Le ricette arrivano da Recipe.objects.for_cards().
+# La card mostra il cuore se la ricetta è tra i preferiti dell'utente (liked_recipes nel contesto,
+# recipes.liked): le due varianti sono in cache separatamente
+@register.simple_tag(takes_context=True)
+def recipe_cards(context, recipes, variant):
+    html = cards.render(context.template.engine, recipes, variant, context.get('liked_recipes', ()),
+                        context.autoescape)
+    return mark_safe(''.join(html))
+
+
+# {% recipe_card recipe 'row' %}: una sola card
+@register.simple_tag(takes_context=True)
+def recipe_card(context, recipe, variant):
+    return recipe_cards(context, [recipe], variant)
@@ -0,0 +1,23 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+# i test girano con MEDIA_ROOT in una cartella temporanea che contiene solo default.jpg, l'immagine predefinita di
+# ricette e profili: le rendition e i file caricati dai test non finiscono nella cartella media del progetto
+class TemporaryMediaRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.media_root = tempfile.mkdtemp()
+        shutil.copy(os.path.join(settings.MEDIA_ROOT, 'default.jpg'), self.media_root)
+        self.media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.media_settings.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,1184 @@
-from django.test import TestCase
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.http import Http404, HttpResponse
+from django.shortcuts import render
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from PIL import Image
+
+from .cache_backends import RedisCache
+from . import (benchmark, checks, db, explain, facets, instrumentation, leaderboard, liked, matching, media,
+               recommendations, search, sitemaps, storage, tasks)
+from .caching import get_stats
+from .bulk import RecipeImporter
+from .forms import IngredientFormSet
+from .models import (Recipe, Category, FacetCount, Ingredient, IngredientTerm, Like, RecipeSimilarity,
+                     generate_unique_slug)
+from .pagination import KeysetPaginator
+
 
 # Create your tests here.
+class RecipeListQueriesTest(TestCase):
+    # il numero di query di ogni pagina elenco non deve dipendere da quante ricette vengono mostrate
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cook', password='secret-pass')
+        cls.category = Category.objects.create(name='Pasta')
+
+    def create_recipes(self, n):
+        for i in range(n):
+            recipe = Recipe.objects.create(title=f'Recipe {i}', description='A tasty dish ' * 20, content='Cook it',
+                                           author=self.user, portions=2, cooking_time=10)
+            recipe.category.add(self.category)
+            recipe.likes.add(self.user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_constant(self):
+        self.client.login(username='cook', password='secret-pass')
+        urls = [
+            reverse('home'),
+            reverse('recipes'),
+            reverse('favourites'),
+            reverse('myRecipes'),
+            reverse('categoryDetail', kwargs={'slug': self.category.slug}),
+            reverse('recipeSearch') + '?q=Recipe',
+        ]
+        self.create_recipes(1)
+        expected = {url: self.count_queries(url) for url in urls}
+        self.create_recipes(30)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), expected[url])
+
+    def test_async_pages_render_outside_the_event_loop(self):
+        # sotto ASGI la catena resta async e il rendering va nel thread di sync_to_async, non nel loop
+        for path in settings.MIDDLEWARE:
+            self.assertTrue(getattr(import_string(path), 'async_capable', False), path)
+        self.create_recipes(2)
+        threads = []
+
+        def tracked_render(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return render(*args, **kwargs)
+
+        async def get(url):
+            return await self.async_client.get(url)
+
+        with mock.patch('recipes.views.render', tracked_render):
+            response = async_to_sync(get)(reverse('recipes'))
+        self.assertContains(response, 'Recipe 1')
+        self.assertEqual(threads, [threading.current_thread()])
+
+
+class KeysetPaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='cook', password='secret-pass')
+        recipes = [Recipe.objects.create(title=f'Recipe {i}', description='A tasty dish', content='Cook it',
+                                         author=user, portions=2, cooking_time=10) for i in range(7)]
+        # tre ricette con la stessa data, a cavallo tra la seconda e la terza pagina: decide l'id
+        Recipe.objects.filter(pk__in=[recipe.pk for recipe in recipes[2:5]]).update(
+            date_posted=timezone.now() - timedelta(days=1))
+        cls.expected = [recipes[i].pk for i in (6, 5, 1, 0, 4, 3, 2)]
+
+    def test_forward_and_backward(self):
+        paginator = KeysetPaginator(Recipe.objects.all(), per_page=3)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        self.assertEqual([[recipe.pk for recipe in page] for page in pages],
+                         [self.expected[0:3], self.expected[3:6], self.expected[6:]])
+        self.assertFalse(pages[0].has_previous())
+
+        back = paginator.page(pages[2].previous_cursor)
+        self.assertEqual([recipe.pk for recipe in back], self.expected[3:6])
+        first = paginator.page(back.previous_cursor)
+        self.assertEqual([recipe.pk for recipe in first], self.expected[0:3])
+        self.assertFalse(first.has_previous())
+        self.assertEqual([recipe.pk for recipe in paginator.page(first.next_cursor)], self.expected[3:6])
+
+    def test_bad_cursor_is_not_found(self):
+        cursor = KeysetPaginator(Recipe.objects.all(), per_page=3).page().next_cursor
+        self.assertEqual(self.client.get(reverse('recipes'), {'cursor': cursor}).status_code, 200)
+        for bad in ['garbage', cursor[:-1] + ('A' if cursor[-1] != 'A' else 'B'), cursor + 'x']:
+            with self.subTest(cursor=bad):
+                self.assertEqual(self.client.get(reverse('recipes'), {'cursor': bad}).status_code, 404)
+
+
+class SlugTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cook')
+
+    def create_recipe(self, title):
+        return Recipe.objects.create(title=title, description='d', content='c', author=self.user,
+                                     portions=1, cooking_time=1)
+
+    def test_duplicates_get_numbered_slugs(self):
+        slugs = [self.create_recipe('Pasta Carbonara').slug for i in range(12)]
+        self.assertEqual(slugs[:3], ['pasta-carbonara', 'pasta-carbonara-1', 'pasta-carbonara-2'])
+        self.assertEqual(slugs[-1], 'pasta-carbonara-11')
+        self.assertEqual(self.create_recipe('Pasta').slug, 'pasta')
+        # ogni modello controlla la propria tabella
+        self.assertEqual(Category.objects.create(name='Pasta Carbonara').slug, 'pasta-carbonara')
+
+    def test_suffixes_with_leading_zeros_are_ignored(self):
+        for slug in ['pasta', 'pasta-8', 'pasta-10', 'pasta-007']:
+            Recipe.objects.create(slug=slug, title='Pasta', description='d', content='c', author=self.user,
+                                  portions=1, cooking_time=1)
+        with mock.patch('recipes.models.generate_unique_slug', wraps=generate_unique_slug) as generate:
+            self.assertEqual(self.create_recipe('Pasta').slug, 'pasta-11')
+        # nessun nuovo tentativo
+        self.assertEqual(generate.call_count, 1)
+
+    def test_slug_taken_concurrently_is_retried(self):
+        recipe = self.create_recipe('Soup')
+        # simula un'altra richiesta che ha appena inserito lo slug che verrebbe scelto
+        Recipe.objects.filter(pk=recipe.pk).update(slug='stew-7')
+        with mock.patch('recipes.models.generate_unique_slug', side_effect=['stew-7', 'stew-8']):
+            self.assertEqual(self.create_recipe('Stew').slug, 'stew-8')
+
+    def import_recipes(self, *titles_and_slugs):
+        importer = RecipeImporter(default_author='cook')
+        importer.run([{'title': title, 'slug': slug, 'portions': 1, 'cooking_time': 1}
+                      for title, slug in titles_and_slugs])
+        return list(Recipe.objects.order_by('-pk')[:len(titles_and_slugs)].values_list('slug', flat=True))[::-1]
+
+    def test_import_skips_slugs_allocated_in_the_same_batch(self):
+        self.create_recipe('Soup')
+        slugs = self.import_recipes(('Soup', 'soup-2'), ('Soup', None), ('Soup', None), ('Soup', 'soup-1'))
+        self.assertEqual(slugs, ['soup-2', 'soup-1', 'soup-3', 'soup-1-1'])
+
+    def test_import_retries_slugs_taken_concurrently(self):
+        self.create_recipe('Stew')
+        # un'altra richiesta inserisce stew-1 tra la scelta degli slug e l'inserimento del lotto
+        with mock.patch('recipes.bulk.last_slug_number', side_effect=[0, 1]) as last_number:
+            Recipe.objects.create(slug='stew-1', title='Stew', description='d', content='c', author=self.user,
+                                  portions=1, cooking_time=1)
+            self.assertEqual(self.import_recipes(('Stew', None)), ['stew-2'])
+        self.assertEqual(last_number.call_count, 2)
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='cook', password='secret-pass')
+        recipes = {
+            'bake': ('Pasta bake', 'Baked in the oven with cheese'),
+            'bowl': ('Green bowl', 'Leftover pasta with greens'),
+            'pesto': ('Pesto chicken', 'Chicken with basil pesto'),
+            'tomato': ('Tomato pasta', 'Fresh tomato sauce on pasta'),
+            'crab': ('Crab cakes', 'Crab with breadcrumbs'),
+        }
+        cls.ids = {name: Recipe.objects.create(title=title, description=description, content='Cook it',
+                                               author=user, portions=2, cooking_time=10).pk
+                   for name, (title, description) in recipes.items()}
+
+    def found(self, backend, query):
+        with connection.cursor() as cursor:
+            hits = backend.search(cursor, search.parse_query(query), None, False, 50)
+        names = {pk: name for name, pk in self.ids.items()}
+        return [names[pk] for pk, score in hits]
+
+    def test_title_matches_rank_first(self):
+        found = self.found(search.get_backend(), 'pasta')
+        self.assertEqual(set(found), {'bake', 'bowl', 'tomato'})
+        if connection.vendor in search.BACKENDS:
+            self.assertEqual(found[-1], 'bowl')
+
+    def test_query_syntax_is_the_same_on_every_backend(self):
+        expected = {
+            'pasta pesto': set(),
+            'pasta OR pesto': {'bake', 'bowl', 'tomato', 'pesto'},
+            '"tomato sauce"': {'tomato'},
+            '"sauce tomato"': set(),
+            'pasta -tomato': {'bake', 'bowl'},
+            '-pasta': set(),
+            'crab or -pasta': {'crab'},
+        }
+        for backend in (search.get_backend(), search.BasicSearchBackend()):
+            for query, names in expected.items():
+                with self.subTest(backend=type(backend).__name__, query=query):
+                    self.assertEqual(set(self.found(backend, query)), names)
+
+    def test_hostile_input(self):
+        queries = ['"', '"unbalanced phrase', 'NEAR(pasta', 'pasta AND NOT *', "'; DROP TABLE recipes_recipe; --",
+                   'title:pasta^', '(((', '-', 'OR', 'pasta OR OR pesto', '\x00']
+        for query in queries:
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(reverse('recipeSearch'), {'q': query}).status_code, 200)
+        self.assertEqual(Recipe.objects.count(), 5)
+
+    def test_other_databases_fall_back_to_icontains(self):
+        with mock.patch.object(search, 'connection', mock.Mock(vendor='mysql')):
+            self.assertIsInstance(search.get_backend(), search.BasicSearchBackend)
+
+
+@override_settings(INGREDIENT_INDEX_REFRESH=0)
+class MatchingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='cook')
+        cls.recipes = {}
+        for title, names in [('Omelette', ['Eggs', 'Milk', 'Butter']), ('Pancakes', ['Flour', 'Egg', 'Milk', 'Sugar']),
+                             ('Salad', ['Lettuce', 'Tomatoes'])]:
+            recipe = cls.recipes[title] = Recipe.objects.create(title=title, description='d', content='c',
+                                                                author=author, portions=1, cooking_time=1)
+            for name in names:
+                Ingredient.objects.create(recipe=recipe, name=name, quantity='1')
+
+    def setUp(self):
+        matching._index = matching._rebuilding_since = None
+
+    def cook(self, ingredients):
+        response = self.client.get(reverse('whatCanICook'), {'ingredients': ingredients})
+        return [(recipe.title, recipe.matched, recipe.total) for recipe in response.context['recipes']]
+
+    def test_full_match_comes_first(self):
+        self.assertEqual(self.cook('egg, MILK; butter'), [('Omelette', 3, 3), ('Pancakes', 2, 4)])
+
+    def test_partial_match_counts_missing_ingredients(self):
+        self.assertEqual(self.cook('tomato'), [('Salad', 1, 2)])
+
+    def test_results_use_the_memoized_cards(self):
+        cache.clear()
+        response = self.client.get(reverse('whatCanICook'), {'ingredients': 'egg, milk'})
+        self.assertContains(response, 'You have <strong>2 of 3</strong> ingredients', html=True)
+        self.assertContains(response, f'href="{self.recipes["Omelette"].get_absolute_url()}"')
+        self.client.get(reverse('whatCanICook'), {'ingredients': 'egg, milk'})
+        self.assertEqual(get_stats()['card'], {'hits': 2, 'misses': 2})
+        # le card hanno in chiave anche i conteggi
+        response = self.client.get(reverse('whatCanICook'), {'ingredients': 'egg, milk, butter'})
+        self.assertContains(response, 'You have <strong>3 of 3</strong> ingredients', html=True)
+        self.assertEqual(get_stats()['card'], {'hits': 3, 'misses': 3})
+
+    def test_unknown_ingredient(self):
+        self.assertEqual(self.cook('dragon fruit'), [])
+        self.assertEqual(self.cook(' , ;'), [])
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_index_follows_ingredient_changes(self):
+        self.assertEqual(self.cook('lettuce'), [('Salad', 1, 2)])
+        salad = self.recipes['Salad']
+        ingredient = salad.ingredient_set.get(name='Tomatoes')
+        ingredient.name = 'Lettuce'
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        self.assertEqual(self.cook('lettuce'), [('Salad', 1, 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(recipe=self.recipes['Omelette'], name='lettuce', quantity='1')
+        self.assertEqual(self.cook('lettuce'), [('Salad', 1, 1), ('Omelette', 1, 4)])
+
+    def test_changes_are_indexed_in_the_background(self):
+        self.assertEqual(self.cook('lettuce'), [('Salad', 1, 2)])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(recipe=self.recipes['Omelette'], name='lettuce', quantity='1')
+        with mock.patch.object(matching, 'run_in_background') as background:
+            # le richieste non aspettano la ricostruzione (solo termini e ricette) e ne accodano una sola
+            with self.assertNumQueries(2):
+                self.assertEqual(self.cook('lettuce'), [('Salad', 1, 2)])
+            self.assertEqual(self.cook('lettuce'), [('Salad', 1, 2)])
+        background.assert_called_once()
+        background.call_args[0][0](*background.call_args[0][1:])
+        self.assertEqual(self.cook('lettuce'), [('Salad', 1, 2), ('Omelette', 1, 4)])
+
+
+class RecipeEditorTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cook', password='secret-pass')
+        cls.category = Category.objects.create(name='Breakfast')
+
+    def setUp(self):
+        self.client.login(username='cook', password='secret-pass')
+
+    def post_recipe(self, url, ingredients, initial=0):
+        data = {'title': 'Pancakes', 'description': 'Fluffy', 'content': 'Mix and fry', 'difficulty': 2,
+                'portions': 4, 'cooking_time': 20, 'category': [self.category.pk],
+                'ingredient_set-TOTAL_FORMS': len(ingredients), 'ingredient_set-INITIAL_FORMS': initial}
+        for i, ingredient in enumerate(ingredients):
+            data.update({f'ingredient_set-{i}-{field}': value for field, value in ingredient.items()})
+        return self.client.post(url, data)
+
+    def test_create_and_update_in_one_request(self):
+        response = self.post_recipe(reverse('recipesCreate'), [
+            {'name': 'Eggs', 'quantity': '2'}, {'name': 'Flour', 'quantity': '200g'}, {'name': 'Milk'}])
+        recipe = Recipe.objects.get(title='Pancakes')
+        self.assertRedirects(response, reverse('recipesDetail', kwargs={'slug': recipe.slug}))
+        self.assertEqual(sorted(recipe.ingredient_set.values_list('name', 'term__name')),
+                         [('Eggs', 'egg'), ('Flour', 'flour'), ('Milk', 'milk')])
+
+        eggs, flour, milk = recipe.ingredient_set.order_by('pk')
+        self.post_recipe(reverse('recipesUpdate', kwargs={'slug': recipe.slug}), [
+            {'id': eggs.pk, 'name': 'Eggs', 'quantity': '3'},
+            {'id': flour.pk, 'name': 'Flour', 'quantity': '200g'},
+            {'id': milk.pk, 'name': 'Milk', 'DELETE': 'on'},
+            {'name': 'Butter', 'quantity': '10g'},
+        ], initial=3)
+        self.assertEqual(sorted(recipe.ingredient_set.values_list('name', 'quantity')),
+                         [('Butter', '10g'), ('Eggs', '3'), ('Flour', '200g')])
+
+    def test_only_the_author_can_edit(self):
+        recipe = Recipe.objects.create(title='Soup', description='d', content='c', portions=1, cooking_time=1,
+                                       author=User.objects.create_user(username='other'))
+        response = self.post_recipe(reverse('recipesUpdate', kwargs={'slug': recipe.slug}), [])
+        self.assertEqual(response.status_code, 403)
+
+    def test_formset_save_without_commit_writes_nothing(self):
+        recipe = Recipe.objects.create(title='Soup', description='d', content='c', portions=1, cooking_time=1,
+                                       author=self.user)
+        carrot = Ingredient.objects.create(recipe=recipe, name='Carrot', quantity='2')
+        formset = IngredientFormSet({
+            'ingredient_set-TOTAL_FORMS': 2, 'ingredient_set-INITIAL_FORMS': 1,
+            'ingredient_set-0-id': carrot.pk, 'ingredient_set-0-name': 'Carrot', 'ingredient_set-0-DELETE': 'on',
+            'ingredient_set-1-name': 'Leek',
+        }, instance=recipe)
+        self.assertTrue(formset.is_valid())
+        with self.assertNumQueries(0):
+            ingredients = formset.save(commit=False)
+        self.assertEqual([ingredient.name for ingredient in ingredients], ['Leek'])
+        self.assertEqual(formset.deleted_objects, [carrot])
+        self.assertEqual(list(recipe.ingredient_set.values_list('name', flat=True)), ['Carrot'])
+
+
+class ApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cook')
+        cls.recipe = Recipe.objects.create(title='Soup', description='Hot soup', content='Boil it',
+                                           author=cls.user, portions=2, cooking_time=10)
+        Ingredient.objects.create(recipe=cls.recipe, name='Carrot', quantity='2')
+
+    def test_sparse_fields(self):
+        response = self.client.get(reverse('apiRecipeDetail', args=['soup']), {'fields': 'title,ingredients'})
+        self.assertEqual(response.json(), {'title': 'Soup', 'ingredients': [{'name': 'Carrot', 'quantity': '2'}]})
+        self.assertEqual(self.client.get(reverse('apiRecipes'), {'fields': 'password'}).status_code, 400)
+
+    def test_conditional_get(self):
+        for url in (reverse('apiRecipes'), reverse('apiRecipeDetail', args=['soup'])):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertIn('Last-Modified', response)
+                # la versione già in mano al client costa una sola query e nessun corpo
+                with self.assertNumQueries(1):
+                    cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(cached.status_code, 304)
+
+                Recipe.objects.filter(pk=self.recipe.pk).update(updated_at=timezone.now() + timedelta(seconds=1))
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_list_page_is_loaded_once(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('apiRecipes'))
+        self.assertIn('ETag', response)
+        # con le relazioni: una query in più per ognuna
+        with self.assertNumQueries(3):
+            self.client.get(reverse('apiRecipes'), {'fields': 'id,ingredients,categories'})
+
+    def test_missing_resources_have_no_validators(self):
+        for url in (reverse('apiRecipeDetail', args=['stew']), reverse('apiCategoryRecipes', args=['stews'])):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+                self.assertEqual(response.status_code, 404)
+                self.assertNotIn('ETag', response)
+                self.assertNotIn('Last-Modified', response)
+
+    def test_errors_are_json(self):
+        for url, params in ((reverse('apiRecipeDetail', args=['stew']), {}),
+                            (reverse('apiCategoryRecipes', args=['stews']), {}),
+                            (reverse('apiRecipes'), {'cursor': 'not-a-cursor'})):
+            with self.subTest(url=url):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response['Content-Type'], 'application/json')
+                self.assertIn('detail', response.json())
+
+    def test_etags_follow_categories_in_the_database(self):
+        category = Category.objects.create(name='Soups')
+        self.recipe.category.add(category)
+        urls = (reverse('apiRecipes'), reverse('apiRecipeDetail', args=['soup']), reverse('apiCategories'),
+                reverse('apiCategoryRecipes', args=['soups']))
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        # niente dalla cache locale del worker: un altro processo calcola gli stessi ETag
+        cache.clear()
+        self.assertEqual([self.client.get(url)['ETag'] for url in urls], etags)
+
+        Category.objects.filter(pk=category.pk).update(updated_at=timezone.now() + timedelta(seconds=1))
+        for url, etag in zip(urls, etags):
+            self.assertNotEqual(self.client.get(url)['ETag'], etag)
+
+    def test_favourites_follow_like_time(self):
+        newer = Recipe.objects.create(title='Stew', description='d', content='c', author=self.user, portions=1,
+                                      cooking_time=1)
+        self.recipe.toggle_like(self.user)
+        newer.toggle_like(self.user)
+        Like.objects.filter(recipe=newer).update(created_at=timezone.now() - timedelta(days=1))
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('apiFavourites'), {'fields': 'slug'})
+        self.assertEqual(response.json()['results'], [{'slug': 'soup'}, {'slug': 'stew'}])
+
+
+class ToggleLikeTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cook', password='secret-pass')
+        cls.recipe = Recipe.objects.create(title='Soup', description='d', content='c', author=cls.user,
+                                           portions=1, cooking_time=1)
+
+    def test_toggle_returns_the_new_count(self):
+        url = reverse('toggleLike', kwargs={'pk': self.recipe.pk})
+        self.assertEqual(self.client.post(url).status_code, 403)
+        self.client.login(username='cook', password='secret-pass')
+        self.assertEqual(self.client.post(url).json(), {'liked': True, 'like_count': 1})
+        self.assertEqual(self.client.post(url).json(), {'liked': False, 'like_count': 0})
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.assertEqual(self.client.post(reverse('toggleLike', kwargs={'pk': 0})).status_code, 404)
+
+
+REDIS_CACHES = {'default': {'BACKEND': 'recipes.cache_backends.RedisCache', 'TIMEOUT': None,
+                            'OPTIONS': {'CLIENT_FACTORY': 'recipes.tests.FakeRedis'}}}
+
+
+@override_settings(CACHES=REDIS_CACHES)
+class LikedSetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cook', password='secret-pass')
+        cls.recipes = [Recipe.objects.create(title=f'Soup {i}', description='d', content='c', author=cls.user,
+                                             portions=1, cooking_time=1) for i in range(3)]
+
+    def setUp(self):
+        cache.clear()
+
+    def toggle(self, recipe):
+        with self.captureOnCommitCallbacks(execute=True):
+            return recipe.toggle_like(self.user)
+
+    def test_toggles_update_the_cached_set(self):
+        first, second, third = self.recipes
+        self.toggle(third)
+        self.assertEqual(list(liked.liked_recipes(self.user)), [third.pk])
+        self.toggle(first)
+        self.toggle(third)
+        with self.assertNumQueries(0):
+            ids = liked.liked_recipes(self.user)
+        self.assertEqual((first.pk in ids, second.pk in ids, third.pk in ids), (True, False, False))
+
+    def test_pages_show_liked_state_and_favourites_follow_like_time(self):
+        first, second, third = self.recipes
+        self.toggle(second)
+        self.toggle(first)
+        self.client.login(username='cook', password='secret-pass')
+        response = self.client.get(reverse('recipes'))
+        self.assertContains(response, 'title="In your favourites"', count=2)
+        self.assertTrue(self.client.get(reverse('recipesDetail', args=[first.slug])).context['is_liked'])
+        response = self.client.get(reverse('favourites'))
+        self.assertEqual([recipe.pk for recipe in response.context['recipes']], [first.pk, second.pk])
+
+    def test_local_cache_reads_the_database(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            liked.liked_recipes(self.user)
+            self.toggle(self.recipes[0])
+            with self.assertNumQueries(1):
+                self.assertEqual(list(liked.liked_recipes(self.user)), [self.recipes[0].pk])
+            self.assertIsNone(cache.get(f'liked:{self.user.pk}'))
+
+
+class LeaderboardTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(username=f'user{i}') for i in range(3)]
+        cls.old, cls.new = [Recipe.objects.create(title=title, description='d', content='c', author=cls.users[0],
+                                                  portions=1, cooking_time=1) for title in ('Old', 'New')]
+
+    def test_toggle_like_keeps_counters(self):
+        self.new.toggle_like(self.users[0])
+        self.new.toggle_like(self.users[1])
+        self.new.toggle_like(self.users[0])
+        self.new.refresh_from_db()
+        self.assertEqual((self.new.like_count, self.new.weekly_like_count), (1, 1))
+        liked_at = Like.objects.get(recipe=self.new).created_at
+        self.assertAlmostEqual(self.new.trending_score, leaderboard.score_from_likes([liked_at]))
+
+    def test_every_way_of_changing_likes_keeps_counters(self):
+        def counters():
+            return list(Recipe.objects.order_by('pk').values_list('like_count', 'weekly_like_count', 'trending_score'))
+
+        def assert_rebuilt():
+            current = counters()
+            leaderboard.rebuild(Recipe, Like)
+            for row, expected in zip(current, counters()):
+                self.assertEqual(row[:2], expected[:2])
+                self.assertAlmostEqual(row[2], expected[2])
+
+        self.new.likes.add(*self.users)
+        self.users[0].likes.add(self.old)
+        Like.objects.create(recipe=self.old, user=self.users[1], created_at=timezone.now() - timedelta(days=30))
+        self.assertEqual(counters()[0][:2], (2, 1))
+        assert_rebuilt()
+        self.users[1].likes.remove(self.new)
+        self.old.likes.remove(self.users[0])
+        assert_rebuilt()
+        self.users[2].delete()
+        self.assertEqual(Recipe.objects.get(pk=self.new.pk).like_count, 1)
+        self.users[1].likes.clear()
+        self.new.likes.clear()
+        self.assertEqual(counters(), [(0, 0, 0.0), (0, 0, 0.0)])
+
+    def test_recent_likes_trend_higher(self):
+        # due like vecchi di un mese contro uno di adesso
+        month_ago = timezone.now() - timedelta(days=30)
+        for user in self.users[:2]:
+            Like.objects.create(recipe=self.old, user=user, created_at=month_ago)
+        Like.objects.create(recipe=self.new, user=self.users[2])
+        leaderboard.rebuild(Recipe, Like)
+        self.assertEqual(list(Recipe.objects.leaderboard(leaderboard.ALL_TIME)), [self.old, self.new])
+        self.assertEqual(list(Recipe.objects.leaderboard(leaderboard.TRENDING)), [self.new, self.old])
+
+        Like.objects.filter(recipe=self.new).update(created_at=month_ago)
+        leaderboard.refresh_weekly(Recipe, Like)
+        self.assertEqual(Recipe.objects.filter(weekly_like_count__gt=0).count(), 0)
+
+    def test_likes_before_the_epoch_still_trend(self):
+        # i like precedenti a leaderboard.EPOCH hanno punteggio negativo ma restano in classifica
+        Like.objects.create(recipe=self.old, user=self.users[0], created_at=leaderboard.EPOCH - timedelta(days=365))
+        leaderboard.rebuild(Recipe, Like)
+        self.old.refresh_from_db()
+        self.assertLess(self.old.trending_score, 0)
+        self.assertEqual(list(Recipe.objects.leaderboard(leaderboard.TRENDING)), [self.old])
+
+        self.old.toggle_like(self.users[1])
+        self.old.toggle_like(self.users[1])
+        self.new.toggle_like(self.users[1])
+        self.assertEqual(list(Recipe.objects.leaderboard(leaderboard.TRENDING)), [self.new, self.old])
+        self.new.toggle_like(self.users[1])
+        self.assertEqual(list(Recipe.objects.leaderboard(leaderboard.TRENDING)), [self.old])
+
+
+@override_settings(INSTRUMENTATION_SAMPLE_RATE=1, INSTRUMENTATION_N_PLUS_ONE=5)
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        instrumentation.stats.clear()
+
+    def test_n_plus_one_is_flagged(self):
+        def view(request):
+            for i in range(6):
+                list(Recipe.objects.filter(pk=i))
+            return HttpResponse('ok')
+
+        request = RequestFactory().get('/')
+        response = instrumentation.InstrumentationMiddleware(view)(request)
+        self.assertIn('desc="6 queries"', response['Server-Timing'])
+        [row] = instrumentation.summarize(instrumentation.stats.snapshot())
+        self.assertEqual((row['requests'], row['max_queries'], row['n_plus_one'], row['repeated_count']), (1, 6, 1, 6))
+
+    def test_async_requests_are_measured(self):
+        async def view(request):
+            await sync_to_async(Recipe.objects.count)()
+            await sync_to_async(User.objects.count)()
+            return HttpResponse('ok')
+
+        middleware = instrumentation.InstrumentationMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_measured(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('home')))
+        self.assertEqual(instrumentation.stats.snapshot()['samples'], {})
+
+
+class BenchmarkTest(TestCase):
+    def test_seed_and_run_every_journey(self):
+        created = benchmark.seed(users=3, recipes=10, ingredients=3, categories=2, likes=4)
+        self.assertEqual((created['recipes'], created['ingredients'], created['likes']), (10, 30, 12))
+
+        result = benchmark.run(iterations=2, warmup=1)
+        self.assertEqual(set(result['journeys']), {'home', 'recipe_list', 'recipe_detail', 'search', 'category',
+                                                   'toggle_like', 'create_recipe'})
+        self.assertEqual([row['errors'] for row in result['journeys'].values()], [0] * 7)
+        # la transazione del benchmark è stata annullata
+        self.assertEqual(Recipe.objects.count(), 10)
+        self.assertEqual(benchmark.compare(result, result), [])
+
+
+class ExplainTest(TestCase):
+    def test_every_page_is_explained(self):
+        benchmark.seed(users=2, recipes=10, ingredients=3, categories=2, likes=4)
+        result = explain.run()
+        self.assertEqual({name: page['status'] for name, page in result['pages'].items() if page['status'] != 200},
+                         {'create_recipe': 302})
+        self.assertTrue(all(page['plans'] for page in result['pages'].values()))
+        # le ricette apprezzate escono già in ordine dall'indice (user, recipe)
+        self.assertEqual(result['pages']['favourites']['problems'], [])
+        self.assertEqual(explain.compare(result, result), [])
+
+        baseline = {'pages': {'favourites': {'problems': []}}}
+        result['pages']['favourites']['problems'] = ['full scan of recipes_recipe_likes']
+        self.assertEqual(explain.compare(baseline, result), ['favourites: full scan of recipes_recipe_likes'])
+        self.assertEqual(Recipe.objects.count(), 10)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRoutingTest(TestCase):
+    def route(self, view, method='get', cookies=None):
+        router, seen = db.ReplicaRouter(), {}
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            seen['recipe'], seen['session'] = view(request, router)
+            return HttpResponse()
+
+        middleware = db.ReplicaMiddleware(get_response)
+        request = getattr(RequestFactory(), method)('/')
+        request.COOKIES.update(cookies or {})
+        response = middleware(request)
+        return seen, db.STICKY_COOKIE in response.cookies
+
+    def test_reads_go_to_the_replica_until_the_client_writes(self):
+        @db.replica_reads
+        def read(request, router):
+            return router.db_for_read(Recipe), (router.db_for_read(Session), router.db_for_read(User))
+
+        @db.replica_reads
+        def write(request, router):
+            # db_for_write da solo non conta: servono le scritture vere (signal)
+            router.db_for_write(Recipe)
+            IngredientTerm.objects.create(name='egg')
+            return router.db_for_read(Recipe), None
+
+        @db.replica_reads
+        def login(request, router):
+            Session.objects.create(session_key='k', session_data='', expire_date=timezone.now())
+            return router.db_for_read(Recipe), None
+
+        self.assertEqual(self.route(read), ({'recipe': 'replica1', 'session': ('default', 'default')}, False))
+        self.assertEqual(self.route(read, 'post'), ({'recipe': 'default', 'session': ('default', 'default')}, False))
+        self.assertEqual(self.route(write), ({'recipe': 'default', 'session': None}, True))
+        self.assertEqual(self.route(login), ({'recipe': 'replica1', 'session': None}, False))
+        self.assertEqual(self.route(read, cookies={db.STICKY_COOKIE: '1'})[0]['recipe'], 'default')
+        self.assertEqual(self.route(lambda request, router: (router.db_for_read(Recipe), None))[0]['recipe'],
+                         'default')
+
+    def test_async_requests_stick_after_a_write(self):
+        async def view(request):
+            await sync_to_async(Category.objects.create)(name='Soups')
+            return HttpResponse()
+
+        middleware = db.ReplicaMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().post('/'))
+        self.assertIn(db.STICKY_COOKIE, response.cookies)
+
+
+class ContentAddressedStorageTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        shutil.copy(default_storage.path('default.jpg'), self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root, BACKGROUND_TASKS_EAGER=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user(username='cook')
+
+    def upload(self, name, color='red'):
+        buffer = BytesIO()
+        Image.new('RGB', (600, 400), color).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def create_recipe(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Recipe.objects.create(title='Soup', description='d', content='c', portions=1, cooking_time=1,
+                                         author=self.user, image=image)
+
+    @mock.patch.object(storage, 'GRACE_SECONDS', 0)
+    def test_duplicates_are_stored_once_and_collected_with_the_last_reference(self):
+        first = self.create_recipe(self.upload('soup.png'))
+        second = self.create_recipe(self.upload('Other Name.PNG'))
+        name = first.image.name
+        self.assertTrue(name.startswith('cas/'))
+        self.assertEqual(second.image.name, name)
+        renditions = Recipe.objects.values_list('image_card', flat=True).get(pk=first.pk)
+        self.assertTrue(default_storage.exists(renditions))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(default_storage.exists(renditions))
+
+    @mock.patch.object(storage, 'GRACE_SECONDS', 0)
+    def test_replaced_image_is_released(self):
+        recipe = self.create_recipe(self.upload('soup.png'))
+        old = recipe.image.name
+        recipe.image = self.upload('soup.png', color='blue')
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        self.assertNotEqual(recipe.image.name, old)
+        self.assertFalse(default_storage.exists(old))
+        self.assertTrue(default_storage.exists(recipe.image.name))
+
+    def test_recently_uploaded_orphans_are_kept_until_gc(self):
+        recipe = self.create_recipe(self.upload('soup.png'))
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertTrue(default_storage.exists(recipe.image.name))
+        self.assertEqual(storage.collect([recipe.image.name], grace=0), [recipe.image.name])
+
+
+class MediaServingTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root, MEDIA_SENDFILE='')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.name = default_storage.save('photo.jpg', SimpleUploadedFile('photo.jpg', bytes(range(256)) * 4))
+
+    def get(self, path, **headers):
+        return media.serve_media(RequestFactory().get('/media/' + path, **headers), path)
+
+    def test_content_addressed_files_are_immutable(self):
+        response = self.get(self.name)
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(256)) * 4)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(self.get(self.name, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_range_requests(self):
+        response = self.get(self.name, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual((response['Content-Range'], response['Content-Length']), ('bytes 10-19/1024', '10'))
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+        self.assertEqual(b''.join(self.get(self.name, HTTP_RANGE='bytes=-4').streaming_content), bytes(range(252, 256)))
+        self.assertEqual(self.get(self.name, HTTP_RANGE='bytes=2000-').status_code, 416)
+        # If-Range con una versione vecchia: file intero
+        self.assertEqual(self.get(self.name, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"old"').status_code, 200)
+
+    def test_sendfile_delegation_and_traversal(self):
+        with override_settings(MEDIA_SENDFILE='x-accel-redirect'):
+            response = self.get(self.name)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.name)
+        self.assertEqual(response.content, b'')
+        with self.assertRaises(Http404):
+            self.get('../settings.py')
+
+
+class BackgroundTaskTest(TestCase):
+    def test_one_executor_for_concurrent_callers(self):
+        pools = []
+        with mock.patch.object(tasks, '_executor', None):
+            threads = [threading.Thread(target=lambda: pools.append(tasks._get_executor())) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(set(pools)), 1)
+        pools[0].shutdown()
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_sqlite_runs_after_commit_in_the_request_thread(self):
+        calls = []
+        with self.captureOnCommitCallbacks(execute=True):
+            tasks.run_in_background(lambda value: calls.append((value, threading.current_thread())), 1)
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [(1, threading.current_thread())])
+
+
+class SitemapTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        settings = override_settings(SITEMAP_ROOT=self.root, SITE_URL='https://recipes.example/')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patcher = mock.patch.object(sitemaps, 'SHARD_SIZE', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='cook')
+        self.category = Category.objects.create(name='Soups')
+        self.recipes = [Recipe.objects.create(title=title, description='d', content='c', author=self.user,
+                                              portions=1, cooking_time=1) for title in 'ABCDE']
+        self.recipes[0].category.add(self.category)
+
+    def content(self, name, *args):
+        response = self.client.get(reverse(name, args=args))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        return b''.join(response.streaming_content).decode()
+
+    def test_incremental_build(self):
+        shards = len({recipe.pk // 2 for recipe in self.recipes})
+        self.assertEqual(sitemaps.build(), {'rebuilt': shards, 'deleted': 0, 'shards': shards, 'feeds': 4})
+        self.assertEqual(sitemaps.build(), {'rebuilt': 0, 'deleted': 0, 'shards': shards, 'feeds': 0})
+
+        first, last = self.recipes[0], self.recipes[-1]
+        first.title = 'A2'
+        first.save()
+        self.assertEqual(sitemaps.build()['rebuilt'], 1)
+        last.delete()
+        # la sua shard viene riscritta, o cancellata se era l'unica ricetta
+        result = sitemaps.build()
+        self.assertEqual(result['rebuilt'] + result['deleted'], 1)
+
+        index = self.content('sitemap')
+        self.assertIn(f'<loc>https://recipes.example/sitemap-recipes-{first.pk // 2}.xml</loc>', index)
+        shard = self.content('sitemapRecipes', first.pk // 2)
+        self.assertIn(f'<loc>https://recipes.example/recipes/{first.slug}/</loc>', shard)
+        self.assertEqual(self.client.get(reverse('sitemapRecipes', args=[1000])).status_code, 404)
+
+    def test_likes_do_not_change_lastmod(self):
+        sitemaps.build()
+        recipe = self.recipes[0]
+        lastmod = Recipe.objects.get(pk=recipe.pk).content_updated_at
+        recipe.toggle_like(User.objects.create_user(username='fan'))
+        self.assertEqual(Recipe.objects.get(pk=recipe.pk).content_updated_at, lastmod)
+        self.assertEqual(sitemaps.build()['rebuilt'], 0)
+        Ingredient.objects.create(recipe=recipe, name='salt', quantity='1')
+        self.assertGreater(Recipe.objects.get(pk=recipe.pk).content_updated_at, lastmod)
+        self.assertEqual(sitemaps.build()['rebuilt'], 1)
+
+    def test_failed_write_leaves_the_old_file(self):
+        def chunks():
+            yield 'partial'
+            raise ValueError
+        sitemaps.write(sitemaps.PAGES, ['old'])
+        with self.assertRaises(ValueError):
+            sitemaps.write(sitemaps.PAGES, chunks())
+        self.assertEqual(os.listdir(self.root), [sitemaps.PAGES])
+        with open(os.path.join(self.root, sitemaps.PAGES)) as f:
+            self.assertEqual(f.read(), 'old')
+
+    def test_files_are_written_only_by_the_build(self):
+        shard = self.recipes[0].pk // 2
+        for name, args in (('sitemap', []), ('sitemapPages', []), ('sitemapRecipes', [shard]), ('recipeFeed', ['rss']),
+                           ('categoryFeed', ['soups', 'atom'])):
+            with self.subTest(name=name):
+                self.assertEqual(self.client.get(reverse(name, args=args)).status_code, 404)
+        self.assertFalse(os.listdir(self.root))
+
+        sitemaps.build()
+        self.assertIn(self.recipes[0].slug, self.content('sitemapRecipes', shard))
+        self.assertIn('<loc>https://recipes.example/categories/soups/</loc>', self.content('sitemapPages'))
+        rss = self.content('recipeFeed', 'rss')
+        self.assertEqual([title in rss for title in 'ABCDE'], [True] * 5)
+        atom = self.content('categoryFeed', 'soups', 'atom')
+        self.assertIn('<title>A</title>', atom)
+        self.assertNotIn('<title>B</title>', atom)
+        self.assertEqual(self.client.get(reverse('recipeFeed', args=['json'])).status_code, 404)
+
+    def test_only_changed_feeds_are_rewritten(self):
+        salads = Category.objects.create(name='Salads')
+        self.recipes[1].category.add(salads)
+        self.assertEqual(sitemaps.build()['feeds'], 6)
+        # una ricetta di Soups: il suo feed e quello di tutte le ricette
+        first = self.recipes[0]
+        first.title = 'A2'
+        first.save()
+        self.assertEqual(sitemaps.build()['feeds'], 4)
+        self.assertIn('<title>A2</title>', self.content('categoryFeed', 'soups', 'atom'))
+        # il nome della categoria compare nel feed
+        salads.name = 'Green salads'
+        salads.save()
+        self.assertEqual(sitemaps.build()['feeds'], 2)
+        # una ricetta tolta dalla categoria: è anche una modifica della ricetta, quindi pure il feed generale
+        salads.recipe_set.clear()
+        self.assertEqual(sitemaps.build()['feeds'], 4)
+        # un file mancante viene riscritto anche se non è cambiato niente
+        os.remove(os.path.join(self.root, sitemaps.feed_name('rss', 'soups')))
+        self.assertEqual(sitemaps.build()['feeds'], 2)
+        self.assertEqual(sitemaps.build()['feeds'], 0)
+
+
+class RecommendationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(username=f'cook{i}') for i in range(3)]
+        cls.category = Category.objects.create(name='Soups')
+        cls.a, cls.b, cls.c, cls.d, cls.e = [
+            Recipe.objects.create(title=title, description='d', content='c', author=cls.users[0], portions=1,
+                                  cooking_time=1) for title in 'ABCDE']
+        cls.e.category.add(cls.category)
+        cls.a.category.add(cls.category)
+        for user, recipes in zip(cls.users, [(cls.a, cls.b), (cls.a, cls.b, cls.c), (cls.c, cls.d)]):
+            for recipe in recipes:
+                Like.objects.create(user=user, recipe=recipe)
+
+    def similar(self, recipe):
+        return list(RecipeSimilarity.objects.filter(recipe=recipe).order_by('rank').values_list('similar__title',
+                                                                                                'score'))
+
+    def test_build_and_incremental_update(self):
+        self.assertEqual(recommendations.build(full=True), 4)
+        self.assertEqual(self.similar(self.a), [('B', 1.0), ('C', 0.5)])
+        self.assertEqual(self.similar(self.d), [('C', 1 / 2 ** 0.5)])
+
+        self.d.toggle_like(self.users[0])
+        self.assertEqual(recommendations.build(), 4)
+        self.assertEqual([title for title, score in self.similar(self.a)], ['B', 'C', 'D'])
+        self.assertEqual(recommendations.build(), 0)
+
+    def test_detail_page_falls_back_to_the_category(self):
+        recommendations.build(full=True)
+        with self.assertNumQueries(2):
+            similar = recommendations.for_recipe(self.a)
+        self.assertEqual([recipe.title for recipe in similar], ['B', 'C', 'E'])
+        response = self.client.get(reverse('recipesDetail', args=[self.a.slug]))
+        self.assertEqual(response.context['recommendations'], similar)
+
+
+class FacetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cook')
+        cls.vegetarian, cls.soups, cls.quick = [Category.objects.create(name=name)
+                                                for name in ('Vegetarian', 'Soups', 'Quick')]
+        cls.recipes = [Recipe.objects.create(title=title, description='d', content='c', author=cls.user, portions=1,
+                                             difficulty=difficulty, cooking_time=minutes)
+                       for title, difficulty, minutes in [('A', 2, 20), ('B', 2, 45), ('C', 4, 10), ('D', 1, 90)]]
+        a, b, c, d = cls.recipes
+        a.category.add(cls.vegetarian, cls.soups)
+        b.category.add(cls.vegetarian)
+        cls.soups.recipe_set.add(c, d)
+
+    def assertCubeIsCurrent(self):
+        cube = {(row.selected, row.category, row.difficulty, row.time_bucket): row.recipes
+                for row in FacetCount.objects.exclude(recipes=0)}
+        self.assertEqual(cube, dict(facets.delta({}, facets.load())))
+
+    def test_counts_follow_every_change(self):
+        a, b, c, d = self.recipes
+        self.assertCubeIsCurrent()
+        b.category.set([self.soups, self.quick])
+        self.soups.recipe_set.remove(a, b)
+        self.quick.recipe_set.clear()
+        a.cooking_time = 5
+        a.save()
+        d.delete()
+        self.assertCubeIsCurrent()
+        self.vegetarian.delete()
+        RecipeImporter(default_author='cook').run([
+            {'title': 'E', 'portions': 1, 'cooking_time': 30, 'difficulty': 2, 'categories': ['Soups', 'Salads']}])
+        self.assertCubeIsCurrent()
+
+    def test_browse_combines_facets(self):
+        response = self.client.get(reverse('browse'), {'category': 'vegetarian', 'difficulty': '2', 'time': '30'})
+        self.assertEqual([recipe.title for recipe in response.context['recipes']], ['A'])
+        groups = dict(response.context['facets']['groups'])
+        self.assertEqual(response.context['facets']['total'], 1)
+        self.assertEqual({option['label']: option['count'] for option in groups['Categories']},
+                         {'Soups': 1, 'Vegetarian': 1})
+        self.assertEqual([option['count'] for option in groups['Difficulty']], [0, 1, 0, 0, 0])
+        self.assertEqual([option['count'] for option in groups['Cooking time']], [0, 1, 2])
+
+        # due categorie: conteggi calcolati sull'intersezione, stesso risultato
+        response = self.client.get(reverse('categoryDetail', args=['soups']), {'category': 'vegetarian'})
+        self.assertEqual([recipe.title for recipe in response.context['recipes']], ['A'])
+        groups = dict(response.context['facets']['groups'])
+        self.assertEqual([option['count'] for option in groups['Cooking time']], [0, 1, 1])
+        self.assertIn('category=soups&amp;category=vegetarian&amp;difficulty=2', response.content.decode())
+
+        response = self.client.get(reverse('categories'))
+        self.assertEqual([(category.name, category.recipe_count) for category in response.context['categories']],
+                         [('Vegetarian', 2), ('Soups', 3), ('Quick', 0)])
+
+
+class PageCacheTest(TestCase):
+    # le pagine anonime vengono servite dalla cache finché una modifica non invalida il loro namespace
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cook', password='secret-pass')
+        cls.recipe = Recipe.objects.create(title='Soup', description='Hot soup', content='Boil it',
+                                           author=cls.user, portions=2, cooking_time=10)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_pages_are_cached(self):
+        url = reverse('recipesDetail', kwargs={'slug': self.recipe.slug})
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Hot soup')
+        self.assertEqual(get_stats()['page'], {'hits': 1, 'misses': 1})
+
+    def test_changes_invalidate_pages(self):
+        home = reverse('home')
+        detail = reverse('recipesDetail', kwargs={'slug': self.recipe.slug})
+        self.client.get(home)
+        self.client.get(detail)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.toggle_like(self.user)
+        self.assertContains(self.client.get(home), 'Likes: 1')
+        self.assertContains(self.client.get(detail), '<span id="likeCount">1</span>', html=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(recipe=self.recipe, name='Carrot', quantity='2')
+        self.assertContains(self.client.get(detail), 'Carrot')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.category.add(Category.objects.create(name='Winter'))
+        self.assertContains(self.client.get(detail), 'Winter')
+
+    def test_logged_in_users_bypass_the_cache(self):
+        self.client.get(reverse('home'))
+        self.client.login(username='cook', password='secret-pass')
+        self.assertContains(self.client.get(reverse('home')), 'Logout')
+
+    def test_deploy_check_requires_a_shared_cache(self):
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        redis = {'default': {'BACKEND': 'recipes.cache_backends.RedisCache'}}
+        with override_settings(DEBUG=False, CACHES=locmem):
+            self.assertEqual([error.id for error in checks.check_shared_cache(None)], ['recipes.E001'])
+        with override_settings(DEBUG=True, CACHES=locmem):
+            self.assertEqual(checks.check_shared_cache(None), [])
+        with override_settings(DEBUG=False, CACHES=redis):
+            self.assertEqual(checks.check_shared_cache(None), [])
+
+    @override_settings(CACHES=REDIS_CACHES)
+    def test_deploy_check_requires_redis_to_evict(self):
+        self.assertEqual([warning.id for warning in checks.check_cache_eviction(None)], ['recipes.W001'])
+        with mock.patch.object(FakeRedis, 'policy', 'allkeys-lru'):
+            self.assertEqual(checks.check_cache_eviction(None), [])
+        with mock.patch.object(FakeRedis, 'config_get', side_effect=ConnectionError):
+            self.assertEqual([warning.id for warning in checks.check_cache_eviction(None)], ['recipes.W002'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual(checks.check_cache_eviction(None), [])
+
+    def test_entries_expire_with_the_default_timeout(self):
+        # la scadenza libera le voci invalidate, che nessuno cancella
+        with override_settings(CACHES={'default': {**REDIS_CACHES['default'], 'TIMEOUT': 3600}}):
+            self.client.get(reverse('home'))
+            ttls = cache._client.ttls
+        ttls = [(key.split(':')[2], ttl) for key, ttl in ttls.items()]
+        self.assertEqual({(kind, ttl) for kind, ttl in ttls if kind in ('page', 'ns')}, {('page', 3600), ('ns', 3600)})
+
+
+class RecipeCardTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cook', password='secret-pass')
+        self.recipe = Recipe.objects.create(title='Soup', description='Hot soup ' * 20, content='Boil it',
+                                            author=self.user, portions=2, cooking_time=10)
+        self.client.login(username='cook', password='secret-pass')
+
+    def test_cards_are_memoized_per_version(self):
+        url = reverse('recipesDetail', kwargs={'slug': self.recipe.slug})
+        self.assertEqual(self.recipe.get_absolute_url(), url)
+        first = self.client.get(reverse('recipes'))
+        self.assertContains(first, f'href="{url}"', count=2)
+        # l'estratto troncato come faceva truncatewords:10
+        self.assertContains(first, 'Hot soup Hot soup Hot soup Hot soup Hot soup …')
+        second = self.client.get(reverse('recipes'))
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(get_stats()['card'], {'hits': 1, 'misses': 1})
+
+        # il like cambia updated_at e il cuore: la card viene rifatta
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.toggle_like(self.user)
+        self.assertContains(self.client.get(reverse('recipes')), 'In your favourites')
+        self.assertEqual(get_stats()['card'], {'hits': 1, 'misses': 2})
+
+    def test_cards_expire_with_the_default_timeout(self):
+        # ogni modifica lascia la card della versione vecchia, che deve poter scadere
+        with override_settings(CACHES={'default': {**REDIS_CACHES['default'], 'TIMEOUT': 3600}}):
+            self.client.get(reverse('recipes'))
+            ttls = cache._client.ttls
+        self.assertEqual({ttl for key, ttl in ttls.items() if key.split(':')[2] == 'card'}, {3600})
+
+    def test_render_benchmark(self):
+        result = benchmark.render_cards(cards=5, iterations=2, warmup=1)
+        self.assertEqual(result['cards'], 1)
+        self.assertEqual(set(result['templates']), {'inline', 'component', 'memoized'})
+
+
+class FakeRedis:
+    # stub in memoria dei comandi Redis usati da RedisCache; le scadenze vengono solo registrate
+    policy = 'noeviction'
+
+    def __init__(self, url):
+        self.data = {}
+        self.ttls = {}
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        self.ttls[key] = ex
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def incrby(self, key, delta):
+        self.data[key] = str(int(self.data[key]) + delta).encode()
+        return int(self.data[key])
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+    def persist(self, key):
+        return key in self.data
+
+    def flushdb(self):
+        self.data.clear()
+
+    def config_get(self, pattern):
+        return {'maxmemory-policy': self.policy}
+
+
+class RedisCacheTest(TestCase):
+    def setUp(self):
+        self.cache = RedisCache('redis://localhost:6379/0', {'OPTIONS': {'CLIENT_FACTORY': 'recipes.tests.FakeRedis'}})
+
+    def test_roundtrip(self):
+        self.cache.set('page', (b'<html>', 'text/html'), None)
+        self.assertEqual(self.cache.get('page'), (b'<html>', 'text/html'))
+        self.assertFalse(self.cache.add('page', 'other'))
+        self.assertEqual(self.cache.get_many(['page', 'missing']), {'page': (b'<html>', 'text/html')})
+        self.cache.delete('page')
+        self.assertIsNone(self.cache.get('page'))
+
+    def test_incr(self):
+        self.cache.set('version', 1, None)
+        self.assertEqual(self.cache.incr('version'), 2)
+        self.assertEqual(self.cache.get('version'), 2)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
@@ -1,20 +1,40 @@
 from django.urls import path
-from .views import (RecipeListView, RecipeDeleteView, RecipeDetailView,
-                    RecipeSearchView, CreateRecipeView, CreateIngredientView)
-from . import views as recipe_views
+from .views import (RecipeDeleteView, RecipeDetailView,
+                    RecipeSearchView, CreateRecipeView, UpdateRecipeView, CreateIngredientView)
+from . import api, sitemaps, views as recipe_views
 urlpatterns = [
     path('', recipe_views.HomeView, name='home'),
     path('search/', RecipeSearchView.as_view(), name='recipeSearch'),
-    path('recipes/', RecipeListView.as_view(), name='recipes'),
+    path('recipes/', recipe_views.recipe_list, name='recipes'),
     path('recipes/create/', CreateRecipeView.as_view(), name='recipesCreate'),
     path('recipes/create/ingredients/<int:pk>', CreateIngredientView.as_view(), name='recipesCreateIngredient'),
     path('recipes/create/ingredients/<int:pk>/delete/', recipe_views.delete_ingredient, name='recipesDeleteIngredient'),
     path('recipes/<slug:slug>/', RecipeDetailView.as_view(), name='recipesDetail'),
+    path('recipes/<slug:slug>/edit/', UpdateRecipeView.as_view(), name='recipesUpdate'),
     path('recipes/<slug:slug>/delete/', RecipeDeleteView.as_view(), name='recipesDelete'),
     path('favourites/', recipe_views.favorite_recipes_list, name='favourites'),
     path('categories/', recipe_views.category_list, name='categories'),
+    path('browse/', recipe_views.browse_recipes, name='browse'),
     path('categories/<slug:slug>/', recipe_views.category_detail, name='categoryDetail'),
     path('myRecipes/', recipe_views.user_recipes_list, name='myRecipes'),
+    path('leaderboard/', recipe_views.leaderboard_view, name='leaderboard'),
+    path('stats/requests/', recipe_views.request_stats, name='requestStats'),
+    path('whatCanICook/', recipe_views.what_can_i_cook, name='whatCanICook'),
     path('favourities/<int:pk>/', recipe_views.addFavoriteRecipe, name='editFavorite'),
+    path('recipes/<int:pk>/like/', recipe_views.toggle_like, name='toggleLike'),
+
+    # API JSON in sola lettura (recipes.api)
+    path('api/recipes/', api.recipe_list, name='apiRecipes'),
+    path('api/recipes/<slug:slug>/', api.recipe_detail, name='apiRecipeDetail'),
+    path('api/categories/', api.category_list, name='apiCategories'),
+    path('api/categories/<slug:slug>/recipes/', api.category_recipes, name='apiCategoryRecipes'),
+    path('api/favourites/', api.favourites, name='apiFavourites'),
+
+    # sitemap e feed precalcolati per i crawler (recipes.sitemaps)
+    path('sitemap.xml', sitemaps.sitemap_index_view, name='sitemap'),
+    path('sitemap-pages.xml', sitemaps.sitemap_pages_view, name='sitemapPages'),
+    path('sitemap-recipes-<int:shard>.xml', sitemaps.sitemap_recipes_view, name='sitemapRecipes'),
+    path('feeds/recipes.<str:kind>', sitemaps.recipe_feed_view, name='recipeFeed'),
+    path('feeds/categories/<slug:slug>.<str:kind>', sitemaps.category_feed_view, name='categoryFeed'),
 
 ]
\ No newline at end of file
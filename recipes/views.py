@@ -1,41 +1,138 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.contrib import messages
-from django.db.models import Count, Q
-from django.http import HttpResponseRedirect
+from django.db import transaction
+from django.http import Http404, HttpResponseNotAllowed, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from .forms import RecipeForm, IngredientForm
-from .models import Recipe, Category, Ingredient
+from .caching import CATEGORIES, RECIPES, RECOMMENDATIONS, cache_anonymous_page, recipe_namespace
+from .db import replica_reads
+from .forms import RecipeForm, IngredientForm, IngredientFormSet
+from . import facets, instrumentation, leaderboard, liked, recommendations
+from .models import LIKED_ORDERING, Recipe, Category, Ingredient
+from .pagination import KeysetPaginationMixin, paginate_keyset
+from .matching import match_recipes, parse_ingredients
+from .search import search_recipes
+from .signals import ingredients_changed
 
 
 # Create your views here.
-class RecipeListView(ListView):
-    model = Recipe
-    context_object_name = 'recipes'
-    template_name = 'recipes/allRecipes.html'
-    ordering = ['-date_posted']
 
+# Le viste degli elenchi e il like sono async e la catena dei middleware è tutta async-capable, così sotto
+# ASGI la richiesta non passa da un thread all'altro a ogni strato. Query e rendering (card in cache,
+# context processor) sono lavoro sincrono e vanno in sync_to_async, in un solo passaggio per pagina.
+# Con Django 3.2 il codice sincrono thread-sensitive di un processo gira tutto in un unico thread: ASGI non
+# aumenta il throughput rispetto a WSGI (bench_server lo misura), si scala con il numero di worker.
+async def load_user(request):
+    # request.user è lazy e la prima lettura va sul database (sessione e utente)
+    request.user = await sync_to_async(get_user)(request)
+    return request.user
 
-def HomeView(request):
-    mostLikedRecipes = Recipe.objects.annotate(likeCount=Count('likes')).order_by('-likeCount')[:4]
-    recentRecipes = Recipe.objects.order_by('-date_posted')[:4]
-    return render(request, 'recipes/home.html', {'mostLiked': mostLikedRecipes, 'recent': recentRecipes})
+
+def _render_keyset_page(request, template_name, queryset, context, ordering):
+    page = paginate_keyset(request, queryset, ordering=ordering)
+    return render(request, template_name, dict(context or {}, recipes=page.object_list, page_obj=page))
+
+
+async def render_keyset_page(request, template_name, queryset, context=None, ordering=('-date_posted', '-id')):
+    return await sync_to_async(_render_keyset_page)(request, template_name, queryset, context, ordering)
 
 
-class CreateRecipeView(LoginRequiredMixin, CreateView):
+@replica_reads
+async def recipe_list(request):
+    return await render_keyset_page(request, 'recipes/allRecipes.html', Recipe.objects.for_cards())
+
+
+@replica_reads
+@cache_anonymous_page(RECIPES)
+def HomeView(request):
+    # le classifiche sono colonne indicizzate mantenute dai signal dei like: i primi 4 si leggono dall'indice
+    mostLikedRecipes = Recipe.objects.for_cards().leaderboard(leaderboard.ALL_TIME)[:4]
+    trendingRecipes = Recipe.objects.for_cards().leaderboard(leaderboard.TRENDING)[:4]
+    recentRecipes = Recipe.objects.for_cards().order_by('-date_posted')[:4]
+    return render(request, 'recipes/home.html', {'mostLiked': mostLikedRecipes, 'trending': trendingRecipes,
+                                                 'recent': recentRecipes})
+
+
+LEADERBOARD_SIZE = 24
+LEADERBOARD_TITLES = {
+    leaderboard.ALL_TIME: 'All time',
+    leaderboard.WEEKLY: 'This week',
+    leaderboard.TRENDING: 'Trending',
+}
+
+
+@replica_reads
+@cache_anonymous_page(RECIPES)
+def leaderboard_view(request):
+    board = request.GET.get('board', leaderboard.TRENDING)
+    if board not in leaderboard.BOARDS:
+        board = leaderboard.TRENDING
+    recipes = Recipe.objects.for_cards().leaderboard(board)[:LEADERBOARD_SIZE]
+    return render(request, 'recipes/leaderboard.html', {'recipes': recipes, 'board': board,
+                                                        'boards': LEADERBOARD_TITLES.items()})
+
+
+class RecipeFormsetMixin:
+    # ricetta e ingredienti nello stesso form: un solo POST, salvato in un'unica transazione
     model = Recipe
     form_class = RecipeForm
 
-    def form_valid(self, form):
-        form.instance.author = self.request.user
-        self.object = form.save()
-        return super().form_valid(form)
+    def get_formset(self):
+        if self.request.method == 'POST':
+            return IngredientFormSet(self.request.POST, instance=self.object)
+        return IngredientFormSet(instance=self.object)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.setdefault('formset', self.get_formset())
+        return context
+
+    def post(self, request, *args, **kwargs):
+        form = self.get_form()
+        formset = self.get_formset()
+        if not (form.is_valid() and formset.is_valid()):
+            return self.render_to_response(self.get_context_data(form=form, formset=formset))
+        with transaction.atomic():
+            self.object = form.save()
+            formset.instance = self.object
+            formset.save()
+            if formset.has_saved_changes():
+                ingredients_changed([self.object.pk])
+        messages.success(request, 'Your recipe has been successfully saved.')
+        return redirect(self.get_success_url())
 
     def get_success_url(self):
-        pk = self.object.pk
-        return reverse_lazy('recipesCreateIngredient', kwargs={'pk': self.object.pk})
+        return reverse_lazy('recipesDetail', kwargs={'slug': self.object.slug})
+
+
+class CreateRecipeView(LoginRequiredMixin, RecipeFormsetMixin, CreateView):
+    def post(self, request, *args, **kwargs):
+        self.object = None
+        return super().post(request, *args, **kwargs)
+
+    def get_form(self, form_class=None):
+        form = super().get_form(form_class)
+        form.instance.author = self.request.user
+        return form
+
+
+class UpdateRecipeView(LoginRequiredMixin, UserPassesTestMixin, RecipeFormsetMixin, UpdateView):
+    slug_field = 'slug'
+    slug_url_kwarg = 'slug'
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        return super().post(request, *args, **kwargs)
+
+    def test_func(self):
+        return self.request.user == self.get_object().author
 
 
 class CreateIngredientView(LoginRequiredMixin, CreateView):
@@ -73,6 +170,8 @@ class CreateIngredientView(LoginRequiredMixin, CreateView):
             return reverse_lazy('recipesCreateIngredient', kwargs={'pk': self.recipe.pk})
 
 
+@replica_reads
+@method_decorator(cache_anonymous_page(recipe_namespace, CATEGORIES, RECOMMENDATIONS), name='dispatch')
 class RecipeDetailView(DetailView):
     model = Recipe
     template_name = 'recipes/detailRecipe.html'
@@ -83,6 +182,8 @@ class RecipeDetailView(DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['ingredients'] = Ingredient.objects.filter(recipe=self.object)
+        context['is_liked'] = self.object.pk in liked.liked_recipes(self.request.user)
+        context['recommendations'] = recommendations.for_recipe(self.object)
         return context
 
 
@@ -97,12 +198,13 @@ class RecipeDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         return False
 
 
-# mostra le ricette preferite
-@login_required
-def favorite_recipes_list(request):
-    user = request.user
-    fav_recipes = user.likes.all()
-    return render(request, 'recipes/likeRecipe.html', {'recipes': fav_recipes})
+# mostra le ricette preferite, dall'ultimo like al primo
+async def favorite_recipes_list(request):
+    user = await load_user(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    return await render_keyset_page(request, 'recipes/likeRecipe.html', Recipe.objects.for_cards().liked_by(user),
+                                    ordering=LIKED_ORDERING)
 
 
 # funzione per aggiungere o rimuovere una ricetta dai preferiti
@@ -112,48 +214,85 @@ def addFavoriteRecipe(request, pk):
     recipe = get_object_or_404(Recipe, pk=pk)
 
     if request.method == "POST":
-        if recipe.likes.filter(pk=user.pk).exists():
-            recipe.likes.remove(user)
-            messages.success(request, f'Recipe {recipe.title} has been removed from favorites')
-        else:
-            recipe.likes.add(user)
+        if recipe.toggle_like(user):
             messages.success(request, f'Recipe {recipe.title} has been added to favorites')
+        else:
+            messages.success(request, f'Recipe {recipe.title} has been removed from favorites')
 
     return redirect('recipesDetail', slug=recipe.slug)
 
 
+# stesso toggle in JSON per il pulsante della pagina di dettaglio, senza ricaricare la pagina
+async def toggle_like(request, pk):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    user = await load_user(request)
+    if not user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication required.'}, status=403)
+    try:
+        recipe = await sync_to_async(Recipe.objects.only('pk', 'slug').get)(pk=pk)
+    except Recipe.DoesNotExist:
+        raise Http404('No recipe found')
+    liked = await sync_to_async(recipe.toggle_like)(user)
+    return JsonResponse({'liked': liked, 'like_count': recipe.like_count})
+
+
 @login_required
 def user_recipes_list(request):
-    return render(request, 'recipes/userRecipes.html', {'recipes': Recipe.objects.filter(author=request.user)})
+    return render(request, 'recipes/userRecipes.html', {'recipes': Recipe.objects.for_cards().filter(author=request.user)})
 
 
-# mostra tutte le categorie presenti
+# mostra tutte le categorie presenti, con il numero di ricette (dal cubo di recipes.facets)
+@replica_reads
+@cache_anonymous_page(CATEGORIES, RECIPES)
 def category_list(request, ):
-    categories = Category.objects.all()
+    categories = list(Category.objects.all())
+    counts = facets.category_counts()
+    for category in categories:
+        category.recipe_count = counts[category.pk]
     return render(request, 'recipes/categories.html', {'categories': categories})
 
 
-# mostra le ricette presenti in una categoria
-def category_detail(request, slug):
-    categories = get_object_or_404(Category, slug=slug)
-    recipes = Recipe.objects.filter(category=categories)
-    return render(request, 'recipes/RecipesForCategories.html', {"categories": categories, "recipes": recipes})
+async def render_facets(request, context=None, base=None):
+    # ricette filtrate dalle faccette scelte nella querystring, con i conteggi di ogni opzione
+    selection = await sync_to_async(facets.Selection.from_query)(request.GET, base)
+    options = await sync_to_async(facets.options)(selection)
+    return await render_keyset_page(request, 'recipes/RecipesForCategories.html',
+                                    selection.filter(Recipe.objects.for_cards()),
+                                    dict(context or {}, facets=options, selection=selection))
+
+
+# mostra le ricette presenti in una categoria, filtrabili con le altre faccette
+@replica_reads
+@cache_anonymous_page(RECIPES, CATEGORIES)
+async def category_detail(request, slug):
+    categories = await sync_to_async(get_object_or_404)(Category, slug=slug)
+    return await render_facets(request, {"categories": categories}, base=categories)
+
+
+# navigazione a faccette: categorie, difficoltà e tempo combinabili (recipes.facets)
+@replica_reads
+@cache_anonymous_page(RECIPES, CATEGORIES)
+async def browse_recipes(request):
+    return await render_facets(request)
 
 
-# implementa la ricerca per titolo
-class RecipeSearchView(ListView):
+# ricerca full-text su titolo, descrizione, ingredienti e categorie, ordinata per rilevanza (recipes.search)
+@replica_reads
+class RecipeSearchView(KeysetPaginationMixin, ListView):
     model = Recipe
     template_name = 'recipes/recipe_search.html'
     context_object_name = 'recipes'
 
     def get_queryset(self):
-        queryset = Recipe.objects.all()
-        query = self.request.GET.get('q')
-        if query:
-            queryset = queryset.filter(
-                Q(title__icontains=query)
-            )
-        return queryset
+        return Recipe.objects.for_cards()
+
+    def paginate_queryset(self, queryset, page_size):
+        query = self.request.GET.get('q', '').strip()
+        if not query:
+            return super().paginate_queryset(queryset, page_size)
+        page = search_recipes(self.request, queryset, query, page_size)
+        return None, page, page.object_list, page.has_other_pages()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -161,6 +300,22 @@ class RecipeSearchView(ListView):
         return context
 
 
+# "cosa posso cucinare": ricette ordinate per quanti dei loro ingredienti l'utente ha già (recipes.matching)
+def what_can_i_cook(request):
+    text = request.GET.get('ingredients', '')
+    names = parse_ingredients(text)
+    results = []
+    if names:
+        matches = match_recipes(names)
+        recipes = Recipe.objects.for_cards().in_bulk([recipe_id for recipe_id, matched, total in matches])
+        for recipe_id, matched, total in matches:
+            if recipe_id in recipes:
+                recipe = recipes[recipe_id]
+                recipe.matched, recipe.total = matched, total
+                results.append(recipe)
+    return render(request, 'recipes/whatCanICook.html', {'recipes': results, 'ingredients': text})
+
+
 # elimina gli ingredienti
 @login_required
 def delete_ingredient(request, pk):
@@ -175,3 +330,12 @@ def delete_ingredient(request, pk):
     messages.success(request, 'Ingredient has been successfully deleted.')
     return redirect('recipesCreateIngredient', pk=recipe.pk)  # Reindirizza alla pagina di aggiornamento della
     # ricetta
+
+
+# misure delle richieste (recipes.instrumentation) del processo che risponde, o di tutti i processi con ?all=1
+@staff_member_required
+def request_stats(request):
+    all_processes = bool(request.GET.get('all'))
+    snapshot = instrumentation.collect() if all_processes else instrumentation.stats.snapshot()
+    return render(request, 'recipes/requestStats.html', {'rows': instrumentation.summarize(snapshot),
+                                                         'all_processes': all_processes})
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, \
+    teardown_test_environment
+from django.urls import reverse
+from PIL import Image
+
+# hasher delle password confrontati: quello vecchio e veloce (MD5) e quelli del progetto (PBKDF2 per primo)
+HASHERS = {
+    'old': ['django.contrib.auth.hashers.MD5PasswordHasher'],
+    'new': None,
+}
+
+
+def resave_profile(sender, instance, **kwargs):
+    # il comportamento precedente, per la colonna "before": ogni salvataggio dello User (anche last_login a ogni
+    # login) riscriveva il profilo e riapriva l'immagine con PIL, riducendola se più grande di 300 pixel
+    instance.profile.save()
+    with Image.open(instance.profile.image.path) as img:
+        if img.height > 300 or img.width > 300:
+            img.thumbnail((300, 300))
+            img.save(instance.profile.image.path)
+
+
+# misura il throughput del login reale (POST su LoginView) su un database di test usa e getta, affiancando
+# profilo riscritto a ogni login (before) o no (after) e hasher delle password vecchi e nuovi
+class Command(BaseCommand):
+    help = 'Benchmark login throughput and queries per login on a throwaway test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200)
+        parser.add_argument('--image-size', type=int, default=1200,
+                            help='Side in pixels of the synthetic profile picture of the benchmark user.')
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp()
+        shutil.copy(os.path.join(settings.MEDIA_ROOT, 'default.jpg'), media_root)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stdout.write(f'{"profile":<10}{"hashers":<10}{"logins/s":>10}{"ms/login":>10}{"queries/login":>15}')
+            for hashers, hasher_list in HASHERS.items():
+                for profile in ('before', 'after'):
+                    with override_settings(MEDIA_ROOT=media_root, BACKGROUND_TASKS_EAGER=True,
+                                           PASSWORD_HASHERS=hasher_list or settings.PASSWORD_HASHERS):
+                        if profile == 'before':
+                            post_save.connect(resave_profile, sender=User)
+                        try:
+                            result = self.run_benchmark(media_root, f'{profile}-{hashers}', options['logins'],
+                                                        options['image_size'])
+                        finally:
+                            post_save.disconnect(resave_profile, sender=User)
+                    self.stdout.write(f'{profile:<10}{hashers:<10}{result[0]:>10.1f}{result[1]:>10.2f}'
+                                      f'{result[2]:>15.1f}')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+    def run_benchmark(self, media_root, name, logins, image_size):
+        # un utente e un'immagine nuovi per ogni configurazione: "before" riduce l'immagine sul disco
+        user = User.objects.create_user(username=name, password='bench-password')
+        Image.new('RGB', (image_size, image_size), 'orange').save(f'{media_root}/{name}.jpg')
+        user.profile.image = f'{name}.jpg'
+        user.profile.save()
+
+        url = reverse('login')
+        data = {'username': name, 'password': 'bench-password'}
+        queries = 0
+        start = time.perf_counter()
+        for _ in range(logins):
+            client = Client()
+            with CaptureQueriesContext(connection) as ctx:
+                response = client.post(url, data)
+            assert response.status_code == 302, response.status_code
+            queries += len(ctx.captured_queries)
+        elapsed = time.perf_counter() - start
+        return logins / elapsed, elapsed * 1000 / logins, queries / logins
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='image_avatar',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='image_processed',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_profile_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='image',
+            field=models.ImageField(db_index=True, default='default.jpg', upload_to='profilePics'),
+        ),
+    ]
@@ -1,12 +1,18 @@
-from PIL import Image
 from django.db import models
 from django.contrib.auth.models import User
 
+from recipes.images import rendition_url, schedule_image_processing
+
 
 # Create your models here.
 class Profile(models.Model):
+    # rendition generate in background (recipes.images): campo -> lato massimo in pixel
+    RENDITIONS = {'image_avatar': 100}
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    image = models.ImageField(default='default.jpg', upload_to='profilePics')
+    image = models.ImageField(default='default.jpg', upload_to='profilePics', db_index=True)
+    image_avatar = models.CharField(max_length=255, blank=True, editable=False)
+    # immagine sorgente da cui è stata generata la rendition: l'elaborazione riparte solo quando cambia
+    image_processed = models.CharField(max_length=255, blank=True, editable=False)
 
     def __str__(self):
         return f'{self.user.username} Profile'
@@ -14,9 +20,8 @@ class Profile(models.Model):
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
 
-        img = Image.open(self.image.path)
+        schedule_image_processing(self)
 
-        if img.height > 300 or img.width > 300:
-            output_size = (300, 300)
-            img.thumbnail(output_size)
-            img.save(self.image.path)
\ No newline at end of file
+    @property
+    def avatar_url(self):
+        return rendition_url(self, 'image_avatar')
\ No newline at end of file
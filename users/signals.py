@@ -1,15 +1,31 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
+from recipes import storage
 from .models import Profile
 
 
+# il profilo viene creato insieme all'utente; gli altri salvataggi dello User (es. last_login a ogni login)
+# non toccano il profilo, che si salva da solo quando cambia (vedi users.views.profile)
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
 
 
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
+# l'avatar sostituito o quello di un profilo cancellato viene eliminato se nessun altro lo usa (recipes.storage)
+@receiver(pre_save, sender=Profile)
+def remember_profile_image(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw:
+        storage.remember_image(instance, update_fields)
+
+
+@receiver(post_save, sender=Profile)
+def release_replaced_profile_image(sender, instance, raw=False, **kwargs):
+    if not raw:
+        storage.release_replaced_image(instance)
+
+
+@receiver(post_delete, sender=Profile)
+def release_profile_image(sender, instance, **kwargs):
+    storage.release([instance.image.name])
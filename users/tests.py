@@ -1,3 +1,39 @@
-from django.test import TestCase
+import os
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .models import Profile
+
+OLD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+NEW_HASHERS = ['django.contrib.auth.hashers.PBKDF2PasswordHasher', 'django.contrib.auth.hashers.MD5PasswordHasher']
+
 
 # Create your tests here.
+class LoginTest(TestCase):
+    def test_old_hash_logs_in_and_is_upgraded(self):
+        with override_settings(PASSWORD_HASHERS=OLD_HASHERS):
+            user = User.objects.create_user(username='cook', password='secret-pass')
+        self.assertTrue(user.password.startswith('md5$'))
+
+        with override_settings(PASSWORD_HASHERS=NEW_HASHERS), mock.patch.object(Profile, 'save') as profile_save:
+            response = self.client.post(reverse('login'), {'username': 'cook', 'password': 'secret-pass'})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$'))
+        self.assertIsNotNone(user.last_login)
+        # né il nuovo hash né last_login riscrivono il profilo
+        profile_save.assert_not_called()
+
+
+class ProfileImageTest(TestCase):
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_renditions_are_written_outside_the_project_media(self):
+        User.objects.create_user(username='cook')
+        self.assertTrue(default_storage.exists('renditions/default-100.webp'))
+        self.assertNotEqual(settings.MEDIA_ROOT, os.path.join(settings.BASE_DIR, 'media'))
+        self.assertFalse(os.path.exists(os.path.join(settings.BASE_DIR, 'media', 'renditions')))